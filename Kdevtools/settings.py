@@ -43,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings and query counts cover the whole stack
+    'mims.middleware.RequestStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,9 +82,33 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep each worker's connection (and its PRAGMAs and page cache) between requests
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Take the write lock at BEGIN: a transaction that started as a reader
+            # cannot upgrade while another till writes and fails with "database is locked"
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
+# One cache for every process on the machine -- the web workers and the nightly
+# management commands -- so rebuild_daily_summary and refresh_stock_alerts
+# invalidate what the server has cached. Closed report buckets are kept with no
+# expiry, hence a cull limit well above the default 300 entries.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache',
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    }
+}
+
+# PRAGMAs set on every SQLite connection, merged over mims.db.DEFAULT_PRAGMAS
+# (WAL, synchronous=NORMAL, busy_timeout, cache_size, mmap_size, temp_store).
+MIMS_SQLITE_PRAGMAS = {}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -126,4 +152,12 @@ LOGIN_REDIRECT_URL = 'dashboard'
 LOGIN_URL = 'login'
 
 # Where to go after logging out
-LOGOUT_REDIRECT_URL = 'login'
\ No newline at end of file
+LOGOUT_REDIRECT_URL = 'login'
+
+# Reject sales that would take a product's stock below zero.
+# Off by default: the shop sometimes sells stock that was received but not yet entered.
+MIMS_PREVENT_OVERSELL = False
+
+# Requests slower than this are logged to the 'mims.performance' logger;
+# every request is kept in the per-view stats at /admin/performance/.
+MIMS_SLOW_REQUEST_MS = 500
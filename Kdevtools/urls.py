@@ -5,6 +5,7 @@ from mims.views import dashboard_view, inventory_list_view
 from django.contrib.auth import views as auth_views
 
 urlpatterns = [
+    path('admin/performance/', views.performance_view, name='performance'),
     path('admin/', admin.site.urls),
     path('dashboard/', dashboard_view, name='dashboard'),
     path('inventory/', inventory_list_view, name='inventory'),
@@ -13,11 +14,18 @@ urlpatterns = [
     path('sales/ledger/', views.sale_ledger_view, name='sale_ledger'),
     path('sales/pay/<int:sale_id>/', views.pay_debt_view, name='pay_debt'),
     path('notifications/', views.notifications_view, name='notifications'),
+    path('notifications/lots/<int:lot_id>/dispose/', views.dispose_lot_view, name='dispose_lot'),
     path('expenses/', views.expense_list_view, name='expense_list'),
     path('login/', auth_views.LoginView.as_view(template_name='mims/login.html'), name='login'),
     path('logout/', auth_views.LogoutView.as_view(next_page='login'), name='logout'),
     path('', auth_views.LoginView.as_view(template_name='mims/login.html'), name='login'),
     path('sale/<int:sale_id>/', views.view_sale_view, name='view_sale'),
+    path('sales/invoices/', views.day_invoices_view, name='day_invoices'),
     path('loans/', views.loans_list_view, name='loans_list'),
+    path('loans/pay/', views.pay_customer_view, name='pay_customer'),
+    path('customers/search/', views.customer_search, name='customer_search'),
+    path('exports/<str:name>/', views.export_view, name='export'),
+    path('reports/financial/', views.financial_report_view, name='financial_report'),
     path('barcode-lookup/', views.barcode_lookup, name='barcode_lookup'),
+    path('products/search/', views.product_search, name='product_search'),
 ]
\ No newline at end of file
@@ -1,8 +1,7 @@
 from django.contrib import admin, messages
-from django.db import models
 from django.utils.html import format_html
 from django.urls import reverse
-from .models import Category, PaymentRecord, Product, Purchase, Sale, SaleItem, Expense, Loan
+from .models import Category, Customer, DailySummary, PaymentRecord, Product, Purchase, Sale, SaleItem, Expense, Loan, StockAlert, StockLot
 
 # --- INLINES (Must be defined first) ---
 
@@ -15,6 +14,18 @@ class PaymentRecordInline(admin.TabularInline):
     extra = 1  # Allows you to add a new payment line easily
     fields = ('date_paid', 'amount_received', 'payment_method', 'note')
 
+class StockLotInline(admin.TabularInline):
+    # Lots move with sales and deliveries; edit stock through purchases or the edit form
+    model = StockLot
+    extra = 0
+    fields = ('received_at', 'expiry_date', 'quantity_received', 'quantity_base', 'purchase')
+    readonly_fields = fields
+    can_delete = False
+    ordering = ('-quantity_base', 'expiry_date')
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 # --- ADMIN CLASSES ---
 
 @admin.register(Category)
@@ -23,10 +34,11 @@ class CategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'category', 'stock_qty', 'base_unit', 'sell_price_per_base')
+    list_display = ('name', 'category', 'stock_boxes', 'stock_base', 'base_unit', 'sell_price_per_base')
     list_filter = ('category',)
     search_fields = ('name',)
-    readonly_fields = ('stock_qty',)
+    readonly_fields = ('stock_base',)
+    inlines = [StockLotInline]
     
     fieldsets = (
         ('Basic Info', {'fields': ('name', 'category')}),
@@ -34,33 +46,62 @@ class ProductAdmin(admin.ModelAdmin):
             'fields': ('bulk_unit', 'base_unit', 'conversion_factor'),
             'description': "Define how many small units are in one bulk box."
         }),
-        ('Pricing & Stock', {'fields': ('buy_price_per_bulk', 'sell_price_per_base', 'stock_qty')}),
+        ('Pricing & Stock', {'fields': ('buy_price_per_bulk', 'sell_price_per_base', 'stock_base')}),
     )
 
 @admin.register(Purchase)
 class PurchaseAdmin(admin.ModelAdmin):
-    list_display = ('product', 'quantity_bulk', 'purchase_date', 'total_cost')
+    list_display = ('product', 'quantity_bulk', 'purchase_date', 'expiry_date', 'total_cost')
     list_filter = ('purchase_date', 'product')
     date_hierarchy = 'purchase_date'
 
+@admin.register(Customer)
+class CustomerAdmin(admin.ModelAdmin):
+    list_display = ('name', 'phone', 'balance')
+    search_fields = ('name', 'phone')
+    readonly_fields = ('balance',)
+
+
 @admin.register(Sale)
 class SaleAdmin(admin.ModelAdmin):
-    list_display = ('id', 'customer_name', 'payment_status', 'total_amount', 'amount_paid', 'due_balance', 'sale_date')
+    list_display = ('id', 'customer_name', 'payment_status', 'total_amount', 'amount_paid', 'balance_due', 'sale_date')
     list_filter = ('payment_status', 'sale_date')
+    raw_id_fields = ('customer',)
     search_fields = ('customer_name',)
     inlines = [SaleItemInline, PaymentRecordInline]
     readonly_fields = ('amount_paid', 'subtotal', 'total_amount')
-    
-    def due_balance(self, obj):
-        balance = obj.total_amount - obj.amount_paid
-        return balance
-    due_balance.short_description = "Balance Due"
 
 @admin.register(Expense)
 class ExpenseAdmin(admin.ModelAdmin):
     list_display = ('description', 'amount', 'date')
     list_filter = ('date',)
 
+@admin.register(DailySummary)
+class DailySummaryAdmin(admin.ModelAdmin):
+    # Maintained automatically; use `manage.py rebuild_daily_summary` to recompute
+    list_display = ('day', 'product', 'revenue', 'cost_of_goods', 'profit', 'cash_collected', 'expenses')
+    list_filter = ('day',)
+    date_hierarchy = 'day'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(StockAlert)
+class StockAlertAdmin(admin.ModelAdmin):
+    # Written by `manage.py refresh_stock_alerts`; edit stock or sales instead
+    list_display = ('product', 'avg_daily_sales', 'reorder_point', 'days_of_cover', 'reorder', 'expiring', 'computed_at')
+    list_filter = ('active', 'reorder', 'expiring')
+    search_fields = ('product__name',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 @admin.register(Loan)
 class LoanAdmin(admin.ModelAdmin):
     # Integrated display including editable payments and invoice links
@@ -74,12 +115,13 @@ class LoanAdmin(admin.ModelAdmin):
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        return qs.filter(total_amount__gt=models.F('amount_paid'))
+        return qs.filter(Loan.outstanding_q())
 
     def balance_due_display(self, obj):
-        amount = obj.balance_due()
+        amount = obj.balance_due
         return format_html('<span style="color: red; font-weight: bold;">${}</span>', amount)
     balance_due_display.short_description = "Outstanding Debt"
+    balance_due_display.admin_order_field = 'balance_due'
 
     def sale_link(self, obj):
         # IMPORTANT: Change 'yourappname' to your actual Django app name
@@ -93,4 +135,4 @@ class LoanAdmin(admin.ModelAdmin):
             obj.payment_status = 'PAID'
         elif obj.amount_paid > 0:
             obj.payment_status = 'PARTIAL'
-        super().save(request, obj, form, change)
\ No newline at end of file
+        super().save_model(request, obj, form, change)
\ No newline at end of file
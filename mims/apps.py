@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class MimsConfig(AppConfig):
     name = 'mims'
+
+    def ready(self):
+        from . import db, signals  # noqa: F401 (connects the receivers)
@@ -0,0 +1,92 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+# Returned by LRUCache.get on a miss, so that None can be cached as a value
+MISSING = object()
+
+
+class LRUCache:
+    """A small thread-safe, size-bounded, least-recently-used cache."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return MISSING
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._pop(key)
+            self._data[key] = value
+            self._stored(key, value)
+            while len(self._data) > self.maxsize:
+                self._dropped(*self._data.popitem(last=False))
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def _pop(self, key):
+        value = self._data.pop(key, MISSING)
+        if value is not MISSING:
+            self._dropped(key, value)
+
+    # Hooks for subclasses keeping their own bookkeeping in step; called with the lock held
+    def _stored(self, key, value):
+        pass
+
+    def _dropped(self, key, value):
+        pass
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class BarcodeCache(LRUCache):
+    """
+    barcode -> serialized barcode_lookup payload, or None for unknown codes.
+    Remembers which barcode each product was cached under so a save can
+    evict the old code even after the barcode itself was edited.
+    """
+
+    def __init__(self, maxsize):
+        super().__init__(maxsize)
+        self._barcode_of = {}
+
+    def _stored(self, key, value):
+        if value is not None:
+            self._barcode_of[value['id']] = key
+
+    def _dropped(self, key, value):
+        if value is not None and self._barcode_of.get(value['id']) == key:
+            del self._barcode_of[value['id']]
+
+    def invalidate_product(self, product):
+        with self._lock:
+            code = self._barcode_of.get(product.pk)
+            if code is not None:
+                self._pop(code)
+            if product.barcode:
+                # A negative entry may exist for the code this product now carries
+                self._pop(product.barcode)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._barcode_of.clear()
+
+
+barcode_cache = BarcodeCache(getattr(settings, 'MIMS_BARCODE_CACHE_SIZE', 5000))
@@ -0,0 +1,136 @@
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Customer, DailySummary, InsufficientStock, Product, Sale, SaleItem, StockLot, business_day
+
+
+class CheckoutError(Exception):
+    """Raised when a basket cannot be turned into a sale."""
+
+
+def parse_basket(names, quantities):
+    """
+    Pairs the product_name[] / quantity[] lists posted by the sale form.
+    Blank names and non-numeric or non-positive quantities are skipped,
+    matching how the form has always treated half-filled rows.
+    """
+    lines = []
+    for name, qty in zip(names, quantities):
+        name = (name or '').strip()
+        try:
+            qty = int(qty)
+        except (TypeError, ValueError):
+            continue
+        if name and qty > 0:
+            lines.append((name, qty))
+    return lines
+
+
+def payment_status_for(total_amount, amount_paid):
+    """Same rules as Sale.update_status, without the extra save."""
+    if amount_paid >= total_amount:
+        return 'PAID'
+    if amount_paid > 0:
+        return 'PARTIAL'
+    return 'LOAN'
+
+
+@transaction.atomic
+def process_checkout(lines, customer_name='', amount_paid=0, sale_date=None, prevent_oversell=None, customer_phone=''):
+    """
+    Turns a basket of (product_name, quantity_base) pairs into a Sale.
+
+    The whole checkout is one transaction with a fixed number of queries,
+    however many lines the basket has:
+      1. one IN lookup for every product in the basket,
+      2. one INSERT for the Sale (totals and status already computed), plus
+         the customer lookup and their running-balance UPDATE,
+      3. one bulk INSERT for the SaleItem rows,
+      4. the same few statements to post the day's DailySummary rows,
+      5. one UPDATE that decrements stock for every product at once,
+      6. one ordered read of those products' open lots and one UPDATE that
+         draws them down first-expiry-first-out (plus one to move
+         Product.expiry_date when a lot runs out).
+
+    Lines naming unknown products are skipped. Raises CheckoutError if
+    nothing sellable is left, if a walk-in customer leaves a balance, or
+    (when oversell protection is on) if a line exceeds the stock on hand.
+    prevent_oversell defaults to settings.MIMS_PREVENT_OVERSELL.
+    Named customers are matched by Customer.name_key (created on first sale).
+    """
+    customer_name = (customer_name or '').strip() or 'Walk-in'
+    amount_paid = Decimal(amount_paid or 0)
+
+    # --- 1. RESOLVE PRODUCTS IN ONE QUERY ---
+    names = {name for name, _ in lines}
+    products = {}
+    for p in Product.objects.filter(name__in=names).order_by('pk'):
+        # Names are not unique; keep the first match like .get() order would
+        products.setdefault(p.name, p)
+
+    items = []
+    sold_per_product = OrderedDict()
+    subtotal = Decimal(0)
+    for name, qty in lines:
+        p = products.get(name)
+        if p is None:
+            continue
+        items.append(SaleItem(
+            product=p, quantity_base=qty,
+            price_at_sale=p.sell_price_per_base, cost_at_sale=p.buy_price_per_bulk,
+        ))
+        sold_per_product[p] = sold_per_product.get(p, 0) + qty
+        subtotal += qty * p.sell_price_per_base
+
+    if not items:
+        raise CheckoutError("No valid items in this sale.")
+
+    # --- 2. TOTALS AND STATUS ONCE ---
+    total_amount = subtotal
+    status = payment_status_for(total_amount, amount_paid)
+    customer = Customer.for_name(customer_name, phone=customer_phone)
+    if status != 'PAID' and customer is None:
+        raise CheckoutError("Customer Name is required for Loan/Partial sales.")
+
+    sale = Sale.objects.create(
+        customer=customer,
+        customer_name=customer.name if customer else customer_name,
+        sale_date=sale_date or timezone.now(),
+        payment_status=status,
+        subtotal=subtotal,
+        total_amount=total_amount,
+        amount_paid=amount_paid,
+    )
+
+    # --- 3. LINE ITEMS (bulk_create skips the per-item SaleItem.save) ---
+    for item in items:
+        item.sale = sale
+    SaleItem.objects.bulk_create(items)
+
+    # --- 4. DAILY SUMMARY (a fixed few statements for any basket size) ---
+    DailySummary.post_lines(
+        business_day(sale.sale_date),
+        [item.line_figures() for item in items],
+        [item.product_id for item in items],
+        totals={'revenue': total_amount, 'cash_collected': amount_paid},
+    )
+
+    # --- 5. SET-BASED STOCK DECREMENT ---
+    if prevent_oversell is None:
+        prevent_oversell = getattr(settings, 'MIMS_PREVENT_OVERSELL', False)
+    try:
+        Product.adjust_stock(
+            {p.pk: -qty for p, qty in sold_per_product.items()},
+            prevent_oversell=prevent_oversell,
+        )
+    except InsufficientStock as e:
+        raise CheckoutError(str(e))
+
+    # --- 6. FEFO LOT ALLOCATION (after 5, whose UPDATE locks these products) ---
+    StockLot.allocate({p.pk: qty for p, qty in sold_per_product.items()})
+
+    return sale
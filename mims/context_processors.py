@@ -1,23 +1,39 @@
+from django.core.cache import cache
 from django.utils import timezone
-from datetime import timedelta
-from .models import Product
+from django.utils.functional import SimpleLazyObject
+from .models import StockAlert
+
+
+def _cache_key(day):
+    # The date is part of the key, so the count rolls over at midnight on its own
+    return f"mims:notification_count:{day.isoformat()}"
+
+
+def get_notification_count():
+    """
+    Number of active StockAlert rows (products to reorder or with stock
+    expiring soon). One COUNT on a partial index, cached until the alerts
+    are refreshed (see signals.py).
+    """
+    today = timezone.localdate()
+    key = _cache_key(today)
+    count = cache.get(key)
+    if count is None:
+        count = StockAlert.active_alerts().count()
+        cache.set(key, count, timeout=None)
+    return count
+
+
+def invalidate_notification_count():
+    cache.delete(_cache_key(timezone.localdate()))
+
 
 def notifications(request):
     """
     Globally provides notification data to all templates.
+    Both values are lazy: pages that never show the badge never compute it.
     """
-    today = timezone.now().date()
-    six_months_from_now = today + timedelta(days=180)
-    
-    # Logic: Stock < 2 OR Expiry Date <= 6 months from today
-    low_stock = Product.objects.filter(stock_qty__lt=2)
-    expiring_soon = Product.objects.filter(expiry_date__lte=six_months_from_now)
-    
-    # Combine unique IDs to avoid double-counting the same product
-    total_ids = set(low_stock.values_list('id', flat=True)) | set(expiring_soon.values_list('id', flat=True))
-    count = len(total_ids)
-    
     return {
-        'notification_count': count,
-        'has_notifications': count > 0
-    }
\ No newline at end of file
+        'notification_count': SimpleLazyObject(get_notification_count),
+        'has_notifications': SimpleLazyObject(lambda: get_notification_count() > 0),
+    }
@@ -0,0 +1,141 @@
+import csv
+import datetime
+import tempfile
+from decimal import Decimal
+
+from django.db.models import DecimalField, ExpressionWrapper, F
+from django.utils import timezone
+
+from .models import Expense, PaymentRecord, Product, Sale, SaleItem, start_of_day
+
+# Rows fetched from the database per round trip while streaming
+CHUNK_SIZE = 2000
+
+CENTS = Decimal('0.01')
+
+
+class Echo:
+    """File-like object whose write() hands the line straight back to csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def _sales():
+    return Sale.objects.values_list(
+        'id', 'sale_date', 'customer_name', 'payment_status', 'subtotal', 'discount_amount',
+        'total_amount', 'amount_paid', 'balance_due',
+    ).order_by('sale_date', 'id')
+
+
+def _sale_items():
+    line_total = ExpressionWrapper(
+        F('quantity_base') * F('price_at_sale'), output_field=DecimalField(max_digits=14, decimal_places=2)
+    )
+    return SaleItem.objects.annotate(line_total=line_total).values_list(
+        'sale_id', 'sale__sale_date', 'product_id', 'product__name', 'quantity_base', 'price_at_sale', 'line_total',
+    ).order_by('sale__sale_date', 'sale_id', 'id')
+
+
+def _payments():
+    return PaymentRecord.objects.values_list(
+        'id', 'sale_id', 'sale__customer_name', 'date_paid', 'amount_received', 'payment_method', 'note',
+    ).order_by('date_paid', 'id')
+
+
+def _expenses():
+    return Expense.objects.values_list('id', 'date', 'description', 'amount').order_by('date', 'id')
+
+
+def _inventory():
+    return Product.objects.annotate(value=Product.stock_value_expression()).values_list(
+        'id', 'name', 'category__name', 'barcode', 'stock_base', 'conversion_factor',
+        'buy_price_per_bulk', 'sell_price_per_base', 'expiry_date', 'value',
+    ).order_by('name', 'id')
+
+
+# name -> (header row, queryset factory, field the ?from=/?to= range applies to)
+EXPORTS = {
+    'sales': (
+        ['Sale ID', 'Date', 'Customer', 'Status', 'Subtotal', 'Discount', 'Total', 'Paid', 'Balance Due'],
+        _sales, 'sale_date',
+    ),
+    'sale_items': (
+        ['Sale ID', 'Sale Date', 'Product ID', 'Product', 'Quantity (Base Units)', 'Unit Price', 'Line Total'],
+        _sale_items, 'sale__sale_date',
+    ),
+    'payments': (
+        ['Payment ID', 'Sale ID', 'Customer', 'Date Paid', 'Amount', 'Method', 'Note'],
+        _payments, 'date_paid',
+    ),
+    'expenses': (
+        ['Expense ID', 'Date', 'Description', 'Amount'],
+        _expenses, 'date',
+    ),
+    'inventory': (
+        ['Product ID', 'Name', 'Category', 'Barcode', 'Stock (Base Units)', 'Items per Box',
+         'Buying Price', 'Selling Price', 'Expiry Date', 'Stock Value'],
+        _inventory, None,
+    ),
+}
+
+
+def export_rows(name, date_from=None, date_to=None):
+    """
+    Header plus a lazy stream of value tuples for one export. The date range
+    is applied in SQL (as bounds on the column, whole local days) and rows
+    are read CHUNK_SIZE at a time, so memory does not grow with history.
+    """
+    header, queryset, date_field = EXPORTS[name]
+    rows = queryset()
+    if date_field and (date_from or date_to):
+        # Expense.date is a DateField; the others are timestamps bounded by local days
+        is_datetime = date_field != 'date'
+        if date_from:
+            rows = rows.filter(**{f'{date_field}__gte': start_of_day(date_from) if is_datetime else date_from})
+        if date_to:
+            if is_datetime:
+                rows = rows.filter(**{f'{date_field}__lt': start_of_day(date_to + datetime.timedelta(days=1))})
+            else:
+                rows = rows.filter(**{f'{date_field}__lte': date_to})
+    return header, rows.iterator(chunk_size=CHUNK_SIZE)
+
+
+def _cell(value):
+    if isinstance(value, datetime.datetime):
+        if timezone.is_aware(value):
+            value = timezone.localtime(value)
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, Decimal):
+        # Computed columns come back from SQLite unquantized; every money field here has 2 places
+        return value.quantize(CENTS)
+    return value
+
+
+def stream_csv(header, rows):
+    """Yields CSV lines one row at a time (for StreamingHttpResponse)."""
+    writer = csv.writer(Echo())
+    yield '\ufeff' + writer.writerow(header)  # BOM so Excel opens it as UTF-8
+    for row in rows:
+        yield writer.writerow([_cell(v) for v in row])
+
+
+def write_xlsx(header, rows):
+    """
+    Writes the rows to a temporary .xlsx file and returns it, rewound.
+
+    openpyxl's write-only mode flushes each row to disk, so memory stays
+    flat; the finished file is then streamed to the client. openpyxl is an
+    optional dependency and is only imported here.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(header)
+    for row in rows:
+        sheet.append([_cell(v) for v in row])
+    output = tempfile.TemporaryFile(suffix='.xlsx')
+    workbook.save(output)
+    output.seek(0)
+    return output
@@ -0,0 +1,227 @@
+import csv
+import io
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+
+from .models import Category, Product, StockLot
+from .signals import refresh_product_caches
+from .utils import parse_smart_date
+
+# Rows per bulk write. Keeps each CASE/IN statement under SQLite's 999 parameters.
+BATCH_SIZE = 250
+
+# What the Product columns can hold: DecimalField(max_digits=10, decimal_places=2)
+# prices and IntegerField/PositiveIntegerField unit counts
+MAX_PRICE = Decimal('99999999.99')
+MAX_UNITS = 2 ** 31 - 1
+
+# target -> header fragments, tried in order (same matching the old get_val did:
+# lower-cased, stripped header CONTAINS the fragment)
+COLUMNS = {
+    'name': ('productname',),
+    'category': ('category',),
+    'stock': ('currentstock',),
+    'retail': ('retail',),
+    'buying': ('buying',),
+    'conversion': ('conversion', 'items per box'),
+    'expiry': ('expiry', 'date'),
+    'bulk_unit': ('bulkunit',),
+    'base_unit': ('baseunit',),
+}
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    updated: int = 0
+    errors: list = field(default_factory=list)  # (line number, message)
+
+    @property
+    def imported(self):
+        return self.created + self.updated
+
+
+def clean_dec(v):
+    if not v: return Decimal(0)
+    return Decimal(str(v).replace('$', '').replace(',', '').replace('Tsh', '').strip())
+
+
+def clean_int(v):
+    if not v: return 0
+    return int(float(str(v).replace(',', '').strip()))
+
+
+def check_text(row):
+    """The upload is decoded with surrogateescape, so bytes that are not UTF-8 show up here, per row."""
+    try:
+        for cell in row:
+            cell.encode('utf-8')
+    except UnicodeEncodeError:
+        raise ValueError("not valid UTF-8 text; save the file as CSV UTF-8") from None
+
+
+def check_range(prices, units):
+    if any(abs(price) > MAX_PRICE for price in prices):
+        raise ValueError(f"price above {MAX_PRICE}")
+    if any(abs(n) > MAX_UNITS for n in units):
+        raise ValueError(f"quantity above {MAX_UNITS} units")
+
+
+def resolve_columns(header):
+    """Maps each target to the list of column indexes that may hold it. Done once per file."""
+    folded = [(i, (h or '').strip().lower()) for i, h in enumerate(header)]
+    columns = {}
+    for target, fragments in COLUMNS.items():
+        indexes = []
+        for fragment in fragments:
+            match = next((i for i, h in folded if fragment in h), None)
+            if match is not None:
+                indexes.append(match)
+        columns[target] = indexes
+    return columns
+
+
+class InventoryImporter:
+    """
+    Streams a supplier CSV into Product rows, one StockLot per row that
+    brings stock (with that row's expiry).
+
+    The upload is decoded incrementally, the header is mapped once, and all
+    existing products and categories are preloaded into dicts keyed by
+    case-folded name. Rows are then written BATCH_SIZE at a time with
+    bulk_create / bulk_update and one set-based stock increment, all in one
+    transaction. Bad rows -- unparseable, too large for their column, or
+    not UTF-8 -- are reported in ImportResult.errors and skipped.
+    """
+
+    def __init__(self):
+        self.result = ImportResult()
+        self.products = {
+            p.name.casefold(): p
+            for p in Product.objects.only(
+                'name', 'conversion_factor', 'buy_price_per_bulk', 'sell_price_per_base', 'expiry_date'
+            )
+        }
+        self.categories = {c.name.casefold(): c for c in Category.objects.all()}
+
+    def run(self, upload):
+        # Decoded a buffer at a time; the upload is never read into memory whole
+        text = io.TextIOWrapper(
+            getattr(upload, 'file', upload), encoding='utf-8-sig', errors='surrogateescape', newline='',
+        )
+        try:
+            reader = csv.reader(text)
+            header = next(reader, None)
+            if not header:
+                return self.result
+            self.columns = resolve_columns(header)
+            with transaction.atomic():
+                line_no = 1
+                while True:
+                    batch = list(islice(reader, BATCH_SIZE))
+                    if not batch:
+                        break
+                    self.write_batch(enumerate(batch, start=line_no + 1))
+                    line_no += len(batch)
+                transaction.on_commit(refresh_product_caches)
+        finally:
+            text.detach()
+        return self.result
+
+    def value(self, row, target):
+        for i in self.columns[target]:
+            if i < len(row) and row[i].strip():
+                return row[i].strip()
+        return ''
+
+    def write_batch(self, rows):
+        new_products = {}   # folded name -> unsaved Product
+        new_categories = {}
+        dirty = {}          # pk -> existing Product with changed prices
+        stock_in = {}       # pk -> base units to add
+        deliveries = []     # (Product, base units, expiry); products may not have a pk yet
+        withdrawals = []    # (Product, base units) from rows with a negative stock figure
+
+        for line_no, row in rows:
+            try:
+                check_text(row)
+                name = self.value(row, 'name')
+                if not name:
+                    continue
+                stock = clean_int(self.value(row, 'stock'))
+                retail = clean_dec(self.value(row, 'retail'))
+                buying = clean_dec(self.value(row, 'buying'))
+                conv = next(
+                    (n for n in (clean_int(row[i]) for i in self.columns['conversion'] if i < len(row)) if n),
+                    1,
+                )
+                expiry = parse_smart_date(self.value(row, 'expiry'))
+                if conv < 1:
+                    raise ValueError("items per box must be at least 1")
+                key = name.casefold()
+                known = self.products.get(key) or new_products.get(key)
+                check_range((retail, buying), (conv, stock * (known.conversion_factor if known else conv)))
+            except (InvalidOperation, ValueError, OverflowError) as e:
+                self.result.errors.append((line_no, f"{e.__class__.__name__}: {e}"))
+                continue
+
+            product = self.products.get(key)
+            if product is not None:
+                stock_in[product.pk] = stock_in.get(product.pk, 0) + stock * product.conversion_factor
+                if buying > 0: product.buy_price_per_bulk = buying
+                if retail > 0: product.sell_price_per_base = retail
+                dirty[product.pk] = product
+                self.result.updated += 1
+            elif key in new_products:
+                product = new_products[key]
+                product.stock_base += stock * product.conversion_factor
+                if buying > 0: product.buy_price_per_bulk = buying
+                if retail > 0: product.sell_price_per_base = retail
+                if expiry: product.expiry_date = expiry
+                self.result.updated += 1
+            else:
+                category_name = self.value(row, 'category') or 'General'
+                category = self.categories.get(category_name.casefold())
+                if category is None:
+                    category = new_categories.setdefault(category_name.casefold(), Category(name=category_name))
+                new_products[key] = Product(
+                    name=name,
+                    category=category,
+                    stock_base=stock * conv,
+                    buy_price_per_bulk=buying,
+                    sell_price_per_base=retail,
+                    conversion_factor=conv,
+                    bulk_unit=self.value(row, 'bulk_unit') or 'Box',
+                    base_unit=self.value(row, 'base_unit') or 'Item',
+                    expiry_date=expiry,
+                )
+                product = new_products[key]
+                self.result.created += 1
+            if stock < 0:
+                withdrawals.append((product, -stock * product.conversion_factor))
+            else:
+                deliveries.append((product, stock * product.conversion_factor, expiry))
+
+        if new_categories:
+            Category.objects.bulk_create(new_categories.values())
+            self.categories.update(new_categories)
+        if new_products:
+            Product.objects.bulk_create(new_products.values())
+            self.products.update(new_products)
+        if dirty:
+            # expiry_date is left to StockLot.receive: it follows the lots, not the last row
+            Product.objects.bulk_update(dirty.values(), ['buy_price_per_bulk', 'sell_price_per_base'])
+        Product.adjust_stock(stock_in)
+        StockLot.receive(StockLot.delivery(product.pk, units, expiry) for product, units, expiry in deliveries)
+        # Negative figures (returns, corrections) come off the lots soonest-expiry first, like a sale
+        drawn = {}
+        for product, units in withdrawals:
+            drawn[product.pk] = drawn.get(product.pk, 0) + units
+        StockLot.allocate(drawn)
+
+
+def import_inventory_csv(upload):
+    return InventoryImporter().run(upload)
@@ -0,0 +1,95 @@
+import heapq
+import itertools
+import threading
+from collections import deque
+from dataclasses import dataclass
+
+from django.conf import settings
+
+# Samples kept per URL name; older ones fall off as new requests arrive
+WINDOW = getattr(settings, 'MIMS_REQUEST_STATS_WINDOW', 1000)
+
+# Slowest requests kept (across all views) for the "worst offenders" table
+WORST_KEPT = 20
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list (0 for an empty one)."""
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+@dataclass
+class RequestSample:
+    view: str
+    path: str
+    method: str
+    status: int
+    wall_ms: float
+    queries: int
+    sql_ms: float
+    repeated: int      # queries beyond the first run of the same SQL text
+    worst_sql: str     # the most repeated SQL text when repeated > 0
+
+
+class RequestStats:
+    """
+    Rolling per-view samples of request time and SQL activity.
+
+    Recording is an append to a bounded deque under a lock; percentiles are
+    only worked out when someone looks at the report.
+    """
+
+    def __init__(self, window=WINDOW, worst_kept=WORST_KEPT):
+        self.window = window
+        self.worst_kept = worst_kept
+        self._samples = {}
+        self._worst = []  # min-heap of (wall_ms, tiebreak, sample)
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def record(self, sample):
+        with self._lock:
+            samples = self._samples.get(sample.view)
+            if samples is None:
+                samples = self._samples[sample.view] = deque(maxlen=self.window)
+            samples.append(sample)
+            entry = (sample.wall_ms, next(self._counter), sample)
+            if len(self._worst) < self.worst_kept:
+                heapq.heappush(self._worst, entry)
+            elif entry[0] > self._worst[0][0]:
+                heapq.heapreplace(self._worst, entry)
+
+    def summary(self):
+        """One row per view, slowest p95 first."""
+        with self._lock:
+            snapshot = {view: list(samples) for view, samples in self._samples.items()}
+        rows = []
+        for view, samples in snapshot.items():
+            wall = sorted(s.wall_ms for s in samples)
+            n = len(samples)
+            rows.append({
+                'view': view,
+                'requests': n,
+                'p50_ms': percentile(wall, 50),
+                'p95_ms': percentile(wall, 95),
+                'p99_ms': percentile(wall, 99),
+                'avg_queries': sum(s.queries for s in samples) / n,
+                'max_queries': max(s.queries for s in samples),
+                'avg_sql_ms': sum(s.sql_ms for s in samples) / n,
+                'repeated': max(s.repeated for s in samples),
+            })
+        return sorted(rows, key=lambda row: row['p95_ms'], reverse=True)
+
+    def worst(self):
+        with self._lock:
+            return [sample for _, _, sample in sorted(self._worst, reverse=True)]
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+            self._worst.clear()
+
+
+request_stats = RequestStats()
@@ -0,0 +1,119 @@
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.http import Http404
+from django.template.loader import get_template
+from django.utils import timezone
+
+from .cache import MISSING, LRUCache
+from .models import Sale, SaleItem, start_of_day
+
+# Fully paid invoices never change, so their rendered output is kept.
+# Keyed by (sale id, format); receivers in signals.py evict on any edit.
+invoice_cache = LRUCache(getattr(settings, 'MIMS_INVOICE_CACHE_SIZE', 500))
+
+FORMATS = ('text', 'html')
+
+TEXT_WIDTH = 40
+TEXT_RULE = '-' * TEXT_WIDTH
+TEXT_DOUBLE_RULE = '=' * TEXT_WIDTH
+TEXT_LINE = '{name:<18} {qty:<4} {price:<7} {total:<8.2f}'
+TEXT_TOTAL = '{label:<30} {value:>8.2f}'
+
+
+def _is_final(sale):
+    return sale.payment_status == 'PAID' and sale.balance_due <= 0
+
+
+def _lines_for(sales_filter):
+    """Every matching line with its sale and product joined in, in ONE query, grouped per sale."""
+    items = SaleItem.objects.filter(**sales_filter).select_related('sale', 'product').order_by(
+        'sale__sale_date', 'sale_id', 'pk'
+    )
+    for _, lines in groupby(items, key=lambda item: item.sale_id):
+        lines = list(lines)
+        yield lines[0].sale, lines
+
+
+def _render_text(sale, lines):
+    out = [
+        f"{'PHARMA-LOGIC MEDICAL':^{TEXT_WIDTH}}",
+        f"{'Inventory & Sales Report':^{TEXT_WIDTH}}",
+        TEXT_DOUBLE_RULE,
+        f"Invoice ID: {sale.id}",
+        f"Date:       {timezone.localtime(sale.sale_date).strftime('%Y-%m-%d %H:%M')}",
+        f"Customer:   {sale.customer_name or 'General Client'}",
+        f"Status:     {sale.get_payment_status_display()}",
+        TEXT_RULE,
+        f"{'Item':<18} {'Qty':<4} {'Price':<7} {'Total':<8}",
+    ]
+    out.extend(
+        TEXT_LINE.format(name=item.product.name[:17], qty=item.quantity_base, price=item.price_at_sale, total=item.line_total)
+        for item in lines
+    )
+    out.append(TEXT_RULE)
+    out.append(TEXT_TOTAL.format(label='Subtotal:', value=sale.subtotal))
+    out.append(f"{'Discount:':<30} -{sale.discount_amount:>7.2f}")
+    for label, value in (
+        ('GRAND TOTAL:', sale.total_amount), ('Amount Paid:', sale.amount_paid), ('BALANCE DUE:', sale.balance_due),
+    ):
+        out.append(TEXT_TOTAL.format(label=label, value=value))
+    out.append(TEXT_DOUBLE_RULE)
+    return '\n'.join(out)
+
+
+def _render_html(sale, lines):
+    return get_template('mims/invoice_receipt.html').render({'sale': sale, 'sale_items': lines})
+
+
+RENDERERS = {'text': _render_text, 'html': _render_html}
+
+
+def _render(sale, lines, fmt):
+    output = RENDERERS[fmt](sale, lines)
+    if _is_final(sale):
+        invoice_cache.set((sale.pk, fmt), output)
+    return output
+
+
+def render_invoice(sale_id, fmt='text'):
+    """
+    One sale's invoice as text or HTML. A cached (fully paid) invoice costs
+    no queries; otherwise the sale, its lines and their products are read
+    in a single joined query.
+    """
+    cached = invoice_cache.get((sale_id, fmt))
+    if cached is not MISSING:
+        return cached
+    for sale, lines in _lines_for({'sale_id': sale_id}):
+        return _render(sale, lines, fmt)
+    # A sale with no lines left (or none at all)
+    try:
+        sale = Sale.objects.get(pk=sale_id)
+    except Sale.DoesNotExist:
+        raise Http404("No such sale.")
+    return _render(sale, [], fmt)
+
+
+def render_day(day, fmt='text'):
+    """
+    Every invoice for one local day, oldest first, for end-of-day printing.
+    One query for the whole day however many sales it holds; paid invoices
+    already in the cache are reused rather than re-rendered.
+    Returns a list of (sale, rendered invoice).
+    """
+    rendered = []
+    for sale, lines in _lines_for({
+        'sale__sale_date__gte': start_of_day(day), 'sale__sale_date__lt': start_of_day(day + timedelta(days=1)),
+    }):
+        output = invoice_cache.get((sale.pk, fmt))
+        if output is MISSING:
+            output = _render(sale, lines, fmt)
+        rendered.append((sale, output))
+    return rendered
+
+
+def forget_invoice(sale_id):
+    for fmt in FORMATS:
+        invoice_cache.delete((sale_id, fmt))
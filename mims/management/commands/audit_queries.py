@@ -0,0 +1,190 @@
+import re
+from datetime import timedelta
+from fnmatch import fnmatch
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from mims import utils
+from mims.context_processors import get_notification_count
+from mims.models import Customer, Product, Sale
+
+# Plan steps that mean "read the whole table" or "sort/group without an index"
+SCAN = re.compile(r'^SCAN (\w+)$')
+TEMP_BTREE = 'USE TEMP B-TREE'
+FROM_TABLE = re.compile(r'FROM "(\w+)"')
+
+# Statements that have no plan worth reading
+SKIP = ('INSERT', 'SAVEPOINT', 'RELEASE', 'ROLLBACK', 'BEGIN', 'COMMIT', 'PRAGMA')
+
+# Findings that are expected: (plan step prefix, table or None, scenario glob,
+# SQL fragment or None, reason). The first rule that matches wins.
+ALLOWED = [
+    ('', 'mims_category', '*', None, "a handful of rows"),
+    (f'{TEMP_BTREE} FOR RIGHT PART OF ORDER BY', None, '*', None,
+     "the index supplies the leading sort keys; only rows tied on them are sorted"),
+    (f'{TEMP_BTREE} FOR GROUP BY', None, 'financial_report*', 'django_date_trunc(',
+     "buckets are computed from the date; the date range itself is read through an index"),
+    (f'{TEMP_BTREE} FOR ORDER BY', 'mims_dailysummary', 'dashboard', 'AS "total_sold"',
+     "movers are ranked by their SUM; one row per product to sort"),
+    ('SCAN', 'mims_product', 'inventory*', 'COUNT("mims_product"."id") AS "count" FROM "mims_product"',
+     "the totals line sums every product by definition"),
+    ('SCAN', 'mims_product', '*', '"mims_product"."conversion_factor" *',
+     "low stock compares two columns of the same row"),
+    ('', 'mims_product', 'inventory_by_*', 'ORDER BY', "ordering by a computed value (boxes, stock x price)"),
+    (f'{TEMP_BTREE} FOR ORDER BY', 'mims_product', 'inventory_expiring', '"mims_stocklot"',
+     "expiring products are found through the lot expiry index; only those matches are sorted"),
+    ('SCAN', 'mims_product', 'product_search', None, "loads the in-memory search index once per process"),
+    (f'{TEMP_BTREE} FOR ORDER BY', 'mims_stocklot', 'create_sale', 'ORDER BY 2 ASC, 4 ASC, 1 ASC',
+     "FEFO read: stocklot_fefo_idx serves this order, but for a one-product basket the planner "
+     "may seek the product_id index instead and sort that product's few open lots"),
+]
+
+
+def allowed(name, sql, step, table):
+    for prefix, rule_table, scenario, fragment, reason in ALLOWED:
+        if (step.startswith(prefix) and rule_table in (None, table) and fnmatch(name, scenario)
+                and (fragment is None or fragment in sql)):
+            return reason
+    return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs every query issued by the views, the notification context processor and utils "
+        "through EXPLAIN QUERY PLAN and flags full table scans and temporary B-trees. "
+        "Everything the views write is rolled back. Exits non-zero when something is flagged."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='localhost', help="Host header; must be in ALLOWED_HOSTS.")
+        parser.add_argument('--verbose-plans', action='store_true', help="Print every plan, not only findings.")
+
+    def handle(self, *args, **options):
+        if not Product.objects.exists() or not Sale.objects.exists():
+            raise CommandError("Needs data to plan against; run generate_dataset on a scratch database first.")
+        self.verbose = options['verbose_plans']
+        if connection.vendor == 'sqlite' and 'sqlite_stat1' not in connection.introspection.table_names():
+            self.stdout.write(self.style.WARNING(
+                "No planner statistics; plans may differ from production. Run ANALYZE first."
+            ))
+        findings = []
+        with transaction.atomic():
+            client = Client(HTTP_HOST=options['host'])
+            client.force_login(User.objects.create_superuser('mims-audit', password='x'))
+            for name, run in self.scenarios(client):
+                statements = []
+
+                def capture(execute, sql, params, many, context):
+                    statements.append((sql, params))
+                    return execute(sql, params, many, context)
+
+                with connection.execute_wrapper(capture):
+                    run()
+                findings += self.explain(name, statements)
+            transaction.set_rollback(True)
+
+        flagged = [f for f in findings if f[3] is None]
+        for name, sql, step, reason in findings:
+            line = f"[{name}] {step}\n    {sql[:300]}"
+            if reason is None:
+                self.stdout.write(self.style.ERROR(line))
+            elif self.verbose:
+                self.stdout.write(f"{line}\n    allowed: {reason}")
+        if flagged:
+            raise CommandError(f"{len(flagged)} query plan finding(s).")
+        self.stdout.write(self.style.SUCCESS(
+            f"No unexpected scans or temp B-trees ({len(findings)} allowed finding(s))."
+        ))
+
+    def scenarios(self, client):
+        today = timezone.localdate()
+        sale = Sale.objects.order_by('-pk').first()
+        loan = Sale.objects.filter(Sale.outstanding_q()).order_by('-pk').first() or sale
+        product = Product.objects.exclude(barcode=None).order_by('pk').first()
+        customer = Customer.objects.filter(balance__gt=0).first() or Customer.objects.first()
+        week_ago = (today - timedelta(days=7)).isoformat()
+
+        def get(url, **params):
+            return lambda: self.consume(client.get(url, params))
+
+        def post(url, data):
+            return lambda: client.post(url, data)
+
+        scenarios = [
+            ('dashboard', get(reverse('dashboard'))),
+            ('inventory', get(reverse('inventory'))),
+            ('inventory_search', get(reverse('inventory'), q=product.name[:4])),
+            ('inventory_category', get(reverse('inventory'), category=product.category_id)),
+            ('inventory_low_stock', get(reverse('inventory'), status='low')),
+            ('inventory_expiring', get(reverse('inventory'), status='expiring', sort='expiry')),
+            ('inventory_by_stock', get(reverse('inventory'), sort='-stock')),
+            ('inventory_by_value', get(reverse('inventory'), sort='-value')),
+            ('sale_ledger', get(reverse('sale_ledger'))),
+            ('sale_ledger_range', get(reverse('sale_ledger'), **{'from': week_ago, 'to': today.isoformat()})),
+            ('sale_ledger_status', get(reverse('sale_ledger'), status='LOAN')),
+            ('view_sale', get(reverse('view_sale', args=[sale.pk]))),
+            ('day_invoices', get(reverse('day_invoices'), day=today.isoformat())),
+            ('pay_debt_form', get(reverse('pay_debt', args=[loan.pk]))),
+            ('loans_list', get(reverse('loans_list'))),
+            ('notifications', get(reverse('notifications'), type='low_stock')),
+            ('notifications_expired', get(reverse('notifications'), type='expired')),
+            ('expense_list', get(reverse('expense_list'))),
+            ('financial_report', get(reverse('financial_report'), bucket='week')),
+            ('barcode_lookup', get(reverse('barcode_lookup'), barcode=[product.barcode, 'missing'])),
+            ('product_search', get(reverse('product_search'), q=product.name[:3])),
+            ('create_sale_form', get(reverse('create_sale'))),
+            ('create_sale', post(reverse('create_sale'), {
+                'product_name[]': [product.name], 'quantity[]': [1], 'amount_paid': product.sell_price_per_base,
+            })),
+            ('pay_debt', post(reverse('pay_debt', args=[loan.pk]), {'amount_to_pay': '1'})),
+            ('notification_count', get_notification_count),
+            ('financial_report_text', lambda: utils.format_report_text(utils.get_financial_report('monthly'))),
+            ('cash_flow', lambda: utils.get_cash_flow_report(timezone.now() - timedelta(days=30))),
+            ('invoice_text', lambda: utils.generate_invoice_text(sale)),
+        ]
+        if customer is not None:
+            scenarios += [
+                ('loans_for_customer', get(reverse('loans_list'), customer=customer.name)),
+                ('customer_search', get(reverse('customer_search'), q=customer.name[:3])),
+                ('customer_search_phone', get(reverse('customer_search'), q=customer.phone[-4:] or '0712')),
+                ('pay_customer', post(reverse('pay_customer'), {'customer_name': customer.name, 'amount_to_pay': '1'})),
+            ]
+        scenarios += [
+            (f'export_{name}', get(reverse('export', args=[name]), **{'from': week_ago}))
+            for name in ('sales', 'sale_items', 'payments', 'expenses', 'inventory')
+        ]
+        return scenarios
+
+    @staticmethod
+    def consume(response):
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        return response
+
+    def explain(self, name, statements):
+        """(scenario, sql, plan step, allowed reason or None) for every scan and temp B-tree."""
+        findings = []
+        seen = set()
+        for sql, params in statements:
+            if sql.lstrip().upper().startswith(SKIP) or sql in seen:
+                continue
+            seen.add(sql)
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                plan = [row[-1] for row in cursor.fetchall()]
+            for step in plan:
+                scanned = SCAN.match(step)
+                if scanned:
+                    table = scanned.group(1)
+                elif step.startswith(TEMP_BTREE):
+                    table = next(iter(FROM_TABLE.findall(sql)), None)
+                else:
+                    continue
+                findings.append((name, sql, step, allowed(name, sql, step, table)))
+        return findings
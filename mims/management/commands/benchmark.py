@@ -0,0 +1,127 @@
+import csv
+import io
+import json
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from mims.instrumentation import percentile
+from mims.models import Expense, PaymentRecord, Product, Sale, SaleItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Times the hot paths (checkout, dashboard, inventory, loans, barcode lookup, CSV import) "
+        "through the test client against the current database and prints latency and query "
+        "counts as JSON. Every write is rolled back; run it against a generate_dataset copy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help="Timed runs per path (after one warm-up).")
+        parser.add_argument('--import-rows', type=int, default=500, help="Rows in the benchmark CSV upload.")
+        parser.add_argument('--label', default='', help="Free text stored in the output, e.g. a commit id.")
+        parser.add_argument('--output', help="Write the JSON here instead of stdout.")
+        parser.add_argument('--host', default='localhost', help="Host header; must be in ALLOWED_HOSTS.")
+        parser.add_argument('--seed', type=int, default=7)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.import_rows = options['import_rows']
+        report = {
+            'label': options['label'],
+            'created': timezone.now().isoformat(),
+            'dataset': {
+                'products': Product.objects.count(),
+                'sales': Sale.objects.count(),
+                'sale_items': SaleItem.objects.count(),
+                'payments': PaymentRecord.objects.count(),
+                'expenses': Expense.objects.count(),
+            },
+            'paths': {},
+        }
+
+        with transaction.atomic():
+            user = User.objects.create_superuser('mims-benchmark', password='x')
+            self.client = Client(HTTP_HOST=options['host'])
+            self.client.force_login(user)
+            self.products = list(
+                Product.objects.exclude(barcode=None).order_by('?').values('name', 'barcode', 'sell_price_per_base')[:200]
+            )
+            for name, request in self.paths():
+                report['paths'][name] = self.measure(request, options['repeat'])
+            transaction.set_rollback(True)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def paths(self):
+        client, rng = self.client, self.rng
+        return [
+            ('create_sale', lambda: client.post(reverse('create_sale'), self.basket())),
+            ('dashboard', lambda: client.get(reverse('dashboard'))),
+            ('inventory', lambda: client.get(reverse('inventory'))),
+            ('inventory_search', lambda: client.get(
+                reverse('inventory'), {'q': rng.choice(self.products)['name'][:4], 'sort': '-value'}
+            )),
+            ('loans_list', lambda: client.get(reverse('loans_list'))),
+            ('barcode_lookup', lambda: client.get(
+                reverse('barcode_lookup'), {'barcode': [p['barcode'] for p in rng.sample(self.products, 10)]}
+            )),
+            ('csv_import', lambda: client.post(reverse('inventory'), {'csv_file': self.inventory_csv()})),
+        ]
+
+    def basket(self):
+        picked = self.rng.sample(self.products, 3)
+        quantities = [self.rng.randint(1, 3) for _ in picked]
+        return {
+            'product_name[]': [p['name'] for p in picked],
+            'quantity[]': quantities,
+            'amount_paid': sum(p['sell_price_per_base'] * qty for p, qty in zip(picked, quantities)),
+        }
+
+    def inventory_csv(self):
+        """Half restocks of existing products, half new ones."""
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(['ProductName', 'Category', 'CurrentStock', 'RetailPrice', 'BuyingPrice', 'Items per Box',
+                         'BulkUnit', 'BaseUnit', 'ExpiryDate'])
+        for i in range(self.import_rows):
+            if i % 2:
+                name = self.rng.choice(self.products)['name']
+            else:
+                name = f"Benchmark Import {self.rng.getrandbits(48):x}"
+            writer.writerow([name, 'General', self.rng.randint(1, 20), '500', '300', '10', 'Box', 'Tablet', '2030-01-31'])
+        return SimpleUploadedFile('benchmark.csv', out.getvalue().encode(), content_type='text/csv')
+
+    def measure(self, request, repeat):
+        request()  # warm-up: caches, template loading
+        timings, queries, failures = [], [], 0
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                response = request()
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(len(ctx.captured_queries))
+            if response.status_code >= 400:
+                failures += 1
+        timings.sort()
+        return {
+            'runs': repeat,
+            'failures': failures,
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'max_ms': round(timings[-1], 2) if timings else 0,
+            'queries': max(queries, default=0),
+        }
@@ -0,0 +1,110 @@
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections
+
+from mims.checkout import CheckoutError, process_checkout
+from mims.db import default_database
+from mims.instrumentation import percentile
+from mims.models import Category, Product
+
+# DATABASES overrides per profile. "baseline" is Django's out-of-the-box
+# SQLite setup (rollback journal, deferred BEGIN, no PRAGMAs); "tuned" is
+# what Kdevtools/settings.py now ships (mims.db PRAGMAs, BEGIN IMMEDIATE).
+PROFILES = {
+    'baseline': {'OPTIONS': {}, 'PRAGMAS': {}},
+    'tuned': {'OPTIONS': {'transaction_mode': 'IMMEDIATE'}},
+}
+
+PRODUCTS = 200
+PRICE = Decimal('100')
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs concurrent checkouts against a scratch SQLite file under each connection "
+        "profile and reports throughput and 'database is locked' errors."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tills', type=int, default=4, help="Concurrent cashier threads.")
+        parser.add_argument('--checkouts', type=int, default=100, help="Checkouts per till.")
+        parser.add_argument('--profile', choices=[*PROFILES, 'both'], default='both')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        names = list(PROFILES) if options['profile'] == 'both' else [options['profile']]
+        self.stdout.write(f"{'profile':<10} {'ok':>6} {'locked':>7} {'failed':>7} {'sales/s':>8} {'p50 ms':>7} {'p95 ms':>7}")
+        for name in names:
+            result = self.run_profile(name, options['tills'], options['checkouts'], options['seed'])
+            self.stdout.write(
+                f"{name:<10} {result['ok']:>6} {result['locked']:>7} {result['failed']:>7} "
+                f"{result['per_second']:>8.1f} {result['p50_ms']:>7.1f} {result['p95_ms']:>7.1f}"
+            )
+
+    def run_profile(self, name, tills, checkouts, seed):
+        tmpdir = tempfile.mkdtemp()
+        overrides = {'NAME': os.path.join(tmpdir, 'bench.sqlite3'), **PROFILES[name]}
+        try:
+            with default_database(**overrides) as config:
+                if 'PRAGMAS' not in PROFILES[name]:
+                    config.pop('PRAGMAS', None)
+                call_command('migrate', verbosity=0, interactive=False)
+                category = Category.objects.create(name='Benchmark')
+                Product.objects.bulk_create(
+                    Product(
+                        name=f"Bench {i}", category=category, bulk_unit='Box', base_unit='Item', conversion_factor=1,
+                        buy_price_per_bulk=PRICE / 2, sell_price_per_base=PRICE, stock_base=10 ** 6,
+                    )
+                    for i in range(PRODUCTS)
+                )
+                return self.run_tills(tills, checkouts, seed)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def run_tills(self, tills, checkouts, seed):
+        latencies, counts = [], {'ok': 0, 'locked': 0, 'failed': 0}
+        lock = threading.Lock()
+
+        def till(number):
+            rng = random.Random(seed * 1000 + number)
+            try:
+                for _ in range(checkouts):
+                    basket = [(f"Bench {rng.randrange(PRODUCTS)}", rng.randint(1, 3)) for _ in range(rng.randint(1, 5))]
+                    started = time.perf_counter()
+                    try:
+                        process_checkout(basket, amount_paid=PRICE * sum(qty for _, qty in basket))
+                        outcome = 'ok'
+                    except OperationalError as e:
+                        outcome = 'locked' if 'locked' in str(e) else 'failed'
+                    except CheckoutError:
+                        outcome = 'failed'
+                    with lock:
+                        counts[outcome] += 1
+                        if outcome == 'ok':
+                            latencies.append(time.perf_counter() - started)
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        workers = [threading.Thread(target=till, args=(n,)) for n in range(tills)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            **counts,
+            'per_second': counts['ok'] / elapsed if elapsed else 0,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+        }
@@ -0,0 +1,198 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from mims.models import (
+    Category, Customer, Expense, PaymentRecord, Product, Sale, SaleItem, StockLot, customer_key,
+)
+from mims.signals import refresh_product_caches
+
+# Sales (with their items and payments) generated and written per round
+CHUNK = 5000
+
+STEMS = (
+    'Paracetamol', 'Amoxicillin', 'Ibuprofen', 'Metformin', 'Artemether', 'Ciprofloxacin', 'Omeprazole',
+    'Cetirizine', 'Diclofenac', 'Azithromycin', 'Salbutamol', 'Amlodipine', 'Doxycycline', 'Fluconazole',
+    'Loratadine', 'Metronidazole', 'Prednisolone', 'Losartan', 'Albendazole', 'Zinc Sulphate',
+)
+FORMS = (('Tablet', 100), ('Capsule', 100), ('Syrup', 1), ('Injection', 10), ('Sachet', 50))
+CATEGORIES = ('Antibiotics', 'Analgesics', 'Antimalarials', 'Antihypertensives', 'Supplements', 'General')
+FIRST_NAMES = ('Asha', 'Juma', 'Neema', 'Baraka', 'Rehema', 'Hamisi', 'Zawadi', 'Said', 'Mwajuma', 'Elia')
+LAST_NAMES = ('Mushi', 'Said', 'Kimaro', 'Mollel', 'Mrema', 'Nyerere', 'Shirima', 'Swai', 'Lyimo', 'Massawe')
+EXPENSES = ('Rent', 'Electricity', 'Water', 'Transport', 'Staff lunch', 'Airtime', 'Cleaning', 'Repairs')
+
+
+def money(value):
+    return Decimal(value).quantize(Decimal('0.01'))
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills the database with a reproducible synthetic pharmacy: products with their opening "
+        "stock lots, customers, sales with items, installment payments and expenses, all written "
+        "with bulk_create."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10_000)
+        parser.add_argument('--customers', type=int, default=2_000)
+        parser.add_argument('--sales', type=int, default=500_000)
+        parser.add_argument('--items-per-sale', type=float, default=4.0, help="Average lines per sale.")
+        parser.add_argument('--credit-share', type=float, default=0.25, help="Share of sales sold on credit.")
+        parser.add_argument('--expenses-per-day', type=int, default=3)
+        parser.add_argument('--days', type=int, default=365, help="History length, ending today.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--force', action='store_true', help="Add to a database that already has sales.")
+
+    def handle(self, *args, **options):
+        if Sale.objects.exists() and not options['force']:
+            raise CommandError("The database already has sales. Use a scratch copy, or pass --force to add to it.")
+        self.rng = random.Random(options['seed'])
+        started = time.perf_counter()
+
+        with transaction.atomic():
+            products = self.make_products(options['products'])
+            customers = self.make_customers(options['customers'])
+            counts = self.make_sales(products, customers, options)
+            counts['expenses'] = self.make_expenses(options['days'], options['expenses_per_day'])
+            Customer.refresh_balances([c.pk for c in customers])
+        # Bulk writes skipped every incremental hook; re-derive the summaries and caches once
+        call_command('rebuild_daily_summary', stdout=self.stdout)
+        call_command('refresh_stock_alerts', full=True, stdout=self.stdout)
+        refresh_product_caches()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')  # planner statistics for the new row counts
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {len(products)} products, {len(customers)} customers, {counts['sales']} sales, "
+            f"{counts['items']} items, {counts['payments']} payments and {counts['expenses']} expenses "
+            f"in {time.perf_counter() - started:.1f}s."
+        ))
+
+    def make_products(self, count):
+        rng = self.rng
+        categories = Category.objects.bulk_create([Category(name=name) for name in CATEGORIES])
+        today = timezone.localdate()
+        products = []
+        for i in range(count):
+            form, per_box = rng.choice(FORMS)
+            buy = money(rng.uniform(20, 5000))
+            products.append(Product(
+                name=f"{rng.choice(STEMS)} {rng.choice((100, 250, 500))}mg {form} #{i}",
+                category=rng.choice(categories),
+                barcode=f"{620000000000 + i:013d}",
+                bulk_unit='Box',
+                base_unit=form,
+                conversion_factor=per_box,
+                buy_price_per_bulk=buy,
+                sell_price_per_base=money(buy * Decimal(rng.uniform(1.15, 1.6))),
+                stock_base=rng.randint(0, 50) * per_box + rng.randint(0, per_box - 1),
+                expiry_date=today + timedelta(days=rng.randint(-30, 900)),
+            ))
+        products = Product.objects.bulk_create(products, batch_size=1000)
+        # bulk_create skips Product.save, which opens each product's first lot
+        StockLot.objects.bulk_create([
+            StockLot.delivery(p.pk, p.stock_base, p.expiry_date) for p in products if p.stock_base > 0
+        ], batch_size=2000)
+        return products
+
+    def make_customers(self, count):
+        rng = self.rng
+        customers = []
+        for i in range(count):
+            name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}"
+            phone = f"07{rng.randint(10_000_000, 99_999_999)}"
+            # bulk_create skips Customer.save, which derives the keys
+            customers.append(Customer(name=name, name_key=customer_key(name), phone=phone, phone_key=phone[-9:]))
+        return Customer.objects.bulk_create(customers, batch_size=1000)
+
+    def make_sales(self, products, customers, options):
+        rng = self.rng
+        now = timezone.now()
+        first_day = now - timedelta(days=options['days'])
+        span = (now - first_day).total_seconds()
+        total = options['sales']
+        # Sorted so ids follow sale_date, as they do in a real shop
+        moments = sorted(first_day + timedelta(seconds=rng.uniform(0, span)) for _ in range(total))
+        counts = {'sales': 0, 'items': 0, 'payments': 0}
+
+        for offset in range(0, total, CHUNK):
+            sales, lines, installments = [], [], []
+            for moment in moments[offset:offset + CHUNK]:
+                basket = [
+                    (rng.choice(products), rng.randint(1, 3))
+                    for _ in range(max(1, round(rng.expovariate(1 / options['items_per_sale']))))
+                ]
+                total_amount = sum(p.sell_price_per_base * qty for p, qty in basket)
+                customer = rng.choice(customers) if customers and rng.random() < options['credit_share'] else None
+                if customer is None:
+                    upfront, later = total_amount, []
+                else:
+                    upfront = money(total_amount * Decimal(rng.choice((0, 0, 0.25, 0.5))))
+                    later = self.installments(total_amount - upfront, moment, now)
+                paid = upfront + sum(amount for amount, _ in later)
+                sales.append(Sale(
+                    sale_date=moment,
+                    customer=customer,
+                    customer_name=customer.name if customer else 'Walk-in',
+                    payment_status='PAID' if paid >= total_amount else ('PARTIAL' if paid > 0 else 'LOAN'),
+                    subtotal=total_amount,
+                    total_amount=total_amount,
+                    amount_paid=paid,
+                ))
+                lines.append(basket)
+                installments.append(later)
+
+            Sale.objects.bulk_create(sales, batch_size=1000)
+            items = SaleItem.objects.bulk_create([
+                SaleItem(
+                    sale=sale, product=product, quantity_base=qty,
+                    price_at_sale=product.sell_price_per_base, cost_at_sale=product.buy_price_per_bulk,
+                )
+                for sale, basket in zip(sales, lines) for product, qty in basket
+            ], batch_size=2000)
+            payments = PaymentRecord.objects.bulk_create([
+                PaymentRecord(sale=sale, amount_received=amount, date_paid=paid_on, note='Installment payment')
+                for sale, later in zip(sales, installments) for amount, paid_on in later
+            ], batch_size=2000)
+            counts['sales'] += len(sales)
+            counts['items'] += len(items)
+            counts['payments'] += len(payments)
+            self.stdout.write(f"  {counts['sales']}/{total} sales", ending='\r')
+        self.stdout.write('')
+        return counts
+
+    def installments(self, owed, moment, now):
+        """Zero to three later payments towards `owed`; about a third of debts stay open."""
+        rng = self.rng
+        payments = []
+        remaining = owed
+        for _ in range(rng.choice((0, 1, 1, 2, 3))):
+            paid_on = moment + timedelta(days=rng.uniform(1, 60))
+            if remaining <= 0 or paid_on >= now:
+                break
+            amount = remaining if rng.random() < 0.5 else money(remaining * Decimal(rng.uniform(0.2, 0.8)))
+            if amount <= 0:
+                break
+            payments.append((amount, paid_on))
+            remaining -= amount
+        return payments
+
+    def make_expenses(self, days, per_day):
+        rng = self.rng
+        today = timezone.localdate()
+        expenses = [
+            Expense(
+                description=rng.choice(EXPENSES),
+                amount=money(rng.uniform(2_000, 150_000)),
+                date=today - timedelta(days=day),
+            )
+            for day in range(days) for _ in range(rng.randint(0, per_day))
+        ]
+        return len(Expense.objects.bulk_create(expenses, batch_size=2000))
@@ -0,0 +1,79 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+
+from mims import reports
+from mims.models import DailySummary, Expense, PaymentRecord, Sale, SaleItem
+
+
+class Command(BaseCommand):
+    help = "Recomputes the DailySummary table from sales, payments and expenses."
+
+    def handle(self, *args, **options):
+        line_revenue = F('quantity_base') * F('price_at_sale')
+        # Unit cost as snapshotted at sale time, so no join to the product table
+        line_cost = F('quantity_base') * F('cost_at_sale')
+
+        days = defaultdict(lambda: defaultdict(int))      # day -> field -> total
+        products = defaultdict(lambda: defaultdict(int))  # (day, product_id) -> field -> total
+
+        # --- 1. SALE LINES, PER DAY AND PRODUCT ---
+        lines = (
+            SaleItem.objects.annotate(day=TruncDate('sale__sale_date'))
+            .values('day', 'product_id')
+            .annotate(revenue=Sum(line_revenue), cost=Sum(line_cost), qty=Sum('quantity_base'))
+        )
+        for row in lines.iterator():
+            figures = {
+                'revenue': row['revenue'] or 0,
+                'cost_of_goods': row['cost'] or 0,
+                'profit': (row['revenue'] or 0) - (row['cost'] or 0),
+                'quantity_base': row['qty'] or 0,
+            }
+            for field, value in figures.items():
+                products[(row['day'], row['product_id'])][field] += value
+                if field != 'revenue':
+                    days[row['day']][field] += value
+
+        # --- 2. SALE TOTALS AND CASH ---
+        # Cash on a day = what was paid upfront on that day's sales
+        # (amount_paid less later installments) + installments taken that day
+        sales = Sale.objects.annotate(day=TruncDate('sale_date')).values('day').annotate(
+            revenue=Sum('total_amount'), paid=Sum('amount_paid'),
+        )
+        for row in sales:
+            days[row['day']]['revenue'] += row['revenue'] or 0
+            days[row['day']]['cash_collected'] += row['paid'] or 0
+
+        installments_by_sale_day = PaymentRecord.objects.annotate(
+            day=TruncDate('sale__sale_date')
+        ).values('day').annotate(t=Sum('amount_received'))
+        for row in installments_by_sale_day:
+            days[row['day']]['cash_collected'] -= row['t'] or 0
+
+        installments_by_paid_day = PaymentRecord.objects.annotate(
+            day=TruncDate('date_paid')
+        ).values('day').annotate(t=Sum('amount_received'))
+        for row in installments_by_paid_day:
+            days[row['day']]['cash_collected'] += row['t'] or 0
+
+        # --- 3. EXPENSES ---
+        for row in Expense.objects.values('date').annotate(t=Sum('amount')):
+            days[row['date']]['expenses'] += row['t'] or 0
+
+        rows = [DailySummary(day=day, **figures) for day, figures in days.items()]
+        rows += [
+            DailySummary(day=day, product_id=product_id, **figures)
+            for (day, product_id), figures in products.items()
+        ]
+        with transaction.atomic():
+            DailySummary.objects.all().delete()
+            DailySummary.objects.bulk_create(rows, batch_size=500)
+        reports.invalidate_all()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {len(days)} daily rows and {len(products)} product rows."
+        ))
@@ -0,0 +1,272 @@
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from decimal import Decimal
+from http.cookiejar import CookieJar
+from multiprocessing import get_context
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, build_opener
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.test import Client
+from django.urls import reverse
+
+from mims.db import copy_database, default_database
+from mims.instrumentation import percentile
+from mims.models import Customer, Product, Sale, SaleItem
+
+# How often (in actions) a till re-reads the list of open loans it can pay towards
+LOAN_REFRESH = 25
+
+
+class ClientTransport:
+    """Posts through the Django test client, in this process, against the configured database."""
+
+    def __init__(self, spec):
+        self.client = Client(HTTP_HOST=spec['host'])
+        self.client.force_login(User.objects.get(pk=spec['user_id']))
+
+    def post(self, path, data):
+        """(status code or None, whether the failure was 'database is locked')."""
+        try:
+            return self.client.post(path, data).status_code, False
+        except OperationalError as e:
+            return None, 'locked' in str(e)
+
+
+class _NoRedirect(HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpTransport:
+    """Posts to a running server over HTTP, logged in with a real session and CSRF token."""
+
+    def __init__(self, spec):
+        self.base = spec['url'].rstrip('/')
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies), _NoRedirect)
+        self.opener.open(self.base + reverse('login')).read()
+        status, _ = self.post(reverse('login'), {'username': spec['username'], 'password': spec['password']})
+        if status != 302:
+            raise CommandError(f"Could not log in to {self.base} as {spec['username']}.")
+
+    def post(self, path, data):
+        token = next((c.value for c in self.cookies if c.name == 'csrftoken'), '')
+        body = urlencode({**data, 'csrfmiddlewaretoken': token}, doseq=True).encode()
+        try:
+            with self.opener.open(self.base + path, data=body) as response:
+                return response.status, False
+        except HTTPError as e:
+            if e.code < 400:  # the redirect a successful form post ends with
+                return e.code, False
+            return e.code, b'database is locked' in e.read()
+
+
+def run_till(spec):
+    """One cashier: a seeded mix of checkouts and loan payments. Returns its tallies."""
+    rng = random.Random(spec['seed'])
+    transport = HttpTransport(spec) if spec['url'] else ClientTransport(spec)
+    products = spec['products']
+    tally = {'sale': [], 'payment': [], 'locked_retries': 0, 'locked_failures': 0, 'errors': 0}
+    open_loans = []
+
+    try:
+        for action in range(spec['actions']):
+            if action % LOAN_REFRESH == 0:
+                open_loans = list(
+                    Sale.objects.filter(Sale.outstanding_q()).order_by('-pk').values_list('pk', 'balance_due')[:200]
+                )
+            if open_loans and rng.random() < spec['pay_share']:
+                sale_id, balance = rng.choice(open_loans)
+                amount = min(balance, Decimal(rng.choice((500, 1000, 2000, 5000))))
+                kind, path, data = 'payment', reverse('pay_debt', args=[sale_id]), {'amount_to_pay': amount}
+            else:
+                basket = rng.sample(products, rng.randint(1, min(5, len(products))))
+                quantities = [rng.randint(1, 3) for _ in basket]
+                total = sum(price * qty for (_, price), qty in zip(basket, quantities))
+                data = {'product_name[]': [name for name, _ in basket], 'quantity[]': quantities}
+                if rng.random() < spec['credit_share']:
+                    data['customer_name'] = f"Till Customer {rng.randrange(50)}"
+                    data['amount_paid'] = rng.choice((0, total / 2))
+                else:
+                    data['amount_paid'] = total
+                kind, path = 'sale', reverse('create_sale')
+
+            started = time.perf_counter()
+            for attempt in range(spec['retries'] + 1):
+                status, locked = transport.post(path, data)
+                if not locked:
+                    break
+                tally['locked_retries'] += 1
+                time.sleep(0.05 * 2 ** attempt)
+            if locked:
+                tally['locked_failures'] += 1
+            elif status is None or status >= 400:
+                tally['errors'] += 1
+            else:
+                tally[kind].append((time.perf_counter() - started) * 1000)
+    finally:
+        connections.close_all()
+    return tally
+
+
+def cents(value):
+    return Decimal(str(value or 0)).quantize(Decimal('0.01'))
+
+
+def check_consistency(first_sale_id, stock_before):
+    """
+    Invariants that concurrent tills must not break. Returns {problem: [examples]}.
+    Only sales made by the run (pk >= first_sale_id) and the products they touched are checked.
+    """
+    problems = {}
+
+    sold = dict(
+        SaleItem.objects.filter(sale_id__gte=first_sale_id).values('product_id')
+        .annotate(qty=Sum('quantity_base')).values_list('product_id', 'qty')
+    )
+    stock_after = dict(Product.objects.filter(pk__in=list(sold)).values_list('pk', 'stock_base'))
+    problems['stock drift (before - sold != after)'] = [
+        (pk, stock_before[pk], qty, stock_after[pk])
+        for pk, qty in sold.items() if stock_before[pk] - qty != stock_after[pk]
+    ]
+
+    item_total = Subquery(
+        SaleItem.objects.filter(sale=OuterRef('pk')).values('sale')
+        .annotate(t=Sum(F('quantity_base') * F('price_at_sale'))).values('t')
+    )
+    new_sales = Sale.objects.filter(pk__gte=first_sale_id)
+    # Compared in Python: SQLite hands computed sums back as floats
+    problems['sale subtotal != sum of its items'] = [
+        (pk, subtotal, items_total)
+        for pk, subtotal, items_total in new_sales.annotate(items_total=item_total)
+        .values_list('pk', 'subtotal', 'items_total')
+        if cents(subtotal) != cents(items_total)
+    ][:10]
+    problems['sale without items'] = list(
+        new_sales.annotate(n=Count('items')).filter(n=0).values_list('pk', flat=True)[:10]
+    )
+    problems['overpaid sale'] = [
+        (pk, total, paid)
+        for pk, total, paid in Sale.objects.filter(amount_paid__gt=F('total_amount'))
+        .values_list('pk', 'total_amount', 'amount_paid')
+        if cents(paid) > cents(total)
+    ][:10]
+    problems['status disagrees with amounts'] = [
+        pk
+        for pk, status, total, paid in Sale.objects.filter(pk__gte=first_sale_id)
+        .values_list('pk', 'payment_status', 'total_amount', 'amount_paid')
+        if (status == 'PAID') != (cents(paid) >= cents(total))
+    ][:10]
+    owed = Subquery(
+        Sale.objects.filter(customer=OuterRef('pk')).values('customer')
+        .annotate(t=Sum('balance_due')).values('t')
+    )
+    problems['customer balance != open sales'] = [
+        (name, balance, owed)
+        for name, balance, owed in Customer.objects.annotate(owed=owed).values_list('name', 'balance', 'owed')
+        if cents(balance) != cents(owed)
+    ][:10]
+    return {problem: examples for problem, examples in problems.items() if examples}
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulates several cashiers checking out and taking loan payments at once, then "
+        "reports sales/s, latency percentiles, 'database is locked' retries and any stock "
+        "or balance inconsistencies. Runs on a scratch copy of the database unless told otherwise."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tills', type=int, default=4)
+        parser.add_argument('--actions', type=int, default=200, help="Checkouts and payments per till.")
+        parser.add_argument('--processes', action='store_true', help="One process per till instead of threads.")
+        parser.add_argument('--pay-share', type=float, default=0.15, help="Share of actions that are loan payments.")
+        parser.add_argument('--credit-share', type=float, default=0.2, help="Share of sales sold on credit.")
+        parser.add_argument('--retries', type=int, default=3, help="Retries after 'database is locked'.")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--in-place', action='store_true', help="Write to the configured database itself.")
+        parser.add_argument('--url', help="Drive a running server (e.g. http://127.0.0.1:8000) instead of the test client.")
+        parser.add_argument('--username', help="Login for --url.")
+        parser.add_argument('--password', help="Password for --url.")
+        parser.add_argument('--host', default='localhost', help="Host header for the test client.")
+
+    def handle(self, *args, **options):
+        if options['url'] and not (options['username'] and options['password']):
+            raise CommandError("--url needs --username and --password.")
+        if options['url'] or options['in_place']:
+            # A live server writes to its own database; there is nothing to copy
+            return self.simulate(options)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            scratch = os.path.join(tmpdir, 'tills.sqlite3')
+            copy_database(scratch)
+            with default_database(NAME=scratch):
+                return self.simulate(options)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def simulate(self, options):
+        products = list(
+            Product.objects.filter(stock_base__gt=0, sell_price_per_base__gt=0)
+            .order_by('?').values_list('name', 'sell_price_per_base')[:300]
+        )
+        if not products:
+            raise CommandError("No products in stock to sell; run generate_dataset first.")
+        user_id = None
+        if not options['url']:
+            user_id = User.objects.get_or_create(username='mims-simulator', defaults={'is_staff': True})[0].pk
+        first_sale_id = (Sale.objects.order_by('-pk').values_list('pk', flat=True).first() or 0) + 1
+        stock_before = dict(Product.objects.values_list('pk', 'stock_base'))
+
+        specs = [
+            {
+                'seed': options['seed'] * 1000 + n, 'actions': options['actions'], 'products': products,
+                'pay_share': options['pay_share'], 'credit_share': options['credit_share'],
+                'retries': options['retries'], 'url': options['url'], 'host': options['host'],
+                'username': options['username'], 'password': options['password'], 'user_id': user_id,
+            }
+            for n in range(options['tills'])
+        ]
+        if options['processes']:
+            connections.close_all()  # forked children must not share this process's sqlite handle
+            pool = ProcessPoolExecutor(options['tills'], mp_context=get_context('fork'))
+        else:
+            pool = ThreadPoolExecutor(options['tills'])
+        started = time.perf_counter()
+        with pool:
+            tallies = list(pool.map(run_till, specs))
+        elapsed = time.perf_counter() - started
+
+        self.report(tallies, elapsed, options)
+        problems = check_consistency(first_sale_id, stock_before)
+        if problems:
+            for problem, examples in problems.items():
+                self.stdout.write(self.style.ERROR(f"INCONSISTENT: {problem}: {examples}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("No stock or balance inconsistencies found."))
+
+    def report(self, tallies, elapsed, options):
+        mode = options['url'] or 'test client'
+        workers = 'processes' if options['processes'] else 'threads'
+        self.stdout.write(f"{options['tills']} tills ({workers}, {mode}) for {elapsed:.1f}s")
+        for kind in ('sale', 'payment'):
+            latencies = sorted(ms for tally in tallies for ms in tally[kind])
+            self.stdout.write(
+                f"  {kind + 's':<9} {len(latencies):>6} ok  {len(latencies) / elapsed:>7.1f}/s  "
+                f"p50 {percentile(latencies, 50):6.1f} ms  p95 {percentile(latencies, 95):6.1f} ms  "
+                f"p99 {percentile(latencies, 99):6.1f} ms"
+            )
+        self.stdout.write(
+            f"  'database is locked': {sum(t['locked_retries'] for t in tallies)} retries, "
+            f"{sum(t['locked_failures'] for t in tallies)} gave up; "
+            f"{sum(t['errors'] for t in tallies)} other errors"
+        )
@@ -0,0 +1,78 @@
+import logging
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+
+from .instrumentation import RequestSample, request_stats
+
+logger = logging.getLogger('mims.performance')
+
+
+class QueryRecorder:
+    """connection.execute_wrapper hook counting and timing every SQL statement."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+
+    def repeated(self):
+        """(extra runs of already-seen SQL, the most repeated statement)."""
+        if not self.statements:
+            return 0, ''
+        sql, runs = self.statements.most_common(1)[0]
+        return self.count - len(self.statements), sql if runs > 1 else ''
+
+
+class RequestStatsMiddleware:
+    """
+    Records wall time, query count, SQL time and repeated identical SQL
+    (the N+1 signature) for every request, per URL name, into
+    instrumentation.request_stats. Requests slower than
+    MIMS_SLOW_REQUEST_MS are also logged to the 'mims.performance' logger.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_ms = getattr(settings, 'MIMS_SLOW_REQUEST_MS', 500)
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        wall_ms = (time.perf_counter() - started) * 1000
+
+        match = request.resolver_match
+        if match is None:  # 404s and the like; nothing to attribute them to
+            return response
+        repeated, worst_sql = recorder.repeated()
+        sample = RequestSample(
+            view=match.view_name or match._func_path,
+            path=request.path,
+            method=request.method,
+            status=response.status_code,
+            wall_ms=wall_ms,
+            queries=recorder.count,
+            sql_ms=recorder.seconds * 1000,
+            repeated=repeated,
+            worst_sql=worst_sql,
+        )
+        request_stats.record(sample)
+        if wall_ms >= self.slow_ms:
+            logger.warning(
+                "Slow request %s %s (%s): %.0f ms, %d queries (%.0f ms SQL, %d repeated)",
+                sample.method, sample.path, sample.view, wall_ms, sample.queries, sample.sql_ms, repeated,
+            )
+        return response
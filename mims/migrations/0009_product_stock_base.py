@@ -0,0 +1,38 @@
+from django.db import migrations, models
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast, Round
+
+
+def boxes_to_base_units(apps, schema_editor):
+    Product = apps.get_model('mims', 'Product')
+    # Round once here so any drift accumulated in the float column is dropped
+    Product.objects.using(schema_editor.connection.alias).update(
+        stock_base=Round(F('stock_qty') * F('conversion_factor'))
+    )
+
+
+def base_units_to_boxes(apps, schema_editor):
+    Product = apps.get_model('mims', 'Product')
+    Product.objects.using(schema_editor.connection.alias).filter(conversion_factor__gt=0).update(
+        stock_qty=Cast('stock_base', FloatField()) / F('conversion_factor')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mims', '0008_product_barcode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='stock_base',
+            field=models.IntegerField(default=0, help_text='Current Stock in Smallest Units'),
+        ),
+        migrations.RunPython(boxes_to_base_units, base_units_to_boxes),
+        migrations.RemoveField(
+            model_name='product',
+            name='stock_qty',
+        ),
+    ]
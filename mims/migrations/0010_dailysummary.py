@@ -0,0 +1,99 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:35
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+
+
+def summarise_history(apps, schema_editor):
+    """
+    Fills the new table from existing sales, payments and expenses -- the
+    rebuild_daily_summary command with the historical models. Line cost is
+    the product's buy price, which is what profit was computed from here.
+    """
+    db = schema_editor.connection.alias
+    DailySummary = apps.get_model('mims', 'DailySummary')
+    SaleItem = apps.get_model('mims', 'SaleItem')
+    Sale = apps.get_model('mims', 'Sale')
+    PaymentRecord = apps.get_model('mims', 'PaymentRecord')
+    Expense = apps.get_model('mims', 'Expense')
+
+    days = defaultdict(lambda: defaultdict(int))      # day -> field -> total
+    products = defaultdict(lambda: defaultdict(int))  # (day, product_id) -> field -> total
+
+    lines = (
+        SaleItem.objects.using(db).annotate(day=TruncDate('sale__sale_date'))
+        .values('day', 'product_id')
+        .annotate(
+            revenue=Sum(F('quantity_base') * F('price_at_sale')),
+            cost=Sum(F('quantity_base') * F('product__buy_price_per_bulk')),
+            qty=Sum('quantity_base'),
+        )
+    )
+    for row in lines.iterator():
+        figures = {
+            'revenue': row['revenue'] or 0,
+            'cost_of_goods': row['cost'] or 0,
+            'profit': (row['revenue'] or 0) - (row['cost'] or 0),
+            'quantity_base': row['qty'] or 0,
+        }
+        for field, value in figures.items():
+            products[(row['day'], row['product_id'])][field] += value
+            if field != 'revenue':
+                days[row['day']][field] += value
+
+    sales = Sale.objects.using(db).annotate(day=TruncDate('sale_date')).values('day').annotate(
+        revenue=Sum('total_amount'), paid=Sum('amount_paid'),
+    )
+    for row in sales:
+        days[row['day']]['revenue'] += row['revenue'] or 0
+        days[row['day']]['cash_collected'] += row['paid'] or 0
+
+    # Cash on a day = upfront payment on that day's sales + installments taken that day
+    payments = PaymentRecord.objects.using(db)
+    for row in payments.annotate(day=TruncDate('sale__sale_date')).values('day').annotate(t=Sum('amount_received')):
+        days[row['day']]['cash_collected'] -= row['t'] or 0
+    for row in payments.annotate(day=TruncDate('date_paid')).values('day').annotate(t=Sum('amount_received')):
+        days[row['day']]['cash_collected'] += row['t'] or 0
+
+    for row in Expense.objects.using(db).values('date').annotate(t=Sum('amount')):
+        days[row['date']]['expenses'] += row['t'] or 0
+
+    rows = [DailySummary(day=day, **figures) for day, figures in days.items()]
+    rows += [
+        DailySummary(day=day, product_id=product_id, **figures)
+        for (day, product_id), figures in products.items()
+    ]
+    DailySummary.objects.using(db).bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mims', '0009_product_stock_base'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cost_of_goods', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('profit', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('quantity_base', models.IntegerField(default=0, help_text='Small units sold')),
+                ('cash_collected', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('expenses', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='mims.product')),
+            ],
+            options={
+                'verbose_name_plural': 'Daily summaries',
+                'constraints': [models.UniqueConstraint(condition=models.Q(('product__isnull', True)), fields=('day',), name='unique_daily_total'), models.UniqueConstraint(fields=('day', 'product'), name='unique_daily_product')],
+            },
+        ),
+        migrations.RunPython(summarise_history, migrations.RunPython.noop),
+    ]
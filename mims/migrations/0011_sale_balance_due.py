@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:42
+
+import django.db.models.expressions
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mims', '0010_dailysummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sale',
+            name='balance_due',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(models.F('total_amount'), '-', models.F('amount_paid')), output_field=models.DecimalField(decimal_places=2, max_digits=10)),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(condition=models.Q(('balance_due__gt', 0)), fields=['sale_date', 'balance_due'], name='sale_outstanding_idx'),
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:48
+
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+# Frozen copies of mims.models.customer_key / WALK_IN_KEYS as of this migration
+WALK_IN_KEYS = {'', 'walk in', 'walkin', 'walk in customer', 'general client'}
+
+
+def customer_key(name):
+    folded = unicodedata.normalize('NFKD', name or '').encode('ascii', 'ignore').decode().casefold()
+    return ' '.join(re.findall(r'[0-9a-z]+', folded))
+
+
+def create_customers(apps, schema_editor):
+    """One Customer per spelling-insensitive name; the most used spelling wins."""
+    db = schema_editor.connection.alias
+    Sale = apps.get_model('mims', 'Sale')
+    Customer = apps.get_model('mims', 'Customer')
+
+    spellings = defaultdict(Counter)
+    names = Sale.objects.using(db).exclude(customer_name=None).values('customer_name').annotate(n=Count('pk'))
+    for row in names:
+        key = customer_key(row['customer_name'])
+        if key not in WALK_IN_KEYS:
+            spellings[key][row['customer_name']] += row['n']
+
+    customers = Customer.objects.using(db).bulk_create([
+        Customer(name=' '.join(counter.most_common(1)[0][0].split()), name_key=key)
+        for key, counter in spellings.items()
+    ])
+    for customer in customers:
+        Sale.objects.using(db).filter(customer_name__in=list(spellings[customer.name_key])).update(
+            customer=customer, customer_name=customer.name,
+        )
+
+    owed = Sale.objects.using(db).filter(customer=OuterRef('pk')).order_by().values('customer').annotate(
+        total=Sum('balance_due')
+    ).values('total')
+    Customer.objects.using(db).update(
+        balance=Coalesce(Subquery(owed), Value(Decimal(0)), output_field=models.DecimalField(max_digits=12, decimal_places=2))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mims', '0012_sale_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Customer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('name_key', models.CharField(editable=False, max_length=200, unique=True)),
+                ('phone', models.CharField(blank=True, max_length=30)),
+                ('phone_key', models.CharField(blank=True, db_index=True, editable=False, max_length=9)),
+                ('balance', models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12)),
+            ],
+            options={
+                'ordering': ['name'],
+                'indexes': [models.Index(condition=models.Q(('balance__gt', 0)), fields=['-balance'], name='customer_owing_idx')],
+            },
+        ),
+        migrations.AddField(
+            model_name='sale',
+            name='customer',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sales', to='mims.customer'),
+        ),
+        migrations.RunPython(create_customers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:56
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_cost_at_sale(apps, schema_editor):
+    """
+    Past lines take the product's current buy price -- the same figure
+    profit was computed from until now, so reported history is unchanged.
+    """
+    db = schema_editor.connection.alias
+    Product = apps.get_model('mims', 'Product')
+    SaleItem = apps.get_model('mims', 'SaleItem')
+    SaleItem.objects.using(db).update(cost_at_sale=Subquery(
+        Product.objects.using(db).filter(pk=OuterRef('product_id')).values('buy_price_per_bulk')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mims', '0013_customer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='saleitem',
+            name='cost_at_sale',
+            field=models.DecimalField(decimal_places=2, default=0, help_text='Buy price per smallest unit when sold; later price changes leave it alone', max_digits=10),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_cost_at_sale, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='saleitem',
+            index=models.Index(fields=['sale', 'price_at_sale', 'cost_at_sale', 'quantity_base'], name='saleitem_profit_idx'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:17
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def open_lots_for_stock_on_hand(apps, schema_editor):
+    """Whatever is on the shelf today becomes one lot per product, dated with the product's expiry."""
+    db = schema_editor.connection.alias
+    Product = apps.get_model('mims', 'Product')
+    StockLot = apps.get_model('mims', 'StockLot')
+    StockLot.objects.using(db).bulk_create([
+        StockLot(product_id=pk, expiry_date=expiry, quantity_received=stock, quantity_base=stock)
+        for pk, stock, expiry in Product.objects.using(db).filter(stock_base__gt=0)
+        .values_list('pk', 'stock_base', 'expiry_date').iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mims', '0015_query_plan_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchase',
+            name='expiry_date',
+            field=models.DateField(blank=True, help_text='Expiry printed on this delivery', null=True),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='expiry_date',
+            field=models.DateField(blank=True, help_text='Earliest expiry of the stock on hand', null=True),
+        ),
+        migrations.CreateModel(
+            name='StockLot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expiry_date', models.DateField(blank=True, null=True)),
+                ('quantity_received', models.PositiveIntegerField(help_text='Small units delivered')),
+                ('quantity_base', models.IntegerField(help_text='Small units of this lot still on the shelf')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lots', to='mims.product')),
+                ('purchase', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='lots', to='mims.purchase')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('quantity_base__gt', 0)), fields=['expiry_date', 'product'], name='stocklot_open_expiry_idx'), models.Index(condition=models.Q(('quantity_base__gt', 0)), fields=['product', 'expiry_date', 'id'], name='stocklot_fefo_idx')],
+            },
+        ),
+        migrations.RunPython(open_lots_for_stock_on_hand, migrations.RunPython.noop),
+        migrations.RunSQL('ANALYZE mims_stocklot', migrations.RunSQL.noop),
+    ]
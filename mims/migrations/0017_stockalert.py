@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:21
+
+from datetime import timedelta
+from decimal import ROUND_CEILING, Decimal
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Sum
+from django.utils import timezone
+
+
+def compute_alerts(apps, schema_editor):
+    """
+    Fills the table for every product, as `refresh_stock_alerts --full` would,
+    so the purchase-order page has rows before the first nightly run. The
+    model constants are copied as they stood when this migration was written.
+    """
+    db = schema_editor.connection.alias
+    Product = apps.get_model('mims', 'Product')
+    DailySummary = apps.get_model('mims', 'DailySummary')
+    StockLot = apps.get_model('mims', 'StockLot')
+    StockAlert = apps.get_model('mims', 'StockAlert')
+    window_days, cover_days, warning_days = 28, 7 + 3, 180
+
+    today = timezone.localdate()
+    sold = dict(
+        DailySummary.objects.using(db)
+        .filter(product__isnull=False, day__gt=today - timedelta(days=window_days), day__lte=today)
+        .values('product_id').annotate(t=Sum('quantity_base')).values_list('product_id', 't')
+    )
+    expiring = set(
+        StockLot.objects.using(db)
+        .filter(quantity_base__gt=0, expiry_date__lte=today + timedelta(days=warning_days))
+        .values_list('product_id', flat=True)
+    )
+    alerts = []
+    for pk, stock in Product.objects.using(db).values_list('pk', 'stock_base').iterator():
+        avg = Decimal(sold.get(pk) or 0) / window_days
+        reorder_point = int((avg * cover_days).to_integral_value(rounding=ROUND_CEILING))
+        reorder = stock <= reorder_point
+        alerts.append(StockAlert(
+            product_id=pk,
+            avg_daily_sales=avg.quantize(Decimal('0.001')),
+            reorder_point=reorder_point,
+            days_of_cover=(Decimal(max(stock, 0)) / avg).quantize(Decimal('0.1')) if avg else None,
+            reorder=reorder,
+            expiring=pk in expiring,
+            active=reorder or pk in expiring,
+        ))
+    StockAlert.objects.using(db).bulk_create(alerts, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mims', '0016_stocklot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockAlert',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='alert', serialize=False, to='mims.product')),
+                ('avg_daily_sales', models.DecimalField(decimal_places=3, help_text='Small units per day', max_digits=12)),
+                ('reorder_point', models.IntegerField(help_text='Small units; reorder at or below this')),
+                ('days_of_cover', models.DecimalField(blank=True, decimal_places=1, help_text='Days the stock lasts at the current rate; empty when nothing sold in the window', max_digits=10, null=True)),
+                ('reorder', models.BooleanField(default=False)),
+                ('expiring', models.BooleanField(default=False)),
+                ('active', models.BooleanField(default=False)),
+                ('computed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('active', True)), fields=['days_of_cover', 'product'], name='stockalert_active_idx')],
+            },
+        ),
+        migrations.RunPython(compute_alerts, migrations.RunPython.noop),
+        migrations.RunSQL('ANALYZE mims_stockalert', migrations.RunSQL.noop),
+    ]
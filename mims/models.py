@@ -1,7 +1,47 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.dispatch import Signal
 from django.utils import timezone
-from django.db.models import Sum, F
-from decimal import Decimal, InvalidOperation
+from django.db.models import Sum, Min, F, Q, Case, When, Value, ExpressionWrapper, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThan, GreaterThanOrEqual
+from decimal import ROUND_CEILING, Decimal, InvalidOperation
+from datetime import datetime, time, timedelta
+import re
+import unicodedata
+
+
+class InsufficientStock(Exception):
+    """Raised when a stock movement would take a product below zero."""
+
+    def __init__(self, products):
+        self.products = products
+        super().__init__("Not enough stock for: " + ", ".join(products))
+
+
+# Sent with day=<date> whenever DailySummary.post changes that day's figures
+summary_changed = Signal()
+
+# Sent with sale_ids=[...] after Sale.apply_payments moves amount_paid in place
+payments_applied = Signal()
+
+# Sent with product_ids=[...] after StockAlert.refresh rewrites those products' alerts
+alerts_refreshed = Signal()
+
+# A product is "low" when fewer than this many full boxes remain
+LOW_STOCK_BOXES = 2
+
+# ...and "expiring soon" when its expiry date falls within this many days
+EXPIRY_WARNING_DAYS = 180
+
+# Reorder points (StockAlert): average daily sales over this many days...
+VELOCITY_WINDOW_DAYS = 28
+# ...times the days a delivery takes to arrive plus a safety margin
+REORDER_LEAD_DAYS = 7
+SAFETY_STOCK_DAYS = 3
+# A purchase order tops stock up to cover this many days beyond the reorder point
+ORDER_CYCLE_DAYS = 14
+
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
@@ -13,25 +53,111 @@ class Product(models.Model):
     bulk_unit = models.CharField(max_length=50, help_text="e.g., Box")
     base_unit = models.CharField(max_length=50, help_text="e.g., Piece")
     conversion_factor = models.PositiveIntegerField(help_text="Sellable Items per Box")
-    expiry_date = models.DateField(null=True, blank=True, help_text="Date when product expires")
+    # Earliest expiry among the lots still on the shelf; kept in step by StockLot
+    expiry_date = models.DateField(null=True, blank=True, help_text="Earliest expiry of the stock on hand")
     barcode = models.CharField(max_length=50, blank=True, null=True, unique=True)
     
     # NOTE: Stores the BUY PRICE OF THE SMALLEST UNIT
     buy_price_per_bulk = models.DecimalField(max_digits=10, decimal_places=2, help_text="Buy Price per Smallest Unit")
     sell_price_per_base = models.DecimalField(max_digits=10, decimal_places=2, help_text="Retail Price per Smallest Unit")
     
-    # Stores the Number of BULK UNITS (Boxes)
-    stock_qty = models.FloatField(default=0, help_text="Current Stock in Boxes") 
+    # Stores the number of BASE UNITS (Pieces); boxes are derived on read
+    stock_base = models.IntegerField(default=0, help_text="Current Stock in Smallest Units")
+
+    class Meta:
+        indexes = [
+            # Expired/expiring alerts and the inventory's expiry filter and sort
+            models.Index(fields=['expiry_date'], name='product_expiry_idx'),
+            # Inventory filtered by category comes back already in name order
+            models.Index(fields=['category', 'name'], name='product_category_name_idx'),
+        ]
+
+    @property
+    def stock_boxes(self):
+        if not self.conversion_factor:
+            return Decimal(0)
+        return (Decimal(self.stock_base) / self.conversion_factor).quantize(Decimal('0.01'))
+
+    @property
+    def is_low_stock(self):
+        return self.stock_base < LOW_STOCK_BOXES * self.conversion_factor
 
     @property
     def stock_value(self):
+        return self.stock_base * self.buy_price_per_bulk
+
+    # --- SQL counterparts of the properties above, for filters and aggregates ---
+    @staticmethod
+    def low_stock_q():
+        return Q(stock_base__lt=F('conversion_factor') * LOW_STOCK_BOXES)
+
+    @staticmethod
+    def expiring_q(today):
+        """Products with an open lot that expires within EXPIRY_WARNING_DAYS (read through the lot expiry index)."""
+        expiring = StockLot.open_lots().filter(expiry_date__lte=today + timedelta(days=EXPIRY_WARNING_DAYS))
+        return Q(pk__in=expiring.values('product_id'))
+
+    @staticmethod
+    def stock_value_expression():
+        return ExpressionWrapper(
+            F('stock_base') * F('buy_price_per_bulk'),
+            output_field=models.DecimalField(max_digits=16, decimal_places=2),
+        )
+
+    @staticmethod
+    def base_units(boxes, conversion_factor):
+        """Converts a box count as typed by staff (may be fractional) to whole base units."""
         try:
-            boxes = Decimal(str(self.stock_qty))
-            items_per_box = Decimal(str(self.conversion_factor))
-            unit_buy_price = Decimal(str(self.buy_price_per_bulk))
-            return boxes * items_per_box * unit_buy_price
-        except (ValueError, TypeError, InvalidOperation):
-            return Decimal(0)
+            return int((Decimal(str(boxes or 0)) * conversion_factor).to_integral_value())
+        except (InvalidOperation, TypeError, ValueError):
+            return 0
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            if adding and self.stock_base > 0:
+                # Opening stock is a lot of its own, so FEFO has something to draw from
+                StockLot.receive(
+                    [StockLot.delivery(self.pk, self.stock_base, self.expiry_date)], using=self._state.db
+                )
+
+    @classmethod
+    def adjust_stock(cls, changes, prevent_oversell=False, using=None):
+        """
+        Applies {product_id: delta_in_base_units} as ONE conditional UPDATE
+        (stock_base = stock_base + delta). The database does the arithmetic, so
+        two tills selling the same item never overwrite each other, and no
+        other column (prices, expiry) is rewritten.
+
+        With prevent_oversell, products that would go below zero are left
+        out by the WHERE clause of that same statement and InsufficientStock
+        is raised, rolling back the whole adjustment.
+        """
+        changes = {pk: int(delta) for pk, delta in changes.items() if delta}
+        if not changes:
+            return
+
+        qs = cls.objects.db_manager(using).filter(pk__in=list(changes))
+        if prevent_oversell:
+            guard = Q()
+            for pk, delta in changes.items():
+                guard |= Q(pk=pk, stock_base__gte=-delta) if delta < 0 else Q(pk=pk)
+            qs = qs.filter(guard)
+
+        delta_expr = Case(
+            *[When(pk=pk, then=Value(delta)) for pk, delta in changes.items()],
+            default=Value(0),
+            output_field=models.IntegerField(),
+        )
+        with transaction.atomic(using=qs.db):
+            updated = qs.update(stock_base=F('stock_base') + delta_expr)
+            if prevent_oversell and updated != len(changes):
+                short = [
+                    p.name for p in cls.objects.db_manager(using).filter(pk__in=list(changes))
+                    if p.stock_base + changes[p.pk] < 0
+                ]
+                raise InsufficientStock(short)
 
     def __str__(self):
         return self.name
@@ -41,26 +167,326 @@ class Purchase(models.Model):
     quantity_bulk = models.PositiveIntegerField()
     purchase_date = models.DateTimeField(default=timezone.now)
     total_cost = models.DecimalField(max_digits=10, decimal_places=2)
+    expiry_date = models.DateField(null=True, blank=True, help_text="Expiry printed on this delivery")
+
+    class Meta:
+        indexes = [
+            # Report date ranges
+            models.Index(fields=['purchase_date'], name='purchase_date_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            adding = not self.pk
+            if adding:
+                Product.adjust_stock({self.product_id: self.quantity_bulk * self.product.conversion_factor})
+            super().save(*args, **kwargs)
+            if adding:
+                StockLot.receive([StockLot.delivery(
+                    self.product_id, self.quantity_bulk * self.product.conversion_factor, self.expiry_date,
+                    purchase=self,
+                )])
+
+
+class StockLot(models.Model):
+    """
+    One delivery of a product: how much of it is left and when it expires.
+
+    Product.stock_base stays the figure every till reads and updates; lots
+    say which physical stock that is. Sales draw lots down first-expiry-
+    first-out (allocate), deliveries add lots (receive), and both keep
+    Product.expiry_date at the earliest expiry still on the shelf. Empty
+    lots are kept as the delivery history.
+    """
+    product = models.ForeignKey(Product, related_name='lots', on_delete=models.CASCADE)
+    purchase = models.ForeignKey(Purchase, related_name='lots', null=True, blank=True, on_delete=models.SET_NULL)
+    received_at = models.DateTimeField(default=timezone.now)
+    expiry_date = models.DateField(null=True, blank=True)
+    quantity_received = models.PositiveIntegerField(help_text="Small units delivered")
+    quantity_base = models.IntegerField(help_text="Small units of this lot still on the shelf")
+
+    class Meta:
+        indexes = [
+            # Expired and expiring-soon lists; partial, so sold-out lots never bloat it
+            models.Index(
+                fields=['expiry_date', 'product'], condition=Q(quantity_base__gt=0), name='stocklot_open_expiry_idx',
+            ),
+            # FEFO order within a product, for allocation at checkout
+            models.Index(
+                fields=['product', 'expiry_date', 'id'], condition=Q(quantity_base__gt=0), name='stocklot_fefo_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.product} x{self.quantity_base} (exp. {self.expiry_date or 'none'})"
+
+    @classmethod
+    def open_lots(cls):
+        return cls.objects.filter(quantity_base__gt=0)
+
+    @classmethod
+    def delivery(cls, product_id, quantity_base, expiry_date, purchase=None):
+        """An unsaved lot for quantity_base units arriving now."""
+        return cls(
+            product_id=product_id, purchase=purchase, expiry_date=expiry_date,
+            quantity_received=quantity_base, quantity_base=quantity_base,
+        )
+
+    @classmethod
+    def receive(cls, lots, using=None):
+        """Saves new lots in one INSERT. Product.stock_base is the caller's to adjust."""
+        lots = [lot for lot in lots if lot.quantity_base > 0]
+        if lots:
+            cls.objects.db_manager(using).bulk_create(lots)
+            cls.sync_expiry({lot.product_id for lot in lots}, using=using)
+
+    @classmethod
+    def allocate(cls, demand, using=None):
+        """
+        Draws {product_id: base_units} from the open lots, soonest expiry
+        first (lots without an expiry last, ties by age), in two statements
+        for any basket: one ordered read of the products' open lots and one
+        UPDATE that sets every touched lot at once. Returns the units no lot
+        could cover, {product_id: shortfall}; what the shelf is allowed to go
+        below zero is Product.adjust_stock's business, not this method's.
+
+        Call it inside the transaction that moved Product.stock_base for the
+        same products: that UPDATE is what serialises two tills selling them.
+        """
+        remaining = {pk: int(qty) for pk, qty in demand.items() if qty > 0}
+        if not remaining:
+            return {}
+        # Read in stocklot_fefo_idx order, where undated lots come first; they are
+        # moved behind the dated ones here, since a NULLS LAST sort would cost a
+        # temporary B-tree in SQL. The sort is stable, so expiry and age order hold.
+        lots = sorted(
+            cls.objects.db_manager(using).filter(product_id__in=list(remaining), quantity_base__gt=0)
+            .order_by('product_id', 'expiry_date', 'pk')
+            .values_list('pk', 'product_id', 'quantity_base', 'expiry_date'),
+            key=lambda lot: (lot[1], lot[3] is None),
+        )
+        taken = {}
+        emptied = set()
+        for pk, product_id, on_hand, _ in lots:
+            want = remaining[product_id]
+            if want:
+                take = min(want, on_hand)
+                taken[pk] = take
+                remaining[product_id] = want - take
+                if take == on_hand:
+                    emptied.add(product_id)
+        if taken:
+            cls.objects.db_manager(using).filter(pk__in=list(taken)).update(quantity_base=F('quantity_base') - Case(
+                *[When(pk=pk, then=Value(take)) for pk, take in taken.items()],
+                default=Value(0),
+                output_field=models.IntegerField(),
+            ))
+        # The earliest expiry only moves when a lot runs out
+        cls.sync_expiry(emptied, using=using)
+        return {pk: short for pk, short in remaining.items() if short}
+
+    @classmethod
+    def sync_expiry(cls, product_ids, using=None):
+        """Sets Product.expiry_date to the earliest open lot (None when none is left), in one UPDATE."""
+        if not product_ids:
+            return
+        earliest = (
+            cls.objects.filter(product=OuterRef('pk'), quantity_base__gt=0)
+            .values('product').annotate(earliest=Min('expiry_date')).values('earliest')
+        )
+        Product.objects.db_manager(using).filter(pk__in=list(product_ids)).update(expiry_date=Subquery(earliest))
+
+    @classmethod
+    def recount(cls, product, expiry_date=None):
+        """
+        Brings a product's open lots in line with a stock_base typed in by
+        hand (the edit form). Extra stock becomes a new lot expiring on
+        expiry_date; missing stock is drawn down FEFO like a sale. When the
+        count adds nothing, a changed expiry_date re-dates the lots that
+        carry the earliest expiry on record (a corrected label).
+        """
+        with transaction.atomic():
+            on_shelf = cls.open_lots().filter(product=product).aggregate(t=Sum('quantity_base'))['t'] or 0
+            counted = max(product.stock_base, 0)
+            if counted > on_shelf:
+                cls.receive([cls.delivery(product.pk, counted - on_shelf, expiry_date)])
+            else:
+                cls.allocate({product.pk: on_shelf - counted})
+                if expiry_date and expiry_date != product.expiry_date:
+                    earliest = cls.open_lots().filter(product=product)
+                    earliest = earliest.filter(expiry_date=product.expiry_date) if product.expiry_date else earliest
+                    earliest.update(expiry_date=expiry_date)
+                    cls.sync_expiry([product.pk])
+        # A hand count is rare; bring its alert up to date now rather than tonight
+        StockAlert.refresh([product.pk])
+
+    def write_off(self):
+        """Takes what is left of this lot off the shelf and out of stock, e.g. when it is disposed of."""
+        with transaction.atomic():
+            left = StockLot.objects.select_for_update().filter(pk=self.pk).values_list('quantity_base', flat=True).get()
+            if left > 0:
+                StockLot.objects.filter(pk=self.pk).update(quantity_base=0)
+                Product.adjust_stock({self.product_id: -left})
+                StockLot.sync_expiry([self.product_id])
+                StockAlert.refresh([self.product_id])
+            self.quantity_base = 0
+            return left
+
+def customer_key(name):
+    """Spelling-insensitive lookup key: 'Mama  Asha.' and 'mama asha' are the same debtor."""
+    folded = unicodedata.normalize('NFKD', name or '').encode('ascii', 'ignore').decode().casefold()
+    return ' '.join(re.findall(r'[0-9a-z]+', folded))
+
+
+def phone_key(phone):
+    """Last 9 digits, so 0712 345 678 and +255 712 345 678 match."""
+    digits = re.sub(r'\D', '', phone or '')
+    return digits[-9:]
+
+
+WALK_IN_KEYS = {'', 'walk in', 'walkin', 'walk in customer', 'general client'}
+
+
+class Customer(models.Model):
+    name = models.CharField(max_length=200)
+    name_key = models.CharField(max_length=200, unique=True, editable=False)
+    phone = models.CharField(max_length=30, blank=True)
+    phone_key = models.CharField(max_length=9, blank=True, db_index=True, editable=False)
+    # Sum of balance_due over this customer's sales, kept current by refresh_balances()
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+
+    class Meta:
+        ordering = ['name']
+        indexes = [
+            models.Index(fields=['-balance'], condition=Q(balance__gt=0), name='customer_owing_idx'),
+        ]
 
     def save(self, *args, **kwargs):
-        if not self.pk: 
-            self.product.stock_qty += self.quantity_bulk
-            self.product.save()
+        self.name = ' '.join(self.name.split())
+        self.name_key = customer_key(self.name)
+        self.phone_key = phone_key(self.phone)
         super().save(*args, **kwargs)
 
+    @classmethod
+    def for_name(cls, name, phone=''):
+        """The customer a sale typed as `name` belongs to, created on first use. None for walk-ins."""
+        key = customer_key(name)
+        if key in WALK_IN_KEYS:
+            return None
+        customer, created = cls.objects.get_or_create(name_key=key, defaults={'name': name, 'phone': phone})
+        if phone and not created and not customer.phone:
+            customer.phone = phone
+            customer.save(update_fields=['phone', 'phone_key'])
+        return customer
+
+    @classmethod
+    def refresh_balances(cls, customer_ids, using=None):
+        """
+        Re-derives balance for the given customers (ids or a values() subquery)
+        in ONE UPDATE, summing balance_due over their sales in the database.
+        Called wherever a sale's total or amount paid changes.
+        """
+        owed = Sale.objects.filter(customer=OuterRef('pk')).order_by().values('customer').annotate(
+            total=Sum('balance_due')
+        ).values('total')
+        cls.objects.db_manager(using).filter(pk__in=customer_ids).update(
+            balance=Coalesce(Subquery(owed), Value(Decimal(0)), output_field=models.DecimalField(max_digits=12, decimal_places=2))
+        )
+
+    def __str__(self):
+        return self.name
+
+
 class Sale(models.Model):
     PAYMENT_CHOICES = [('PAID', 'Paid'), ('LOAN', 'Loan'), ('PARTIAL', 'Partial')]
     sale_date = models.DateTimeField(default=timezone.now)
     customer_name = models.CharField(max_length=200, blank=True, null=True)
+    customer = models.ForeignKey(Customer, related_name='sales', on_delete=models.SET_NULL, null=True, blank=True)
     payment_status = models.CharField(max_length=10, choices=PAYMENT_CHOICES, default='PAID')
     subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     discount_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     amount_paid = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Computed and stored by the database, so debtor queries can use the index below.
+    # Like any DB-side value it is only current after a (re)load of the row.
+    balance_due = models.GeneratedField(
+        expression=F('total_amount') - F('amount_paid'),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        db_persist=True,
+    )
 
-    @property
-    def balance_due(self):
-        return self.total_amount - self.amount_paid
+    class Meta:
+        indexes = [
+            # Ledger order; keyset pagination walks this index backwards
+            models.Index(fields=['sale_date', 'id'], name='sale_date_id_idx'),
+            # Partial: only open debts are indexed, so it stays small as paid sales pile up
+            models.Index(
+                fields=['sale_date', 'balance_due'],
+                condition=Q(balance_due__gt=0),
+                name='sale_outstanding_idx',
+            ),
+            # One customer's open debts, oldest first (payments) or newest first (loans page)
+            models.Index(
+                fields=['customer', 'sale_date'],
+                condition=Q(balance_due__gt=0),
+                name='sale_customer_open_idx',
+            ),
+        ]
+
+    @staticmethod
+    def outstanding_q():
+        return Q(balance_due__gt=0)
+
+    @classmethod
+    def apply_payments(cls, amounts, using=None):
+        """
+        Adds {sale_id: amount} to amount_paid and re-derives payment_status,
+        for every sale at once, in ONE UPDATE. Both columns are computed from
+        the row as it is in the database, so concurrent payments add up
+        instead of overwriting each other. Negative amounts reverse a payment.
+        """
+        amounts = {pk: Decimal(str(amount)) for pk, amount in amounts.items() if amount}
+        if not amounts:
+            return
+        money = models.DecimalField(max_digits=10, decimal_places=2)
+        paid = F('amount_paid') + Case(
+            *[When(pk=pk, then=Value(amount, output_field=money)) for pk, amount in amounts.items()],
+            default=Value(Decimal(0), output_field=money),
+            output_field=money,
+        )
+        sales = cls.objects.db_manager(using).filter(pk__in=list(amounts))
+        sales.update(
+            amount_paid=paid,
+            payment_status=Case(
+                When(GreaterThanOrEqual(paid, F('total_amount')), then=Value('PAID')),
+                When(GreaterThan(paid, 0), then=Value('PARTIAL')),
+                default=Value('LOAN'),
+            ),
+        )
+        Customer.refresh_balances(sales.exclude(customer=None).values('customer_id'), using=using)
+        payments_applied.send(sender=cls, sale_ids=list(amounts))
+
+    def save(self, *args, **kwargs):
+        # No savepoint: the balance refresh only ever commits or fails with the row itself
+        with transaction.atomic(savepoint=False):
+            previous = None
+            if self.pk:
+                previous = Sale.objects.filter(pk=self.pk).values('customer_id', 'total_amount', 'amount_paid').first()
+            super().save(*args, **kwargs)
+            if previous:
+                # Edits made outside checkout and the payment paths (the admin's editable
+                # amount_paid, calculate_sale_totals) are posted as differences
+                update_fields = kwargs.get('update_fields')
+                totals = {
+                    summary_field: Decimal(str(getattr(self, field))) - previous[field]
+                    for field, summary_field in (('total_amount', 'revenue'), ('amount_paid', 'cash_collected'))
+                    if update_fields is None or field in update_fields
+                }
+                if any(totals.values()):
+                    DailySummary.post(business_day(self.sale_date), totals=totals)
+            customers = {previous and previous['customer_id'], self.customer_id} - {None}
+            if customers:
+                Customer.refresh_balances(customers)
 
     def update_status(self):
         if self.amount_paid >= self.total_amount:
@@ -75,12 +501,16 @@ class Sale(models.Model):
         aggregate = self.items.aggregate(
             total=Sum(F('quantity_base') * F('price_at_sale'))
         )
+        previous_total = Sale.objects.filter(pk=self.pk).values_list('total_amount', flat=True).first() or 0
         self.subtotal = aggregate['total'] or 0
         self.total_amount = self.subtotal - self.discount_amount
         Sale.objects.filter(pk=self.pk).update(
             subtotal=self.subtotal, 
             total_amount=self.total_amount
         )
+        DailySummary.post(business_day(self.sale_date), totals={'revenue': self.total_amount - previous_total})
+        if self.customer_id:
+            Customer.refresh_balances([self.customer_id])
 
     def __str__(self):
         return f"Sale {self.id} - {self.customer_name}"
@@ -92,31 +522,76 @@ class PaymentRecord(models.Model):
     payment_method = models.CharField(max_length=50, default='CASH')
     note = models.CharField(max_length=255, blank=True)
 
+    class Meta:
+        indexes = [
+            # Cash-flow report and payment export date ranges
+            models.Index(fields=['date_paid', 'id'], name='payment_date_paid_idx'),
+        ]
+
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        total = PaymentRecord.objects.filter(sale=self.sale).aggregate(Sum('amount_received'))['amount_received__sum'] or 0
-        self.sale.amount_paid = total
-        self.sale.update_status()
+        with transaction.atomic():
+            previous = PaymentRecord.objects.filter(pk=self.pk).first() if self.pk else None
+            super().save(*args, **kwargs)
+            amount = Decimal(str(self.amount_received))
+            # Incremental: only this payment's amount (or the change to it) is applied
+            changes = {self.sale_id: amount}
+            if previous is not None:
+                changes[previous.sale_id] = changes.get(previous.sale_id, 0) - previous.amount_received
+                DailySummary.post(business_day(previous.date_paid), totals={'cash_collected': -previous.amount_received})
+            Sale.apply_payments(changes)
+            DailySummary.post(business_day(self.date_paid), totals={'cash_collected': amount})
 
 class SaleItem(models.Model):
     sale = models.ForeignKey(Sale, related_name='items', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity_base = models.PositiveIntegerField(help_text="Small units sold")
     price_at_sale = models.DecimalField(max_digits=10, decimal_places=2)
+    cost_at_sale = models.DecimalField(
+        max_digits=10, decimal_places=2,
+        help_text="Buy price per smallest unit when sold; later price changes leave it alone",
+    )
+
+    class Meta:
+        indexes = [
+            # Covers the profit sums per sale, so they never read the product table
+            models.Index(fields=['sale', 'price_at_sale', 'cost_at_sale', 'quantity_base'], name='saleitem_profit_idx'),
+        ]
+
+    @property
+    def line_total(self):
+        return self.quantity_base * self.price_at_sale
+
+    def line_figures(self, sign=1):
+        """This line's contribution to DailySummary, negated with sign=-1."""
+        revenue = self.line_total
+        cost = self.quantity_base * self.cost_at_sale
+        return {
+            'revenue': sign * revenue,
+            'cost_of_goods': sign * cost,
+            'profit': sign * (revenue - cost),
+            'quantity_base': sign * self.quantity_base,
+        }
 
     def save(self, *args, **kwargs):
-        if not self.pk:
-            try:
-                qty_sold = Decimal(str(self.quantity_base))
-                conv_rate = Decimal(str(self.product.conversion_factor))
-                reduction = qty_sold / conv_rate
-                current_stock = Decimal(str(self.product.stock_qty))
-                self.product.stock_qty = float(current_stock - reduction)
-                self.product.save()
-            except (ZeroDivisionError, InvalidOperation, TypeError):
-                pass 
-        super().save(*args, **kwargs)
-        self.sale.update_totals()
+        with transaction.atomic():
+            if not self.pk:
+                if self.cost_at_sale is None:
+                    self.cost_at_sale = self.product.buy_price_per_bulk
+                Product.adjust_stock(
+                    {self.product_id: -self.quantity_base},
+                    prevent_oversell=getattr(settings, 'MIMS_PREVENT_OVERSELL', False),
+                )
+                StockLot.allocate({self.product_id: self.quantity_base})
+                previous = None
+            else:
+                previous = SaleItem.objects.filter(pk=self.pk).first()
+            super().save(*args, **kwargs)
+            self.sale.update_totals()
+
+            day = business_day(self.sale.sale_date)
+            if previous is not None:
+                DailySummary.post_lines(day, [previous.line_figures(sign=-1)], [previous.product_id])
+            DailySummary.post_lines(day, [self.line_figures()], [self.product_id])
         
 class Loan(Sale):
     class Meta:
@@ -127,4 +602,236 @@ class Loan(Sale):
 class Expense(models.Model):
     description = models.CharField(max_length=255)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
-    date = models.DateField(default=timezone.now)
\ No newline at end of file
+    date = models.DateField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Today's expenses, the newest-first list and exports; rows of a day stay in id order
+            models.Index(fields=['date', 'id'], name='expense_date_id_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = Expense.objects.filter(pk=self.pk).values('date', 'amount').first() if self.pk else None
+            super().save(*args, **kwargs)
+            if previous:
+                DailySummary.post(previous['date'], totals={'expenses': -previous['amount']})
+            DailySummary.post(self.date, totals={'expenses': Decimal(str(self.amount))})
+
+
+def business_day(moment):
+    """The local calendar day a timestamp is booked under."""
+    return timezone.localdate(moment) if timezone.is_aware(moment) else moment.date()
+
+
+def start_of_day(day):
+    """First instant of a business day, for range filters on DateTimeFields."""
+    moment = datetime.combine(day, time.min)
+    return timezone.make_aware(moment) if settings.USE_TZ else moment
+
+
+class DailySummary(models.Model):
+    """
+    Running totals per business day, kept up to date by SaleItem,
+    PaymentRecord and Expense writes so dashboards and reports read a few
+    small rows instead of re-aggregating every sale line.
+
+    The row with product=None holds the day's totals. Rows with a product
+    hold that product's sales for the day (revenue here is line revenue,
+    before any sale-level discount). `manage.py rebuild_daily_summary`
+    recomputes everything from the raw tables.
+    """
+    day = models.DateField()
+    product = models.ForeignKey(Product, null=True, blank=True, on_delete=models.CASCADE)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cost_of_goods = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    profit = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    quantity_base = models.IntegerField(default=0, help_text="Small units sold")
+    cash_collected = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    expenses = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name_plural = "Daily summaries"
+        constraints = [
+            models.UniqueConstraint(fields=['day'], condition=Q(product__isnull=True), name='unique_daily_total'),
+            models.UniqueConstraint(fields=['day', 'product'], name='unique_daily_product'),
+        ]
+
+    @classmethod
+    def post(cls, day, totals=None, per_product=None):
+        """
+        Adds {field: delta} to the day's totals row and {product_id: {field: delta}}
+        to the per-product rows, creating missing rows first. Costs the same
+        few queries however many products are touched.
+        """
+        rows = {None: totals or {}}
+        rows.update(per_product or {})
+        rows = {
+            pk: {field: delta for field, delta in deltas.items() if delta}
+            for pk, deltas in rows.items()
+        }
+        rows = {pk: deltas for pk, deltas in rows.items() if deltas}
+        if not rows:
+            return
+
+        def row_q(pk):
+            return Q(product__isnull=True) if pk is None else Q(product_id=pk)
+
+        match = Q(product__isnull=True) if None in rows else Q(pk__in=[])
+        product_ids = [pk for pk in rows if pk is not None]
+        if product_ids:
+            match |= Q(product_id__in=product_ids)
+
+        # No savepoint: a failed posting must abort the write that caused it
+        with transaction.atomic(savepoint=False):
+            qs = cls.objects.filter(match, day=day)
+            existing = set(qs.values_list('product_id', flat=True))
+            missing = [cls(day=day, product_id=pk) for pk in rows if pk not in existing]
+            if missing:
+                cls.objects.bulk_create(missing)
+
+            updates = {}
+            for field in {field for deltas in rows.values() for field in deltas}:
+                output_field = cls._meta.get_field(field)
+                updates[field] = F(field) + Case(
+                    *[When(row_q(pk), then=Value(deltas[field], output_field=output_field))
+                      for pk, deltas in rows.items() if field in deltas],
+                    default=Value(0, output_field=output_field),
+                    output_field=output_field,
+                )
+            qs.update(**updates)
+        summary_changed.send(sender=cls, day=day)
+
+    @classmethod
+    def post_lines(cls, day, figures, product_ids, totals=None):
+        """
+        Posts SaleItem.line_figures() to the product rows and their sum to the
+        day row, together with any extra day totals (e.g. cash taken upfront).
+        """
+        totals = dict(totals or {})
+        per_product = {}
+        for pk, line in zip(product_ids, figures):
+            row = per_product.setdefault(pk, {})
+            for field, delta in line.items():
+                row[field] = row.get(field, 0) + delta
+                if field != 'revenue':  # day revenue follows Sale.total_amount instead
+                    totals[field] = totals.get(field, 0) + delta
+        cls.post(day, totals=totals, per_product=per_product)
+
+    def __str__(self):
+        return f"{self.day} - {self.product or 'All products'}"
+
+
+class StockAlert(models.Model):
+    """
+    Precomputed reorder and expiry status per product, read by the
+    purchase-order page and the notification badge instead of evaluating
+    a rule over every product on each request.
+
+    The reorder point comes from how fast the product actually sells:
+    average daily sales over the last VELOCITY_WINDOW_DAYS (from the
+    per-product DailySummary rows) times REORDER_LEAD_DAYS +
+    SAFETY_STOCK_DAYS. `manage.py refresh_stock_alerts` recomputes the
+    products touched on the day (run it nightly); --full recomputes all.
+    """
+    product = models.OneToOneField(Product, primary_key=True, related_name='alert', on_delete=models.CASCADE)
+    avg_daily_sales = models.DecimalField(max_digits=12, decimal_places=3, help_text="Small units per day")
+    reorder_point = models.IntegerField(help_text="Small units; reorder at or below this")
+    days_of_cover = models.DecimalField(
+        max_digits=10, decimal_places=1, null=True, blank=True,
+        help_text="Days the stock lasts at the current rate; empty when nothing sold in the window",
+    )
+    reorder = models.BooleanField(default=False)
+    expiring = models.BooleanField(default=False)
+    # reorder OR expiring, stored so the page reads one partial index
+    active = models.BooleanField(default=False)
+    computed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Active alerts, most urgent (least cover) first
+            models.Index(fields=['days_of_cover', 'product'], condition=Q(active=True), name='stockalert_active_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product}: reorder at {self.reorder_point}, {self.days_of_cover} days of cover"
+
+    @classmethod
+    def active_alerts(cls):
+        return cls.objects.filter(active=True)
+
+    @property
+    def suggested_boxes(self):
+        """Boxes that bring stock back to the reorder point plus ORDER_CYCLE_DAYS of sales."""
+        product = self.product
+        target = self.reorder_point + self.avg_daily_sales * ORDER_CYCLE_DAYS
+        short = max(target - max(product.stock_base, 0), 0)
+        if not product.conversion_factor:
+            return 0
+        return int((Decimal(short) / product.conversion_factor).to_integral_value(rounding=ROUND_CEILING))
+
+    @classmethod
+    def touched_on(cls, day):
+        """
+        Products whose alert can have changed on `day`: sold that day, sold on
+        the day that just left the velocity window, restocked that day, or
+        holding a lot inside the expiry warning window that their alert does
+        not flag yet (so lots that crossed over on a skipped night still count).
+        """
+        sold = DailySummary.objects.filter(
+            product__isnull=False, day__in=[day, day - timedelta(days=VELOCITY_WINDOW_DAYS)],
+        ).values_list('product_id', flat=True)
+        received = StockLot.objects.filter(
+            received_at__gte=start_of_day(day), received_at__lt=start_of_day(day + timedelta(days=1)),
+        ).values_list('product_id', flat=True)
+        dated = StockLot.open_lots().filter(
+            expiry_date__lte=day + timedelta(days=EXPIRY_WARNING_DAYS),
+        ).exclude(product__alert__expiring=True).values_list('product_id', flat=True)
+        return set(sold) | set(received) | set(dated)
+
+    @classmethod
+    def refresh(cls, product_ids=None, today=None):
+        """
+        Recomputes the alerts of product_ids (every product when None) in a
+        fixed number of queries: one grouped read of the window's sales, one
+        of the expiring lots, one of the products' stock, and one upsert per
+        500 products. Returns the number of alerts written.
+        """
+        today = today or timezone.localdate()
+        products = Product.objects.all()
+        sales = DailySummary.objects.filter(
+            product__isnull=False, day__gt=today - timedelta(days=VELOCITY_WINDOW_DAYS), day__lte=today,
+        )
+        expiring = StockLot.open_lots().filter(expiry_date__lte=today + timedelta(days=EXPIRY_WARNING_DAYS))
+        if product_ids is not None:
+            product_ids = list(product_ids)
+            if not product_ids:
+                return 0
+            products = products.filter(pk__in=product_ids)
+            sales = sales.filter(product_id__in=product_ids)
+            expiring = expiring.filter(product_id__in=product_ids)
+
+        sold = dict(sales.values('product_id').annotate(t=Sum('quantity_base')).values_list('product_id', 't'))
+        expiring = set(expiring.values_list('product_id', flat=True))
+        now = timezone.now()
+        alerts = []
+        for pk, stock in products.values_list('pk', 'stock_base').iterator():
+            avg = Decimal(sold.get(pk) or 0) / VELOCITY_WINDOW_DAYS
+            reorder_point = int((avg * (REORDER_LEAD_DAYS + SAFETY_STOCK_DAYS)).to_integral_value(rounding=ROUND_CEILING))
+            reorder = stock <= reorder_point
+            alerts.append(cls(
+                product_id=pk,
+                avg_daily_sales=avg.quantize(Decimal('0.001')),
+                reorder_point=reorder_point,
+                days_of_cover=(Decimal(max(stock, 0)) / avg).quantize(Decimal('0.1')) if avg else None,
+                reorder=reorder,
+                expiring=pk in expiring,
+                active=reorder or pk in expiring,
+                computed_at=now,
+            ))
+        cls.objects.bulk_create(
+            alerts, batch_size=500, update_conflicts=True, unique_fields=['product'],
+            update_fields=['avg_daily_sales', 'reorder_point', 'days_of_cover', 'reorder', 'expiring', 'active', 'computed_at'],
+        )
+        alerts_refreshed.send(sender=cls, product_ids=[alert.product_id for alert in alerts])
+        return len(alerts)
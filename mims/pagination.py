@@ -0,0 +1,84 @@
+import base64
+from dataclasses import dataclass, field
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(row, date_field):
+    raw = f"{getattr(row, date_field).isoformat()}|{row.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Returns (datetime, pk), or None for a missing or tampered cursor."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        moment, pk = raw.rsplit('|', 1)
+        moment = parse_datetime(moment)
+        return (moment, int(pk)) if moment else None
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+@dataclass
+class KeysetPage:
+    object_list: list = field(default_factory=list)
+    next_cursor: str = None
+    previous_cursor: str = None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def keyset_page(queryset, date_field, page_size, after=None, before=None):
+    """
+    Newest-first page of `queryset`, positioned by a cursor instead of an OFFSET.
+
+    Rows are ordered by (date_field, pk) descending. `after` continues past
+    the last row of the previous page, `before` steps back towards newer
+    rows. Each page is a single indexed range scan of page_size + 1 rows,
+    so page 500 costs the same as page 1 and no COUNT(*) is ever run.
+    """
+    after, before = decode_cursor(after), decode_cursor(before)
+
+    if before:
+        moment, pk = before
+        rows = list(
+            queryset.filter(**{f'{date_field}__gte': moment})
+            .filter(Q(**{f'{date_field}__gt': moment}) | Q(pk__gt=pk))
+            .order_by(date_field, 'pk')[:page_size + 1]
+        )
+        more_newer = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        has_newer, has_older = more_newer, True
+    else:
+        if after:
+            moment, pk = after
+            # The plain bound gives SQLite a range on the index; the OR breaks ties
+            queryset = queryset.filter(**{f'{date_field}__lte': moment}).filter(
+                Q(**{f'{date_field}__lt': moment}) | Q(pk__lt=pk)
+            )
+        rows = list(queryset.order_by(f'-{date_field}', '-pk')[:page_size + 1])
+        has_older = len(rows) > page_size
+        rows = rows[:page_size]
+        has_newer = after is not None
+
+    return KeysetPage(
+        object_list=rows,
+        next_cursor=encode_cursor(rows[-1], date_field) if rows and has_older else None,
+        previous_cursor=encode_cursor(rows[0], date_field) if rows and has_newer else None,
+    )
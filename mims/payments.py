@@ -0,0 +1,72 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Customer, DailySummary, PaymentRecord, Sale, business_day, customer_key
+
+
+class PaymentError(Exception):
+    """A payment that cannot be recorded; the message is shown to the cashier."""
+
+
+def open_sales_for(customer):
+    """The customer's unpaid sales, oldest first (the order payments are applied in)."""
+    return Sale.objects.filter(Sale.outstanding_q(), customer=customer).order_by('sale_date', 'pk')
+
+
+@transaction.atomic
+def allocate_payment(customer_name, amount, note='', payment_method='CASH', date_paid=None):
+    """
+    Spreads one lump-sum payment over a customer's open sales, oldest first.
+
+    Everything happens in one transaction and a fixed number of queries
+    however many invoices are settled:
+      1. one SELECT of the customer (their balance is kept on the row),
+      2. one SELECT of the open sales (balance_due is a stored column),
+      3. one bulk INSERT of the PaymentRecord rows,
+      4. one UPDATE incrementing amount_paid and re-deriving payment_status,
+         and one refreshing the customer's balance,
+      5. one DailySummary posting for the cash taken.
+
+    Returns a list of (sale, amount_applied). Raises PaymentError for an
+    invalid amount, a customer with nothing owing, or an overpayment.
+    """
+    try:
+        amount = Decimal(str(amount))
+    except (InvalidOperation, TypeError, ValueError):
+        raise PaymentError("Invalid amount entered.")
+    if not amount.is_finite():
+        raise PaymentError("Invalid amount entered.")
+    if amount <= 0:
+        raise PaymentError("Please enter a valid amount.")
+
+    customer = Customer.objects.filter(name_key=customer_key(customer_name)).first()
+    if customer is None or customer.balance <= 0:
+        raise PaymentError(f"{customer_name} has no outstanding balance.")
+    if amount > customer.balance:
+        raise PaymentError(f"Payment (Tsh {amount}) exceeds balance (Tsh {customer.balance}).")
+
+    open_sales = list(open_sales_for(customer).select_for_update())
+
+    date_paid = date_paid or timezone.now()
+    allocations = []
+    remaining = amount
+    for sale in open_sales:
+        if remaining <= 0:
+            break
+        applied = min(remaining, sale.balance_due)
+        allocations.append((sale, applied))
+        remaining -= applied
+
+    PaymentRecord.objects.bulk_create([
+        PaymentRecord(
+            sale=sale, amount_received=applied, date_paid=date_paid,
+            payment_method=payment_method, note=note,
+        )
+        for sale, applied in allocations
+    ])
+    # bulk_create skips PaymentRecord.save, so post the increments ourselves
+    Sale.apply_payments({sale.pk: applied for sale, applied in allocations})
+    DailySummary.post(business_day(date_paid), totals={'cash_collected': amount})
+    return allocations
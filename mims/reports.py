@@ -0,0 +1,180 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import DateField, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from .models import DailySummary, Purchase, start_of_day
+
+BUCKETS = ('day', 'week', 'month')
+
+# Most buckets one report may span: about three years of days
+MAX_BUCKETS = 1100
+
+# Latest day a report may cover; bucket arithmetic steps up to a month past it
+LAST_REPORT_DAY = date.max - timedelta(days=32)
+
+# Figures read per bucket; the rest of a report row is derived from these
+SUMMARY_FIELDS = ('revenue', 'cost_of_goods', 'profit', 'cash_collected', 'expenses')
+
+_GENERATION_KEY = 'mims:report:generation'
+
+
+def bucket_start(day, size):
+    if size == 'week':
+        return day - timedelta(days=day.weekday())
+    if size == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def bucket_end(start, size):
+    """First day of the next bucket (exclusive end)."""
+    if size == 'week':
+        return start + timedelta(days=7)
+    if size == 'month':
+        return date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start + timedelta(days=1)
+
+
+def bucket_count(start, end, size):
+    """Number of `size` buckets a report over [start, end] has, without walking them."""
+    start, end = min(start, end), max(start, end)
+    if size == 'week':
+        return (bucket_start(end, size) - bucket_start(start, size)).days // 7 + 1
+    if size == 'month':
+        return (end.year - start.year) * 12 + end.month - start.month + 1
+    return (end - start).days + 1
+
+
+def _generation():
+    return cache.get_or_set(_GENERATION_KEY, 0, timeout=None)
+
+
+def _key(size, start, generation):
+    return f"mims:report:{generation}:{size}:{start.isoformat()}"
+
+
+def invalidate_days(days):
+    """Forgets the cached day/week/month buckets containing any of `days` (a back-dated edit)."""
+    generation = _generation()
+    cache.delete_many([
+        _key(size, bucket_start(day, size), generation) for day in set(days) for size in BUCKETS
+    ])
+
+
+def invalidate_all():
+    """Drops every cached bucket at once, e.g. after rebuild_daily_summary."""
+    try:
+        cache.incr(_GENERATION_KEY)
+    except ValueError:
+        cache.set(_GENERATION_KEY, 1, timeout=None)
+
+
+def _row(figures, purchases):
+    revenue = figures['revenue']
+    cash_in = figures['cash_collected']
+    expenses = figures['expenses']
+    return {
+        'revenue': revenue,
+        'cash_in': cash_in,
+        'cost_of_goods': figures['cost_of_goods'],
+        'gross_profit': figures['profit'],
+        'net_profit': figures['profit'] - expenses,
+        'purchases': purchases,
+        'expenses': expenses,
+        'paper_profit': revenue - (purchases + expenses),
+        'cash_flow': cash_in - (purchases + expenses),
+        'outstanding_loans': revenue - cash_in,
+    }
+
+
+def _compute(first, last, size):
+    """
+    Figures for every bucket overlapping [first, last], from ONE grouped query
+    on DailySummary and ONE on Purchase. Keyed by bucket start.
+    """
+    empty = {field: Decimal(0) for field in SUMMARY_FIELDS}
+    found = {}
+
+    summary = DailySummary.objects.filter(
+        product__isnull=True, day__gte=first, day__lte=last,
+    ).annotate(
+        bucket=Trunc('day', size, output_field=DateField())
+    ).values('bucket').annotate(**{field: Sum(field) for field in SUMMARY_FIELDS}).order_by()
+    for row in summary:
+        found[row['bucket']] = {field: row[field] or Decimal(0) for field in SUMMARY_FIELDS}
+
+    purchases = {}
+    spent = Purchase.objects.filter(
+        purchase_date__gte=start_of_day(first), purchase_date__lt=start_of_day(last + timedelta(days=1)),
+    ).annotate(
+        bucket=Trunc('purchase_date', size, output_field=DateField())
+    ).values('bucket').annotate(total=Sum('total_cost')).order_by()
+    for row in spent:
+        purchases[row['bucket']] = row['total'] or Decimal(0)
+
+    return {
+        bucket: _row(found.get(bucket, empty), purchases.get(bucket, Decimal(0)))
+        for bucket in set(found) | set(purchases)
+    }
+
+
+def financial_report(start, end, size='day'):
+    """
+    Revenue, cash, costs and profit for [start, end] (local dates, inclusive),
+    one row per `size` bucket ('day', 'week' or 'month'), empty buckets included.
+
+    A bucket that is entirely inside the range and entirely in the past never
+    changes again, so it is kept in the cache with no expiry (back-dated edits
+    evict it, see invalidate_days). Everything else -- the open current bucket
+    and partial buckets at the edges of the range -- comes from two grouped
+    queries covering only the buckets that are not cached.
+    """
+    if size not in BUCKETS:
+        raise ValueError(f"Unknown bucket size: {size}")
+    if end < start:
+        start, end = end, start
+    today = timezone.localdate()
+    generation = _generation()
+
+    periods = []
+    cursor = bucket_start(start, size)
+    while cursor <= end:
+        following = bucket_end(cursor, size)
+        first, last = max(cursor, start), min(following - timedelta(days=1), end)
+        closed = first == cursor and last == following - timedelta(days=1) and following <= today
+        periods.append((cursor, first, last, closed))
+        cursor = following
+
+    keys = {cursor: _key(size, cursor, generation) for cursor, _, _, closed in periods if closed}
+    cached = cache.get_many(keys.values())
+
+    missing = [p for p in periods if keys.get(p[0]) not in cached]
+    computed = _compute(missing[0][1], missing[-1][2], size) if missing else {}
+    empty = _row({field: Decimal(0) for field in SUMMARY_FIELDS}, Decimal(0))
+
+    rows, fresh = [], {}
+    for cursor, first, last, closed in periods:
+        if keys.get(cursor) in cached:
+            figures = cached[keys[cursor]]
+        else:
+            figures = computed.get(cursor, empty)
+            if closed:
+                fresh[keys[cursor]] = figures
+        rows.append({'start': first, 'end': last, **figures})
+    if fresh:
+        cache.set_many(fresh, timeout=None)
+    return rows
+
+
+def report_totals(rows):
+    """Sums financial_report() rows into one row spanning all of them."""
+    totals = {'start': rows[0]['start'], 'end': rows[-1]['end']} if rows else {}
+    for row in rows:
+        for field, value in row.items():
+            if field not in ('start', 'end'):
+                totals[field] = totals.get(field, Decimal(0)) + value
+    return totals
@@ -11,7 +11,7 @@ class InventoryItemResource(resources.ModelResource):
 
     class Meta:
         model = Product
-        fields = ('id', 'name', 'category', 'stock_qty', 'buy_price_per_bulk', 'sell_price_per_base')
+        fields = ('id', 'name', 'category', 'stock_base', 'buy_price_per_bulk', 'sell_price_per_base')
         import_id_fields = ('name',) 
 
     def save_instance(self, instance, is_create, row, type_cleaner=None):
@@ -24,7 +24,7 @@ class InventoryItemResource(resources.ModelResource):
                 # Fetch the current object from DB
                 existing_obj = Product.objects.get(name=instance.name)
                 # Add imported stock to existing stock
-                instance.stock_qty = existing_obj.stock_qty + instance.stock_qty
+                instance.stock_base = existing_obj.stock_base + instance.stock_base
             except Product.DoesNotExist:
                 pass
         super().save_instance(instance, is_create, row, type_cleaner)
\ No newline at end of file
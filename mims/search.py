@@ -0,0 +1,146 @@
+import re
+import threading
+from collections import defaultdict
+
+from .models import Product
+
+# Prefixes longer than this are matched by filtering the shorter prefix's hits
+MAX_PREFIX = 8
+TOKEN_RE = re.compile(r'[0-9a-z]+')
+
+
+def _tokens(text):
+    return TOKEN_RE.findall((text or '').casefold())
+
+
+def _trigrams(text):
+    text = ' ' + ' '.join(_tokens(text)) + ' '
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class ProductIndex:
+    """
+    Per-process prefix/trigram index over Product.name and Product.barcode.
+
+    Built lazily from one values_list() query on first use, then kept in
+    step by the post_save/post_delete handlers in signals.py. Lookups never
+    touch the database; the view fetches the few matching rows afterwards
+    so prices and stock are always current.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._entries = {}                   # pk -> (folded name, token tuple, barcode)
+        self._prefixes = defaultdict(set)    # word prefix -> pks
+        self._barcodes = defaultdict(set)    # barcode prefix -> pks
+        self._trigrams = defaultdict(set)    # name trigram -> pks
+
+    def clear(self):
+        with self._lock:
+            self._loaded = False
+            self._entries.clear()
+            self._prefixes.clear()
+            self._barcodes.clear()
+            self._trigrams.clear()
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            for pk, name, barcode in Product.objects.values_list('pk', 'name', 'barcode').iterator():
+                self._add(pk, name, barcode)
+            self._loaded = True
+
+    def _add(self, pk, name, barcode):
+        tokens = tuple(_tokens(name))
+        barcode = (barcode or '').casefold()
+        self._entries[pk] = ((name or '').casefold(), tokens, barcode)
+        for token in tokens:
+            for i in range(1, min(len(token), MAX_PREFIX) + 1):
+                self._prefixes[token[:i]].add(pk)
+        for i in range(1, min(len(barcode), MAX_PREFIX) + 1):
+            self._barcodes[barcode[:i]].add(pk)
+        for gram in _trigrams(name):
+            self._trigrams[gram].add(pk)
+
+    def _discard(self, pk):
+        entry = self._entries.pop(pk, None)
+        if entry is None:
+            return
+        name, tokens, barcode = entry
+        for token in tokens:
+            for i in range(1, min(len(token), MAX_PREFIX) + 1):
+                self._prefixes[token[:i]].discard(pk)
+        for i in range(1, min(len(barcode), MAX_PREFIX) + 1):
+            self._barcodes[barcode[:i]].discard(pk)
+        for gram in _trigrams(name):
+            self._trigrams[gram].discard(pk)
+
+    # --- Incremental maintenance (called from signals) ---
+    def update(self, product):
+        with self._lock:
+            if not self._loaded:
+                return
+            self._discard(product.pk)
+            self._add(product.pk, product.name, product.barcode)
+
+    def remove(self, pk):
+        with self._lock:
+            if self._loaded:
+                self._discard(pk)
+
+    # --- Lookup ---
+    def search(self, query, limit=15):
+        """Returns up to `limit` product pks, best matches first."""
+        self._ensure_loaded()
+        words = _tokens(query)
+        folded = ' '.join(words)
+        if not words:
+            return []
+
+        with self._lock:
+            # 1. Barcode prefix (scanners type the whole code)
+            code = (query or '').strip().casefold()
+            hits = {
+                pk for pk in self._barcodes.get(code[:MAX_PREFIX], ())
+                if self._entries[pk][2].startswith(code)
+            }
+            if hits:
+                return sorted(hits, key=lambda pk: (len(self._entries[pk][2]), pk))[:limit]
+
+            # 2. Every query word is a prefix of some word in the name
+            hits = None
+            for word in words:
+                matched = self._prefixes.get(word[:MAX_PREFIX], set())
+                if len(word) > MAX_PREFIX:
+                    matched = {
+                        pk for pk in matched
+                        if any(t.startswith(word) for t in self._entries[pk][1])
+                    }
+                hits = matched if hits is None else hits & matched
+                if not hits:
+                    break
+            if hits:
+                def rank(pk):
+                    name = self._entries[pk][0]
+                    return (not name.startswith(folded), len(name), name, pk)
+                return sorted(hits, key=rank)[:limit]
+
+            # 3. Typo-tolerant fallback: shared trigrams
+            grams = _trigrams(query)
+            scores = defaultdict(int)
+            for gram in grams:
+                for pk in self._trigrams.get(gram, ()):
+                    scores[pk] += 1
+            threshold = max(1, len(grams) // 2)
+            ranked = sorted(
+                (pk for pk, score in scores.items() if score >= threshold),
+                key=lambda pk: (-scores[pk], self._entries[pk][0], pk),
+            )
+            return ranked[:limit]
+
+
+product_index = ProductIndex()
@@ -0,0 +1,144 @@
+from datetime import datetime
+
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import Sum
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .cache import barcode_cache
+from .context_processors import invalidate_notification_count
+from .invoices import forget_invoice, invoice_cache
+from . import reports
+from .models import (
+    Customer, DailySummary, Expense, PaymentRecord, Product, Purchase, Sale, SaleItem,
+    alerts_refreshed, business_day, payments_applied, summary_changed,
+)
+from .search import product_index
+
+
+def refresh_product_caches():
+    """For bulk writes (bulk_create/bulk_update) that bypass the receivers below."""
+    product_index.clear()
+    barcode_cache.clear()
+    invoice_cache.clear()
+    invalidate_notification_count()
+
+
+def _forget_product(instance, deleted=False):
+    # Cleared once the row is committed: done any earlier, a concurrent lookup
+    # could cache the old row again and keep serving it. The caches get a
+    # snapshot, since a deleted instance has lost its pk by then.
+    product = Product(pk=instance.pk, name=instance.name, barcode=instance.barcode)
+
+    def forget():
+        if deleted:
+            product_index.remove(product.pk)
+        else:
+            product_index.update(product)
+            # Cached invoices print the product name; renames are rare enough to drop them all
+            invoice_cache.clear()
+        barcode_cache.invalidate_product(product)
+        invalidate_notification_count()
+
+    transaction.on_commit(forget)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    _forget_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    _forget_product(instance, deleted=True)
+
+
+# The badge counts StockAlert rows, so it moves when they are recomputed, not on every sale
+@receiver(alerts_refreshed)
+def alerts_changed(sender, product_ids, **kwargs):
+    transaction.on_commit(invalidate_notification_count)
+
+
+# --- DailySummary reversals (creation and edits are posted from Model.save) ---
+@receiver(pre_delete, sender=Sale)
+def sale_deleting(sender, instance, **kwargs):
+    # Runs before the cascade removes the payments, so the upfront cash can be told apart.
+    # Amounts come from the row: payments raise amount_paid with F() and leave instances stale.
+    row = Sale.objects.filter(pk=instance.pk).values('total_amount', 'amount_paid').first()
+    if row is None:
+        return
+    paid_later = instance.payments.aggregate(t=Sum('amount_received'))['t'] or 0
+    DailySummary.post(business_day(instance.sale_date), totals={
+        'revenue': -row['total_amount'],
+        'cash_collected': -max(row['amount_paid'] - paid_later, 0),
+    })
+
+
+@receiver(post_delete, sender=Sale)
+def sale_deleted(sender, instance, **kwargs):
+    if instance.customer_id:
+        Customer.refresh_balances([instance.customer_id])
+
+
+@receiver(post_delete, sender=SaleItem)
+def sale_item_deleted(sender, instance, origin=None, **kwargs):
+    figures = instance.line_figures(sign=-1)
+    day = business_day(instance.sale.sale_date)
+    if isinstance(origin, Product):
+        # The product's own summary rows are being cascade-deleted with it
+        figures.pop('revenue')
+        DailySummary.post(day, totals=figures)
+    else:
+        DailySummary.post_lines(day, [figures], [instance.product_id])
+
+
+@receiver(post_delete, sender=PaymentRecord)
+def payment_deleted(sender, instance, origin=None, **kwargs):
+    if not isinstance(origin, Sale):
+        Sale.apply_payments({instance.sale_id: -instance.amount_received})
+    DailySummary.post(business_day(instance.date_paid), totals={'cash_collected': -instance.amount_received})
+
+
+@receiver(post_delete, sender=Expense)
+def expense_deleted(sender, instance, **kwargs):
+    DailySummary.post(instance.date, totals={'expenses': -instance.amount})
+
+
+# --- Closed report periods cached by reports.financial_report ---
+def _forget_report_day(day):
+    if isinstance(day, datetime):  # Expense.date defaults to timezone.now
+        day = business_day(day)
+    # Only finished days are ever cached; today's buckets are recomputed on each request anyway
+    if day < timezone.localdate():
+        transaction.on_commit(lambda: reports.invalidate_days([day]))
+
+
+@receiver(summary_changed)
+def summary_posted(sender, day, **kwargs):
+    _forget_report_day(day)
+
+
+@receiver(post_save, sender=Purchase)
+@receiver(post_delete, sender=Purchase)
+def purchase_changed(sender, instance, **kwargs):
+    _forget_report_day(business_day(instance.purchase_date))
+
+
+# --- Rendered invoices cached by invoices.render_invoice ---
+@receiver(post_save, sender=Sale)
+@receiver(post_delete, sender=Sale)
+def sale_invoice_changed(sender, instance, **kwargs):
+    forget_invoice(instance.pk)
+
+
+@receiver(post_save, sender=SaleItem)
+@receiver(post_delete, sender=SaleItem)
+def sale_line_changed(sender, instance, **kwargs):
+    forget_invoice(instance.sale_id)
+
+
+@receiver(payments_applied)
+def sale_payments_changed(sender, sale_ids, **kwargs):
+    for sale_id in sale_ids:
+        forget_invoice(sale_id)
@@ -1,3 +1,1100 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .checkout import CheckoutError, process_checkout
+from .models import (
+    EXPIRY_WARNING_DAYS, Category, Customer, DailySummary, Expense, InsufficientStock, PaymentRecord, Product,
+    Purchase, Sale, SaleItem, StockAlert, StockLot, business_day, customer_key,
+)
+from .cache import MISSING, BarcodeCache, barcode_cache
+from .context_processors import get_notification_count
+from .db import DEFAULT_PRAGMAS
+from .importers import import_inventory_csv
+from .instrumentation import request_stats
+from .invoices import invoice_cache, render_day, render_invoice
+from .management.commands.simulate_tills import check_consistency
+from .middleware import QueryRecorder
+from .payments import PaymentError, allocate_payment
+from .reports import financial_report, report_totals
+from .search import product_index
+
+
+def make_product(name, category=None, **kwargs):
+    if category is None:
+        category, _ = Category.objects.get_or_create(name='Medicine')
+    defaults = {
+        'bulk_unit': 'Box',
+        'base_unit': 'Tablet',
+        'conversion_factor': 10,
+        'buy_price_per_bulk': Decimal('50'),
+        'sell_price_per_base': Decimal('100'),
+        'stock_base': 1000,
+    }
+    defaults.update(kwargs)
+    return Product.objects.create(name=name, category=category, **defaults)
+
+
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = [make_product(f"Drug {i}") for i in range(30)]
+
+    def test_totals_status_and_stock(self):
+        sale = process_checkout([('Drug 0', 5), ('Drug 1', 20), ('Drug 0', 5)], customer_name='Asha', amount_paid=1000)
+        sale.refresh_from_db()
+        self.assertEqual(sale.subtotal, Decimal('3000'))
+        self.assertEqual(sale.total_amount, Decimal('3000'))
+        self.assertEqual(sale.payment_status, 'PARTIAL')
+        self.assertEqual(sale.items.count(), 3)
+        self.assertEqual(Product.objects.get(name='Drug 0').stock_base, 990)
+        self.assertEqual(Product.objects.get(name='Drug 1').stock_base, 980)
+
+    def test_unknown_products_are_skipped(self):
+        sale = process_checkout([('Drug 0', 1), ('Nope', 3)], amount_paid=100)
+        self.assertEqual(sale.items.count(), 1)
+        with self.assertRaises(CheckoutError):
+            process_checkout([('Nope', 3)])
+
+    def test_walk_in_loan_is_rejected_without_writes(self):
+        with self.assertRaises(CheckoutError):
+            process_checkout([('Drug 0', 1)], amount_paid=0)
+        self.assertFalse(Sale.objects.exists())
+        self.assertEqual(Product.objects.get(name='Drug 0').stock_base, 1000)
+
+    def test_query_count_is_independent_of_basket_size(self):
+        counts = []
+        for size in (1, 30):
+            lines = [(p.name, 2) for p in self.products[:size]]
+            with CaptureQueriesContext(connection) as ctx:
+                process_checkout(lines, amount_paid=10 ** 6)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertLessEqual(counts[1], 14)  # 12 before FEFO lots: + lot read, lot UPDATE
+
+
+class StockMovementTests(TestCase):
+    def setUp(self):
+        self.product = make_product('Amoxyl', stock_base=10)
+
+    def test_sale_item_and_purchase_use_in_place_updates(self):
+        sale = Sale.objects.create(customer_name='Asha')
+        SaleItem.objects.create(sale=sale, product=self.product, quantity_base=5, price_at_sale=100)
+        Purchase.objects.create(product=self.product, quantity_bulk=2, total_cost=1000)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_base, 25)
+        self.assertEqual(self.product.stock_boxes, Decimal('2.50'))
+
+    def test_oversell_is_rejected_in_the_same_statement(self):
+        with self.assertRaises(InsufficientStock):
+            Product.adjust_stock({self.product.pk: -20}, prevent_oversell=True)
+        Product.adjust_stock({self.product.pk: -20})
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_base, -10)
+
+    def test_checkout_oversell_rolls_back_the_sale(self):
+        with self.assertRaises(CheckoutError):
+            process_checkout([('Amoxyl', 20)], amount_paid=2000, prevent_oversell=True)
+        self.assertFalse(Sale.objects.exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_base, 10)
+
+
+class StockLotTests(TestCase):
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.product = make_product('Amoxyl', stock_base=10, expiry_date=self.today + timedelta(days=400))
+        Purchase.objects.create(
+            product=self.product, quantity_bulk=2, total_cost=1000, expiry_date=self.today + timedelta(days=30),
+        )
+        Purchase.objects.create(product=self.product, quantity_bulk=1, total_cost=500)  # no expiry: sold last
+
+    def lots(self):
+        return list(self.product.lots.order_by('pk').values_list('quantity_base', flat=True))
+
+    def test_checkout_draws_soonest_expiry_first(self):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.expiry_date, self.today + timedelta(days=30))
+
+        process_checkout([('Amoxyl', 15)], amount_paid=1500)
+        self.assertEqual(self.lots(), [10, 5, 10])
+        with self.assertNumQueries(3):  # ordered read, one UPDATE, expiry moves on
+            StockLot.allocate({self.product.pk: 8})
+        self.assertEqual(self.lots(), [7, 0, 10])
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock_base, self.product.expiry_date), (25, self.today + timedelta(days=400)))
+
+        self.assertEqual(StockLot.allocate({self.product.pk: 20}), {self.product.pk: 3})
+        self.assertEqual(self.lots(), [0, 0, 0])
+
+    def test_expired_lots_are_listed_and_disposed_of_one_by_one(self):
+        self.client.force_login(User.objects.create_user('owner', password='x'))
+        expired = self.product.lots.get(quantity_received=20)
+        StockLot.objects.filter(pk=expired.pk).update(expiry_date=self.today - timedelta(days=1))
+        self.assertIn('stocklot_open_expiry_idx', StockLot.open_lots().filter(expiry_date__lt=self.today).explain())
+
+        response = self.client.get(reverse('notifications'), {'type': 'expired'})
+        self.assertEqual([lot.pk for lot in response.context['alert_items']], [expired.pk])
+
+        self.client.post(reverse('dispose_lot', args=[expired.pk]))
+        self.assertEqual(self.lots(), [10, 0, 10])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_base, 20)
+        response = self.client.get(reverse('notifications'), {'type': 'expired'})
+        self.assertEqual(list(response.context['alert_items']), [])
+
+    def test_edit_form_count_is_reconciled_with_the_lots(self):
+        self.client.force_login(User.objects.create_user('owner', password='x'))
+        form = {
+            'name': 'Amoxyl', 'category': self.product.category_id, 'bulk_unit': 'Box', 'base_unit': 'Tablet',
+            'conversion_factor': 10, 'buy_price': 50, 'sell_price': 100,
+        }
+        self.client.post(reverse('edit_product', args=[self.product.pk]), {**form, 'stock_qty': '2.5'})
+        self.assertEqual(self.lots(), [10, 5, 10])
+        self.client.post(reverse('edit_product', args=[self.product.pk]), {
+            **form, 'stock_qty': '3', 'expiry_date': (self.today + timedelta(days=90)).isoformat(),
+        })
+        self.assertEqual(self.lots(), [10, 5, 10, 5])
+        self.assertEqual(self.product.lots.get(quantity_received=5).expiry_date, self.today + timedelta(days=90))
+
+    def test_edit_form_leaves_an_untouched_count_alone(self):
+        self.client.force_login(User.objects.create_user('owner', password='x'))
+        bottle = make_product('Syrup', conversion_factor=1000, stock_base=1001)
+        url = reverse('edit_product', args=[bottle.pk])
+        form = self.client.get(url).context['product']
+        self.assertEqual(form.stock_boxes, Decimal('1.00'))  # 1001 ml shows as 1.00 bottles
+
+        self.client.post(url, {
+            'name': 'Syrup', 'category': bottle.category_id, 'bulk_unit': 'Bottle', 'base_unit': 'ml',
+            'conversion_factor': 1000, 'buy_price': 50, 'sell_price': 75,
+            'stock_qty': '1.00', 'stock_qty_shown': '1.00',
+        })
+        bottle.refresh_from_db()
+        self.assertEqual((bottle.stock_base, bottle.sell_price_per_base), (1001, Decimal('75')))
+        self.assertEqual(list(bottle.lots.values_list('quantity_base', flat=True)), [1001])
+
+
+class StockAlertTests(TestCase):
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.fast = make_product('Panadol', conversion_factor=10, stock_base=200)
+        self.slow = make_product('Amoxyl', conversion_factor=10, stock_base=20)
+        self.idle = make_product('Ventolin', conversion_factor=1, stock_base=3, expiry_date=self.today + timedelta(days=60))
+        now = timezone.now()
+        for days_ago in range(14):
+            process_checkout([('Panadol', 10)], amount_paid=1000, sale_date=now - timedelta(days=days_ago))
+        process_checkout([('Amoxyl', 2)], amount_paid=200, sale_date=now - timedelta(days=40))  # outside the window
+        StockLot.objects.update(received_at=now - timedelta(days=30))
+
+    def test_reorder_point_follows_sales_velocity(self):
+        with self.assertNumQueries(4):  # window sales, expiring lots, stock, one upsert
+            self.assertEqual(StockAlert.refresh(), 3)
+        fast = StockAlert.objects.get(product=self.fast)
+        # 140 sold in 28 days = 5 a day; (7 lead + 3 safety) days of that
+        self.assertEqual((fast.avg_daily_sales, fast.reorder_point, fast.days_of_cover), (Decimal('5'), 50, Decimal('12')))
+        self.assertFalse(fast.active)
+        slow = StockAlert.objects.get(product=self.slow)
+        self.assertEqual((slow.reorder_point, slow.days_of_cover, slow.active), (0, None, False))
+        self.assertTrue(StockAlert.objects.get(product=self.idle).expiring)
+
+        process_checkout([('Panadol', 15)], amount_paid=1500)
+        StockAlert.refresh([self.fast.pk])
+        fast.refresh_from_db()
+        self.assertTrue(fast.reorder)
+        self.assertEqual(fast.suggested_boxes, 9)  # up to 56 + 14 days x 5.54, from 45 on hand
+
+        self.client.force_login(User.objects.create_user('owner', password='x'))
+        response = self.client.get(reverse('notifications'))
+        self.assertEqual([a.product.name for a in response.context['alert_items']], ['Panadol', 'Ventolin'])
+
+    def test_nightly_run_only_recomputes_the_days_products(self):
+        StockAlert.refresh([self.idle.pk])  # already flagged as expiring
+        idle = StockAlert.objects.get(product=self.idle)
+        Purchase.objects.create(product=self.slow, quantity_bulk=1, total_cost=100)
+        self.assertEqual(StockAlert.touched_on(self.today), {self.fast.pk, self.slow.pk})
+        out = io.StringIO()
+        call_command('refresh_stock_alerts', stdout=out)
+        self.assertIn('Refreshed 2 stock alert(s)', out.getvalue())
+        self.assertEqual(StockAlert.objects.get(product=self.idle).computed_at, idle.computed_at)
+
+    def test_lot_entering_the_expiry_window_on_a_skipped_night_is_still_picked_up(self):
+        StockAlert.refresh(today=self.today - timedelta(days=2))
+        StockLot.objects.filter(product=self.slow).update(
+            expiry_date=self.today + timedelta(days=EXPIRY_WARNING_DAYS - 1),  # crossed over yesterday
+        )
+        self.assertIn(self.slow.pk, StockAlert.touched_on(self.today))
+        call_command('refresh_stock_alerts', stdout=io.StringIO())
+        self.assertTrue(StockAlert.objects.get(product=self.slow).expiring)
+        self.assertNotIn(self.slow.pk, StockAlert.touched_on(self.today))
+
+
+class ConcurrentStockTests(TransactionTestCase):
+    """Several tills hammering the same products through a WAL-mode SQLite file."""
+    alias = 'stress'
+    threads = 8
+    moves_per_thread = 50
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        config = dict(connections.settings['default'])
+        config['NAME'] = os.path.join(cls.tmpdir, 'stress.sqlite3')
+        # OPTIONS and PRAGMAs as shipped: mims.db turns on WAL for every connection
+        connections.settings[cls.alias] = config
+        call_command('migrate', database=cls.alias, verbosity=0, interactive=False)
+        # Declared here rather than on the class: the runner only sets up
+        # aliases from settings.DATABASES and this one is created on the fly.
+        cls.databases = {'default', cls.alias}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[cls.alias].close()
+        del connections[cls.alias]
+        del connections.settings[cls.alias]
+        shutil.rmtree(cls.tmpdir)
+
+    def run_tills(self, work):
+        errors = []
+
+        def till():
+            try:
+                for _ in range(self.moves_per_thread):
+                    work()
+            except Exception as e:  # surfaced by the assertion below
+                errors.append(e)
+            finally:
+                connections[self.alias].close()
+
+        workers = [threading.Thread(target=till) for _ in range(self.threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        self.assertEqual(errors, [])
+
+    def test_no_lost_updates(self):
+        category = Category.objects.using(self.alias).create(name='Medicine')
+        product = Product.objects.using(self.alias).create(
+            name='Panadol', category=category, bulk_unit='Box', base_unit='Tablet',
+            conversion_factor=1, buy_price_per_bulk=1, sell_price_per_base=2, stock_base=1000,
+        )
+        self.assertEqual(connections[self.alias].cursor().execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+        self.run_tills(lambda: Product.adjust_stock({product.pk: -1}, using=self.alias))
+
+        product.refresh_from_db(using=self.alias)
+        self.assertEqual(product.stock_base, 1000 - self.threads * self.moves_per_thread)
+
+    def test_tuning_profile_is_applied(self):
+        cursor = connections[self.alias].cursor()
+        self.assertEqual(cursor.execute('PRAGMA busy_timeout').fetchone()[0], DEFAULT_PRAGMAS['busy_timeout'])
+        self.assertEqual(cursor.execute('PRAGMA synchronous').fetchone()[0], 1)  # NORMAL
+        self.assertEqual(cursor.execute('PRAGMA temp_store').fetchone()[0], 2)  # MEMORY
+        self.assertEqual(connections[self.alias].transaction_mode, 'IMMEDIATE')
+
+    def test_oversell_guard_holds_under_contention(self):
+        category = Category.objects.using(self.alias).create(name='Medicine')
+        product = Product.objects.using(self.alias).create(
+            name='Panadol', category=category, bulk_unit='Box', base_unit='Tablet',
+            conversion_factor=1, buy_price_per_bulk=1, sell_price_per_base=2, stock_base=100,
+        )
+        sold = []
+
+        def sell_one():
+            try:
+                Product.adjust_stock({product.pk: -1}, prevent_oversell=True, using=self.alias)
+                sold.append(1)
+            except InsufficientStock:
+                pass
+
+        self.run_tills(sell_one)
+
+        product.refresh_from_db(using=self.alias)
+        self.assertEqual(len(sold), 100)
+        self.assertEqual(product.stock_base, 0)
+
+
+class InventoryValuationTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('admin', password='x'))
+
+    def test_valuation_is_exact_in_base_units(self):
+        make_product('Syrup', conversion_factor=3, stock_base=10, buy_price_per_bulk=Decimal('0.10'))
+        make_product('Tabs', conversion_factor=100, stock_base=150, buy_price_per_bulk=Decimal('12.50'))
+        response = self.client.get(reverse('inventory'))
+        self.assertEqual(response.context['total_valuation'], '1,876.00')
+        self.assertEqual(Product.base_units('1.5', 100), 150)
+
+    def test_filters_and_pages_in_sql(self):
+        antibiotics = Category.objects.create(name='Antibiotics')
+        for i in range(120):
+            make_product(f"Drug {i:03}")
+        make_product('Amoxyl', category=antibiotics, stock_base=5)
+        make_product('Ampiclox', category=antibiotics, expiry_date=timezone.now().date() + timedelta(days=30))
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('inventory'), {'page': 2})
+        page = response.context['page_obj']
+        self.assertEqual(page.paginator.count, 122)
+        self.assertEqual(len(page.object_list), 50)
+        self.assertEqual(response.context['product_count'], 122)
+        # count + page + valuation + categories (plus session/auth)
+        self.assertLessEqual(len(ctx.captured_queries), 8)
+
+        def names(**params):
+            return [p.name for p in self.client.get(reverse('inventory'), params).context['page_obj']]
+
+        self.assertEqual(names(q='am'), ['Amoxyl', 'Ampiclox'])
+        self.assertEqual(names(category=antibiotics.pk, status='low'), ['Amoxyl'])
+        self.assertEqual(names(status='expiring'), ['Ampiclox'])
+        self.assertEqual(names(sort='stock')[0], 'Amoxyl')
+        self.assertEqual(names(sort='bogus')[0], 'Amoxyl')
+
+
+class InventoryImportTests(TestCase):
+    header = "ProductName,Category,CurrentStock,BuyingPrice,RetailPrice,Items per Box,ExpiryDate\n"
+
+    def upload(self, body):
+        return SimpleUploadedFile('stock.csv', (self.header + body).encode('utf-8'), content_type='text/csv')
+
+    def test_creates_updates_and_reports_bad_rows(self):
+        existing = make_product('Panadol', conversion_factor=10, stock_base=5)
+        product_index.search('pan')
+        body = (
+            "panadol,Medicine,2,60,120,,2030-01-31\n"
+            "Amoxyl,Antibiotics,3,40,90,20,07/29\n"
+            "Broken,Medicine,lots,1,1,1,\n"
+            "Amoxyl,Antibiotics,1,,,20,\n"
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            result = import_inventory_csv(self.upload(body))
+
+        self.assertEqual((result.created, result.updated), (1, 2))
+        self.assertEqual([line for line, _ in result.errors], [4])
+        existing.refresh_from_db()
+        self.assertEqual(existing.stock_base, 25)
+        self.assertEqual(existing.sell_price_per_base, Decimal('120'))
+        amoxyl = Product.objects.get(name='Amoxyl')
+        self.assertEqual(amoxyl.stock_base, 80)
+        self.assertEqual(amoxyl.category.name, 'Antibiotics')
+        self.assertEqual(amoxyl.expiry_date.isoformat(), '2029-07-01')
+        # Bulk writes skip post_save, so the index is rebuilt after commit
+        self.assertEqual(product_index.search('amox'), [amoxyl.pk])
+
+    def test_negative_stock_comes_off_the_lots_and_bad_rows_do_not_abort(self):
+        existing = make_product('Panadol', conversion_factor=10, stock_base=50)
+        body = (
+            self.header.encode('utf-8')
+            + b"Panadol,Medicine,-2,,,,\n"
+            + b"Caf\xe9 Syrup,Medicine,1,10,20,1,\n"  # Latin-1, not UTF-8
+            + b"Gold,Medicine,1,1e30,20,1,\n"
+            + b"Ventolin,Inhalers,inf,5,5,1,\n"
+            + b"Ventolin,Inhalers,1,5,5,1,\n"
+        )
+        result = import_inventory_csv(SimpleUploadedFile('stock.csv', body, content_type='text/csv'))
+
+        self.assertEqual([line for line, _ in result.errors], [3, 4, 5])
+        self.assertIn('UTF-8', result.errors[0][1])
+        self.assertEqual((result.created, result.updated), (1, 1))
+        existing.refresh_from_db()
+        self.assertEqual(existing.stock_base, 30)
+        self.assertEqual(list(existing.lots.values_list('quantity_base', flat=True)), [30])
+
+    def test_query_count_does_not_grow_with_rows(self):
+        rows = "".join(f"Drug {i},Medicine,1,10,20,10,\n" for i in range(200))
+        with CaptureQueriesContext(connection) as ctx:
+            import_inventory_csv(self.upload(rows))
+        self.assertEqual(Product.objects.count(), 200)
+        self.assertLessEqual(len(ctx.captured_queries), 12)  # 10 before lots: + lot INSERT, expiry UPDATE
+
+    def test_view_reports_result(self):
+        self.client.force_login(User.objects.create_user('admin', password='x'))
+        response = self.client.post(
+            reverse('inventory'), {'csv_file': self.upload("Ventolin,Inhalers,1,5,5,1,\n")}, follow=True
+        )
+        self.assertContains(response, 'Imported 1 items.')
+
+
+class CreateSaleViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('cashier', password='x')
+        self.client.force_login(self.user)
+        make_product('Paracetamol')
+
+    def test_post_creates_sale(self):
+        response = self.client.post(reverse('create_sale'), {
+            'product_name[]': ['Paracetamol'],
+            'quantity[]': ['3'],
+            'customer_name': '',
+            'amount_paid': '300',
+        })
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+        self.assertEqual(SaleItem.objects.get().quantity_base, 3)
+
+    def test_walk_in_loan_redirects_back(self):
+        response = self.client.post(reverse('create_sale'), {
+            'product_name[]': ['Paracetamol'],
+            'quantity[]': ['3'],
+            'amount_paid': '0',
+        })
+        self.assertRedirects(response, reverse('create_sale'), fetch_redirect_response=False)
+        self.assertFalse(Sale.objects.exists())
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        product_index.clear()
+        self.client.force_login(User.objects.create_user('cashier', password='x'))
+        self.panadol = make_product('Tab Panadol Extra', barcode='6001234')
+        make_product('Syrup Paracetamol 120mg')
+        make_product('Tab Amoxyl')
+
+    def search(self, q, **params):
+        response = self.client.get(reverse('product_search'), {'q': q, **params})
+        return [r['name'] for r in response.json()['results']]
+
+    def test_word_prefix_and_barcode(self):
+        self.assertEqual(self.search('pan ext'), ['Tab Panadol Extra'])
+        self.assertEqual(self.search('tab'), ['Tab Amoxyl', 'Tab Panadol Extra'])
+        self.assertEqual(self.search('600123'), ['Tab Panadol Extra'])
+
+    def test_limit_is_clamped(self):
+        self.assertEqual(self.search('tab', limit=1), ['Tab Amoxyl'])
+        self.assertEqual(self.search('tab', limit=-3), ['Tab Amoxyl'])
+        self.assertEqual(self.search('tab', limit=0), ['Tab Amoxyl'])
+
+    def test_typo_falls_back_to_trigrams(self):
+        self.assertIn('Syrup Paracetamol 120mg', self.search('paracetmol'))
+
+    def test_index_follows_saves_and_deletes(self):
+        self.search('tab')  # build the index
+        self.panadol.name = 'Tab Panadol Advance'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.panadol.save()
+            make_product('Tab Augmentin')
+        self.assertEqual(self.search('adv'), ['Tab Panadol Advance'])
+        self.assertEqual(self.search('extra'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.panadol.delete()
+        self.assertEqual(self.search('tab'), ['Tab Amoxyl', 'Tab Augmentin'])
+
+    def test_sale_page_embeds_no_catalog(self):
+        response = self.client.get(reverse('create_sale'))
+        self.assertNotContains(response, 'Tab Amoxyl')
+
+
+class BarcodeLookupTests(TestCase):
+    def setUp(self):
+        barcode_cache.clear()
+        self.client.force_login(User.objects.create_user('cashier', password='x'))
+        self.product = make_product('Panadol', barcode='111')
+        make_product('Amoxyl', barcode='222')
+
+    def lookup(self, *codes, **headers):
+        return self.client.get(reverse('barcode_lookup'), {'barcode': list(codes)}, headers=headers)
+
+    def test_repeat_scans_hit_the_cache(self):
+        self.assertEqual(self.lookup('111').json()['data']['name'], 'Panadol')
+        self.assertEqual(self.lookup('999').json()['status'], 'not_found')
+        with self.assertNumQueries(4):  # session + user per request, no Product query
+            self.lookup('111')
+            self.lookup('999')
+
+    def test_etag_gives_304(self):
+        etag = self.lookup('111')['ETag']
+        self.assertEqual(self.lookup('111', if_none_match=etag).status_code, 304)
+
+    def test_save_invalidates_old_and_new_codes(self):
+        self.lookup('111')
+        self.lookup('333')
+        self.product.barcode = '333'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+            # Until the save commits, other lookups must keep seeing (and caching) the old row
+            self.assertEqual(barcode_cache.get('111')['name'], 'Panadol')
+        self.assertEqual(self.lookup('111').json()['status'], 'not_found')
+        self.assertEqual(self.lookup('333').json()['data']['name'], 'Panadol')
+
+    def test_reverse_map_follows_evictions(self):
+        small = BarcodeCache(2)
+        for pk, code in ((1, 'a'), (2, 'b'), (3, 'c'), (2, 'd')):
+            small.set(code, {'id': pk})
+        small.set('e', None)
+        self.assertEqual(small._barcode_of, {2: 'd'})
+        small.invalidate_product(Product(pk=2))
+        self.assertEqual((small.get('d'), small.get('e'), small._barcode_of), (MISSING, None, {}))
+
+    def test_batch_lookup_is_one_query(self):
+        with CaptureQueriesContext(connection) as ctx:
+            body = self.lookup('111', '222', '999').json()
+        self.assertEqual(body['results']['222']['name'], 'Amoxyl')
+        self.assertIsNone(body['results']['999'])
+        self.assertEqual(sum('mims_product' in q['sql'] for q in ctx.captured_queries), 1)
+
+
+class OutstandingBalanceTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('owner', password='x'))
+        self.product = make_product('Panadol')
+        for paid in (0, 100, 200, 200):
+            process_checkout([('Panadol', 2)], customer_name='Juma', amount_paid=paid)
+
+    def test_balance_is_stored_and_indexed(self):
+        sale = Sale.objects.filter(amount_paid=100).get()
+        self.assertEqual(sale.balance_due, Decimal('100'))
+        self.assertEqual(Sale.objects.filter(Sale.outstanding_q()).count(), 2)
+        # Either partial index on open debts will do; both skip paid sales entirely
+        self.assertRegex(Sale.objects.filter(Sale.outstanding_q()).explain(), r'sale_(outstanding|customer_open)_idx')
+
+    def test_loans_page_totals_in_sql(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('loans_list'))
+        self.assertEqual(response.context['total_outstanding'], Decimal('300'))
+        self.assertEqual(len(response.context['page_obj'].object_list), 2)
+        sale_queries = [q for q in ctx.captured_queries if 'FROM "mims_sale"' in q['sql']]
+        # one aggregate for count + total, one for the page
+        self.assertEqual(len(sale_queries), 2)
+
+
+class SaleLedgerTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('owner', password='x'))
+        make_product('Panadol')
+        start = timezone.now() - timedelta(days=60)
+        for i in range(60):
+            process_checkout(
+                [('Panadol', 1)], customer_name='Juma' if i % 3 else 'Asha',
+                amount_paid=100 if i % 2 else 0, sale_date=start + timedelta(days=i),
+            )
+
+    def walk(self, **params):
+        pages, queries = [], []
+        response = self.client.get(reverse('sale_ledger'), params)
+        while True:
+            page = response.context['page_obj']
+            pages.append([s.pk for s in page])
+            if not page.has_next:
+                return pages, queries, response
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(reverse('sale_ledger'), {**params, 'after': page.next_cursor})
+            queries.append([q['sql'] for q in ctx.captured_queries])
+
+    def test_cursor_reaches_the_whole_ledger_at_flat_cost(self):
+        pages, queries, last = self.walk()
+        ids = [pk for page in pages for pk in page]
+        self.assertEqual(ids, list(Sale.objects.order_by('-sale_date', '-pk').values_list('pk', flat=True)))
+        # every later page runs the same statements as page 2: no COUNT, no OFFSET
+        self.assertEqual(len({len(q) for q in queries}), 1)
+        sql = ' '.join(' '.join(q) for q in queries)
+        self.assertNotIn('COUNT', sql)
+        self.assertNotIn('OFFSET', sql)
+
+        back = self.client.get(reverse('sale_ledger'), {'before': last.context['page_obj'].previous_cursor})
+        self.assertEqual([s.pk for s in back.context['page_obj']], pages[-2])
+
+    def test_filters(self):
+        pages, _, _ = self.walk(status='LOAN', customer='asha')
+        sales = Sale.objects.filter(pk__in=[pk for page in pages for pk in page])
+        self.assertTrue(sales.exists())
+        self.assertFalse(sales.exclude(payment_status='LOAN', customer_name='Asha').exists())
+
+        day = business_day(Sale.objects.earliest('sale_date').sale_date)
+        pages, _, _ = self.walk(**{'from': day.isoformat(), 'to': day.isoformat()})
+        self.assertEqual(sum(map(len, pages)), 1)
+
+        pages, _, _ = self.walk(**{'from': '2024-02-30', 'to': 'soon'})  # ignored, not a 500
+        self.assertEqual(sum(map(len, pages)), 60)
+        self.assertEqual(self.client.get(reverse('sale_ledger'), {'after': 'garbage'}).status_code, 200)
+
+
+class DashboardTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('owner', password='x'))
+        self.now = timezone.now()
+
+    def add_day(self, days_ago, lines):
+        sale_date = self.now - timedelta(days=days_ago)
+        for i in range(lines):
+            make_product(f"Item {days_ago}-{i}", buy_price_per_bulk=Decimal('60'), sell_price_per_base=Decimal('100'))
+            process_checkout([(f"Item {days_ago}-{i}", 2)], amount_paid=200, sale_date=sale_date)
+        Expense.objects.create(description='Rent', amount=Decimal('30'), date=sale_date.date())
+
+    def test_figures(self):
+        self.add_day(0, 2)
+        self.add_day(3, 1)
+        self.add_day(10, 1)  # outside the chart window
+        context = self.client.get(reverse('dashboard')).context
+        self.assertEqual(context['daily_revenue'], Decimal('400'))
+        self.assertEqual(context['daily_profit'], Decimal('160'))
+        self.assertEqual(context['today_expenses'], Decimal('30'))
+        self.assertEqual(context['net_profit'], 130.0)
+        self.assertEqual(context['profit_data'], [0.0, 0.0, 0.0, 80.0, 0.0, 0.0, 160.0])
+        self.assertEqual(context['expense_data'], [0.0, 0.0, 0.0, 30.0, 0.0, 0.0, 30.0])
+        self.assertEqual(context['most_moving']['total_sold'], 2)
+
+    def test_query_count_is_constant(self):
+        self.add_day(0, 1)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(reverse('dashboard'))
+        for days_ago in range(7):
+            self.add_day(days_ago, 3)
+        with CaptureQueriesContext(connection) as large:
+            self.client.get(reverse('dashboard'))
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+        self.assertLessEqual(len(large.captured_queries), 12)
+
+
+class DailySummaryTests(TestCase):
+    def snapshot(self):
+        return sorted(DailySummary.objects.values_list(
+            'day', Coalesce('product_id', 0), 'revenue', 'cost_of_goods', 'profit', 'quantity_base', 'cash_collected', 'expenses',
+        ))
+
+    def test_incremental_rows_match_a_full_rebuild(self):
+        from .utils import calculate_sale_totals
+        make_product('Panadol', buy_price_per_bulk=Decimal('40'))
+        make_product('Amoxyl', buy_price_per_bulk=Decimal('70'))
+        yesterday = timezone.now() - timedelta(days=1)
+
+        loan = process_checkout([('Panadol', 3), ('Amoxyl', 2)], customer_name='Asha', amount_paid=20, sale_date=yesterday)
+        PaymentRecord.objects.create(sale=loan, amount_received=Decimal('50'))
+        allocate_payment('asha', Decimal('30'))
+        cash = process_checkout([('Panadol', 1)], amount_paid=100)
+        SaleItem.objects.create(sale=cash, product=Product.objects.get(name='Amoxyl'), quantity_base=1, price_at_sale=100)
+        rent = Expense.objects.create(description='Rent', amount='300', date=yesterday.date())
+        rent.amount = Decimal('250')
+        rent.save()
+        Expense.objects.create(description='Tea', amount=Decimal('5')).delete()
+        process_checkout([('Amoxyl', 4)], amount_paid=400).delete()
+        stale = process_checkout([('Panadol', 1)], customer_name='Juma', amount_paid=5, sale_date=yesterday)
+        PaymentRecord.objects.create(sale=stale, amount_received=Decimal('3'))
+        stale.delete()  # amount_paid on the instance is still 5
+        edited = Sale.objects.get(pk=loan.pk)
+        edited.amount_paid += 1  # the loans admin's editable amount_paid
+        edited.save()
+        calculate_sale_totals(cash)
+
+        today = DailySummary.objects.get(day=timezone.localdate(), product__isnull=True)
+        self.assertEqual(today.revenue, Decimal('200'))
+        self.assertEqual(today.profit, Decimal('90'))
+
+        incremental = self.snapshot()
+        call_command('rebuild_daily_summary', stdout=open(os.devnull, 'w'))
+        rebuilt = [row for row in self.snapshot() if any(row[2:])]
+        self.assertEqual([row for row in incremental if any(row[2:])], rebuilt)
+
+    def test_cost_is_snapshotted_at_sale(self):
+        panadol = make_product('Panadol', buy_price_per_bulk=Decimal('40'))
+        sale = process_checkout([('Panadol', 2)], amount_paid=200)
+        SaleItem.objects.create(sale=sale, product=panadol, quantity_base=1, price_at_sale=100)
+        self.assertEqual(set(sale.items.values_list('cost_at_sale', flat=True)), {Decimal('40')})
+
+        panadol.buy_price_per_bulk = Decimal('90')
+        panadol.save()
+        with CaptureQueriesContext(connection) as ctx:
+            call_command('rebuild_daily_summary', stdout=open(os.devnull, 'w'))
+        self.assertFalse(any('mims_product' in q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT')))
+        today = DailySummary.objects.get(day=timezone.localdate(), product__isnull=True)
+        self.assertEqual(today.profit, Decimal('180'))
+
+    def test_financial_report_reads_the_summary(self):
+        from .utils import get_financial_report
+        make_product('Panadol')
+        process_checkout([('Panadol', 2)], customer_name='Asha', amount_paid=50)
+        Expense.objects.create(description='Rent', amount=Decimal('30'))
+        with self.assertNumQueries(2):
+            report = get_financial_report('daily')
+        self.assertEqual(report['revenue'], Decimal('200'))
+        self.assertEqual(report['cash_in'], Decimal('50'))
+        self.assertEqual(report['outstanding_loans'], Decimal('150'))
+
+
+class PaymentTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('cashier', password='x'))
+        make_product('Panadol')
+        start = timezone.now() - timedelta(days=10)
+        self.sales = [
+            process_checkout([('Panadol', n)], customer_name='Juma', amount_paid=paid, sale_date=start + timedelta(days=i))
+            for i, (n, paid) in enumerate([(1, 0), (3, 100), (2, 0), (5, 500)])
+        ]
+        process_checkout([('Panadol', 4)], customer_name='Asha', amount_paid=0)
+
+    def test_installment_is_added_not_resummed(self):
+        sale = self.sales[1]
+        PaymentRecord.objects.create(sale=sale, amount_received=Decimal('150'))
+        sale.refresh_from_db()
+        # the 100 paid at the till is kept
+        self.assertEqual((sale.amount_paid, sale.payment_status, sale.balance_due), (Decimal('250'), 'PARTIAL', Decimal('50')))
+
+        payment = PaymentRecord.objects.create(sale=sale, amount_received=Decimal('50'))
+        sale.refresh_from_db()
+        self.assertEqual((sale.amount_paid, sale.payment_status), (Decimal('300'), 'PAID'))
+
+        payment.delete()
+        sale.refresh_from_db()
+        self.assertEqual((sale.amount_paid, sale.payment_status), (Decimal('250'), 'PARTIAL'))
+
+    def test_lump_sum_is_allocated_oldest_first(self):
+        # savepoint, customer, open sales, insert, sale + customer updates, summary (2), release
+        with self.assertNumQueries(9):
+            allocations = allocate_payment('juma', Decimal('350'))
+        self.assertEqual([(s.pk, a) for s, a in allocations], [
+            (self.sales[0].pk, Decimal('100')), (self.sales[1].pk, Decimal('200')), (self.sales[2].pk, Decimal('50')),
+        ])
+        paid = {s.pk: (s.amount_paid, s.payment_status) for s in Sale.objects.filter(customer_name='Juma')}
+        self.assertEqual(paid[self.sales[0].pk], (Decimal('100'), 'PAID'))
+        self.assertEqual(paid[self.sales[1].pk], (Decimal('300'), 'PAID'))
+        self.assertEqual(paid[self.sales[2].pk], (Decimal('50'), 'PARTIAL'))
+        self.assertEqual(paid[self.sales[3].pk], (Decimal('500'), 'PAID'))
+        today = DailySummary.objects.get(day=timezone.localdate(), product__isnull=True)
+        self.assertEqual(today.cash_collected, Decimal('350'))
+
+    def test_rejects_overpayment(self):
+        with self.assertRaises(PaymentError):
+            allocate_payment('Juma', Decimal('1000'))
+        with self.assertRaises(PaymentError):
+            allocate_payment('Nobody', Decimal('10'))
+        for amount in ('NaN', 'sNaN', 'Infinity'):
+            with self.assertRaises(PaymentError):
+                allocate_payment('Juma', amount)
+        self.assertFalse(PaymentRecord.objects.exists())
+
+    def test_view(self):
+        response = self.client.post(reverse('pay_customer'), {'customer_name': 'Asha', 'amount_to_pay': '400'}, follow=True)
+        self.assertContains(response, 'applied to 1 sale(s)')
+        self.assertFalse(Sale.objects.filter(Sale.outstanding_q(), customer_name='Asha').exists())
+
+
+class CustomerTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('cashier', password='x'))
+        make_product('Panadol')
+
+    def balance(self, name):
+        return Customer.objects.get(name_key=customer_key(name)).balance
+
+    def test_spelling_variants_are_one_customer(self):
+        first = process_checkout([('Panadol', 2)], customer_name='Mama Asha', amount_paid=0)
+        second = process_checkout([('Panadol', 1)], customer_name='  mama  ASHA. ', amount_paid=0, customer_phone='0712 345 678')
+        self.assertEqual(first.customer_id, second.customer_id)
+        self.assertEqual(second.customer_name, 'Mama Asha')
+        self.assertEqual(Customer.objects.get().phone_key, '712345678')
+        self.assertIsNone(process_checkout([('Panadol', 1)], amount_paid=100).customer)
+
+    def test_running_balance_follows_sales_and_payments(self):
+        sale = process_checkout([('Panadol', 3)], customer_name='Juma', amount_paid=50)
+        self.assertEqual(self.balance('juma'), Decimal('250'))
+        SaleItem.objects.create(sale=sale, product=Product.objects.get(), quantity_base=1, price_at_sale=100)
+        self.assertEqual(self.balance('juma'), Decimal('350'))
+        payment = PaymentRecord.objects.create(sale=sale, amount_received=Decimal('100'))
+        self.assertEqual(self.balance('juma'), Decimal('250'))
+        payment.delete()
+        self.assertEqual(self.balance('juma'), Decimal('350'))
+        process_checkout([('Panadol', 1)], customer_name='Juma', amount_paid=0)
+        allocate_payment('JUMA', Decimal('400'))
+        self.assertEqual(self.balance('juma'), Decimal('50'))
+        Sale.objects.filter(customer__name_key='juma').delete()
+        self.assertEqual(self.balance('juma'), Decimal('0'))
+
+    def test_autocomplete_and_loans_filter(self):
+        process_checkout([('Panadol', 2)], customer_name='Mama Asha', amount_paid=0)
+        process_checkout([('Panadol', 1)], customer_name='Juma', amount_paid=0)
+        response = self.client.get(reverse('customer_search'), {'q': 'mama a'})
+        self.assertEqual(response.json()['results'], [
+            {'id': Customer.objects.get(name='Mama Asha').pk, 'name': 'Mama Asha', 'phone': '', 'balance': '200.00'},
+        ])
+        response = self.client.get(reverse('loans_list'), {'customer': 'MAMA ASHA'})
+        self.assertEqual(response.context['customer'].balance, Decimal('200'))
+        self.assertEqual([s.customer_name for s in response.context['page_obj']], ['Mama Asha'])
+
+    def test_autocomplete_by_phone_in_any_format(self):
+        process_checkout([('Panadol', 1)], customer_name='Juma', amount_paid=0, customer_phone='0712 345 678')
+        process_checkout([('Panadol', 1)], customer_name='Asha', amount_paid=0, customer_phone='0655 000 111')
+        for query in ('0712 345 678', '+255 712 345 678', '255712345678', '0712', '+255 712', '345 67'):
+            response = self.client.get(reverse('customer_search'), {'q': query})
+            self.assertEqual([c['name'] for c in response.json()['results']], ['Juma'], query)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('accountant', password='x'))
+        make_product('Panadol')
+        self.old = process_checkout([('Panadol', 1)], amount_paid=100, sale_date=timezone.now() - timedelta(days=40))
+        self.new = process_checkout([('Panadol', 2)], customer_name='Juma', amount_paid=0)
+        PaymentRecord.objects.create(sale=self.new, amount_received=Decimal('50'))
+        Expense.objects.create(description='Rent', amount=Decimal('30'))
+
+    def export(self, name, **params):
+        response = self.client.get(reverse('export', args=[name]), params)
+        self.assertTrue(response.streaming)
+        text = b''.join(response.streaming_content).decode('utf-8-sig')
+        return list(csv.reader(io.StringIO(text)))
+
+    def test_streams_each_export_with_sql_date_range(self):
+        self.assertEqual(len(self.export('sales')), 3)
+        today = timezone.localdate().isoformat()
+        rows = self.export('sale_items', **{'from': today, 'to': today})
+        self.assertEqual(rows[0][0], 'Sale ID')
+        self.assertEqual([r[0] for r in rows[1:]], [str(self.new.pk)])
+        self.assertEqual(rows[1][-1], '200.00')
+        self.assertEqual(self.export('payments')[1][2], 'Juma')
+        self.assertEqual(self.export('expenses', **{'from': today})[1][2], 'Rent')
+        self.assertEqual(self.export('inventory')[1][1], 'Panadol')
+
+    def test_rows_are_read_lazily(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('export', args=['sales']))
+        self.assertFalse([q for q in ctx.captured_queries if 'mims_sale' in q['sql']])
+        next(iter(response.streaming_content))
+
+    def test_unknown_export(self):
+        self.assertEqual(self.client.get(reverse('export', args=['users'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('export', args=['sales']), {'to': '2024-02-30'}).status_code, 400)
+
+
+class InvoiceTests(TestCase):
+    def setUp(self):
+        invoice_cache.clear()
+        make_product('Panadol')
+        make_product('Amoxyl')
+        self.paid = process_checkout([('Panadol', 2), ('Amoxyl', 1)], amount_paid=300)
+        self.loan = process_checkout([('Panadol', 1)], customer_name='Juma', amount_paid=0)
+
+    def test_paid_invoice_is_rendered_once(self):
+        with self.assertNumQueries(1):
+            text = render_invoice(self.paid.pk)
+        self.assertIn('Amoxyl', text)
+        self.assertIn(f"{'GRAND TOTAL:':<30} {Decimal('300'):>8.2f}", text)
+        with self.assertNumQueries(0):
+            self.assertEqual(render_invoice(self.paid.pk), text)
+
+        SaleItem.objects.create(sale=self.paid, product=Product.objects.get(name='Amoxyl'), quantity_base=1, price_at_sale=100)
+        self.assertIn('400.00', render_invoice(self.paid.pk))
+
+    def test_open_invoice_is_not_cached(self):
+        render_invoice(self.loan.pk)
+        PaymentRecord.objects.create(sale=self.loan, amount_received=Decimal('40'))
+        self.assertIn(f"{'Amount Paid:':<30} {Decimal('40'):>8.2f}", render_invoice(self.loan.pk))
+
+    def test_whole_day_in_one_query(self):
+        with self.assertNumQueries(1):
+            invoices = render_day(timezone.localdate(), 'html')
+        self.assertEqual([sale.pk for sale, _ in invoices], [self.paid.pk, self.loan.pk])
+
+        self.client.force_login(User.objects.create_user('cashier', password='x'))
+        response = self.client.get(reverse('day_invoices'), {'format': 'text'})
+        self.assertContains(response, f"Invoice ID: {self.loan.pk}")
+        self.assertEqual(self.client.get(reverse('day_invoices'), {'day': '2024-02-30'}).status_code, 400)
+        self.assertContains(self.client.get(reverse('view_sale', args=[self.paid.pk])), 'Amoxyl')
+
+
+class ReportEngineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        make_product('Panadol', buy_price_per_bulk=Decimal('40'))
+        self.today = timezone.localdate()
+        self.now = timezone.now()
+        for days_ago, qty in ((70, 1), (35, 2), (8, 3), (0, 4)):
+            process_checkout([('Panadol', qty)], customer_name='Juma', amount_paid=50, sale_date=self.now - timedelta(days=days_ago))
+        Purchase.objects.create(product=Product.objects.get(), quantity_bulk=1, total_cost=Decimal('80'),
+                                purchase_date=self.now - timedelta(days=8))
+
+    def test_buckets_cover_the_range(self):
+        start = self.today - timedelta(days=90)
+        rows = financial_report(start, self.today, 'month')
+        self.assertEqual(rows[0]['start'], start)
+        self.assertEqual(rows[-1]['end'], self.today)
+        totals = report_totals(rows)
+        self.assertEqual(totals['revenue'], Decimal('1000'))
+        self.assertEqual(totals['cash_in'], Decimal('200'))
+        self.assertEqual(totals['purchases'], Decimal('80'))
+        self.assertEqual(totals['gross_profit'], Decimal('600'))
+
+        days = financial_report(self.today - timedelta(days=9), self.today, 'day')
+        self.assertEqual(len(days), 10)
+        self.assertEqual([d['revenue'] for d in days if d['revenue']], [Decimal('300'), Decimal('400')])
+        weeks = financial_report(self.today - timedelta(days=27), self.today, 'week')
+        self.assertEqual(sum(w['revenue'] for w in weeks), Decimal('700'))
+
+    def test_closed_periods_are_cached_until_backdated_edit(self):
+        start = self.today - timedelta(days=90)
+        with CaptureQueriesContext(connection) as ctx:
+            first = financial_report(start, self.today, 'day')
+        self.assertEqual(len(ctx.captured_queries), 2)  # one grouped query per table
+        with CaptureQueriesContext(connection) as ctx:
+            again = financial_report(start, self.today, 'day')
+        self.assertEqual(again, first)
+        # only today's open bucket is recomputed
+        self.assertEqual(len(ctx.captured_queries), 2)
+        self.assertNotIn(str(start), ' '.join(q['sql'] for q in ctx.captured_queries))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Expense.objects.create(description='Old bill', amount=Decimal('15'), date=self.today - timedelta(days=8))
+        day = next(r for r in financial_report(start, self.today, 'day') if r['start'] == self.today - timedelta(days=8))
+        self.assertEqual(day['expenses'], Decimal('15'))
+
+    def test_text_report(self):
+        from .utils import format_report_text, get_financial_report
+        text = format_report_text(get_financial_report('yearly'))
+        self.assertIn('Yearly FINANCIAL SUMMARY', text)
+        self.assertIn('OUTSTANDING LOANS', text)
+        self.assertEqual(self.client.get(reverse('financial_report')).status_code, 302)
+
+    def test_report_view_rejects_ranges_it_cannot_serve(self):
+        self.client.force_login(User.objects.create_user('owner', password='x'))
+        url = reverse('financial_report')
+        response = self.client.get(url, {'start': '2020-01-01', 'end': '2020-03-31', 'bucket': 'week'})
+        self.assertEqual(len(response.json()['rows']), 14)
+        self.assertEqual(self.client.get(url, {'start': '1000-01-01', 'end': '2020-01-01'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'start': '1000-01-01', 'end': '2020-01-01', 'bucket': 'month'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'start': '9999-01-01', 'end': '9999-12-31', 'bucket': 'month'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'start': '2024-02-30'}).status_code, 400)
+
+
+class RequestStatsTests(TestCase):
+    def setUp(self):
+        request_stats.clear()
+        self.user = User.objects.create_user('owner', password='x', is_staff=True)
+        self.client.force_login(self.user)
+
+    def test_requests_are_recorded_per_view(self):
+        make_product('Panadol')
+        for _ in range(3):
+            self.client.get(reverse('inventory'))
+        self.client.get('/no-such-page/')
+        rows = {row['view']: row for row in request_stats.summary()}
+        self.assertEqual(list(rows), ['inventory'])
+        self.assertEqual(rows['inventory']['requests'], 3)
+        self.assertGreater(rows['inventory']['avg_queries'], 0)
+        self.assertLessEqual(rows['inventory']['p50_ms'], rows['inventory']['p99_ms'])
+
+    def test_repeated_sql_is_flagged(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for pk in range(4):
+                Product.objects.filter(pk=pk).first()
+            Category.objects.count()
+        repeated, sql = recorder.repeated()
+        self.assertEqual((recorder.count, repeated), (5, 3))
+        self.assertIn('mims_product', sql)
+
+    def test_page_is_staff_only(self):
+        self.client.get(reverse('dashboard'))
+        self.assertContains(self.client.get(reverse('performance')), 'dashboard')
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('performance')).status_code, 302)
+
+
+class DatasetCommandTests(TestCase):
+    def test_generated_dataset_is_consistent_and_benchmark_rolls_back(self):
+        call_command(
+            'generate_dataset', products=30, customers=5, sales=60, days=10, seed=3, stdout=open(os.devnull, 'w'),
+        )
+        self.assertEqual(Sale.objects.count(), 60)
+        self.assertEqual(
+            Customer.objects.aggregate(t=Sum('balance'))['t'],
+            Sale.objects.filter(customer__isnull=False).aggregate(t=Sum('balance_due'))['t'],
+        )
+        self.assertEqual(
+            DailySummary.objects.filter(product=None).aggregate(t=Sum('revenue'))['t'],
+            Sale.objects.aggregate(t=Sum('total_amount'))['t'],
+        )
+        with self.assertRaises(CommandError):
+            call_command('generate_dataset', sales=1, stdout=open(os.devnull, 'w'))
+
+        out = io.StringIO()
+        call_command('benchmark', repeat=1, import_rows=4, host='testserver', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['dataset']['sales'], 60)
+        self.assertEqual({p['failures'] for p in report['paths'].values()}, {0})
+        self.assertEqual(Sale.objects.count(), 60)
+        self.assertFalse(User.objects.exists())
+
+
+class QueryPlanAuditTests(TestCase):
+    def test_scans_are_flagged_and_indexed_lookups_are_not(self):
+        from mims.management.commands.audit_queries import Command as Audit
+
+        call_command('generate_dataset', products=30, customers=5, sales=60, days=10, seed=3, stdout=open(os.devnull, 'w'))
+        audit = Audit()
+        today = timezone.localdate()
+        unindexed = Sale.objects.filter(customer_name='Asha').query.sql_with_params()
+        expired = Product.objects.filter(expiry_date__lt=today).order_by('expiry_date').query.sql_with_params()
+        expenses = Expense.objects.filter(date=today).order_by('-id').query.sql_with_params()
+
+        findings = audit.explain('adhoc', [unindexed, expired, expenses])
+        self.assertEqual([(step, reason) for _, _, step, reason in findings], [('SCAN mims_sale', None)])
+
+
+class TillSimulatorTests(TestCase):
+    def test_consistency_check_spots_lost_stock_updates(self):
+        panadol = make_product('Panadol')
+        stock_before = {panadol.pk: panadol.stock_base}
+        first = process_checkout([('Panadol', 3)], amount_paid=300).pk
+        process_checkout([('Panadol', 2)], customer_name='Asha', amount_paid=50)
+        self.assertEqual(check_consistency(first, stock_before), {})
+
+        Product.objects.filter(pk=panadol.pk).update(stock_base=F('stock_base') + 2)  # a lost decrement
+        Sale.objects.filter(pk=first).update(amount_paid=400)
+        self.assertEqual(
+            set(check_consistency(first, stock_before)),
+            {'stock drift (before - sold != after)', 'overpaid sale'},
+        )
+
+
+class NotificationBadgeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = make_product('Panadol', conversion_factor=10, stock_base=100)
+        make_product('Amoxyl', conversion_factor=10, stock_base=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            StockAlert.refresh()
+
+    def count_queries(self, ctx):
+        return [q for q in ctx.captured_queries if q['sql'].startswith('SELECT COUNT(*) AS "__count" FROM "mims_stockalert"')]
+
+    def test_login_page_never_counts(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('login'))
+        self.assertFalse(any('mims_stockalert' in q['sql'] for q in ctx.captured_queries))
+
+    def test_count_is_cached_until_alerts_are_refreshed(self):
+        self.client.force_login(User.objects.create_user('owner', password='x'))
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('dashboard'))
+        self.assertEqual(len(self.count_queries(ctx)), 1)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('dashboard'))
+        self.assertEqual(self.count_queries(ctx), [])
+        self.assertEqual(get_notification_count(), 1)  # Amoxyl is out of stock
+
+        # 90 sold today is ~3.2 a day: reorder point 33, and 10 are left
+        with self.captureOnCommitCallbacks(execute=True):
+            process_checkout([('Panadol', 90)], amount_paid=9000)
+        self.assertEqual(get_notification_count(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('refresh_stock_alerts', stdout=open(os.devnull, 'w'))
+        self.assertEqual(get_notification_count(), 2)
@@ -2,7 +2,11 @@
 from django.db.models import Sum, F
 from django.utils import timezone
 from datetime import timedelta
-from .models import PaymentRecord, Sale, Purchase, Expense
+from .invoices import render_invoice
+from .models import PaymentRecord
+from .reports import financial_report, report_totals
+from datetime import datetime
+import re
 
 def calculate_sale_totals(sale):
     """
@@ -20,82 +24,27 @@ def calculate_sale_totals(sale):
 
 def generate_invoice_text(sale):
     """
-    Generates a professional text-based invoice.
+    Generates a professional text-based invoice (see invoices.render_invoice).
     """
-    header = f"{'PHARMA-LOGIC MEDICAL':^40}\n"
-    header += f"{'Inventory & Sales Report':^40}\n"
-    header += "="*40 + "\n"
-    
-    info = (
-        f"Invoice ID: {sale.id}\n"
-        f"Date:       {sale.sale_date.strftime('%Y-%m-%d %H:%M')}\n"
-        f"Customer:   {sale.customer_name or 'General Client'}\n"
-        f"Status:     {sale.get_payment_status_display()}\n"
-    )
-    
-    table_head = f"{'-'*40}\n"
-    table_head += f"{'Item':<18} {'Qty':<4} {'Price':<7} {'Total':<8}\n"
-    
-    body = ""
-    for item in sale.items.all():
-        line_total = item.quantity_base * item.price_at_sale
-        body += f"{item.product.name[:17]:<18} {item.quantity_base:<4} {item.price_at_sale:<7} {line_total:<8.2f}\n"
-    
-    footer = f"{'-'*40}\n"
-    footer += f"{'Subtotal:':<30} {sale.subtotal:>8.2f}\n"
-    footer += f"{'Discount:':<30} -{sale.discount_amount:>7.2f}\n"
-    footer += f"{'GRAND TOTAL:':<30} {sale.total_amount:>8.2f}\n"
-    footer += f"{'Amount Paid:':<30} {sale.amount_paid:>8.2f}\n"
-    footer += f"{'BALANCE DUE:':<30} {sale.balance_due():>8.2f}\n"
-    footer += "="*40
-    
-    return header + info + table_head + body + footer
+    return render_invoice(sale.pk, 'text')
 
 def get_financial_report(period='daily'):
-    now = timezone.now()
-    
-    if period == 'daily':
-        start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    elif period == 'weekly':
-        start_date = now - timedelta(days=now.weekday())
-    elif period == 'monthly':
-        start_date = now.replace(day=1, hour=0, minute=0, second=0)
-    elif period == 'yearly':
-        start_date = now.replace(month=1, day=1, hour=0, minute=0, second=0)
-    else:
+    """Totals from the start of the current day/week/month/year until today (see reports.py)."""
+    today = timezone.localdate()
+    starts = {
+        'daily': today,
+        'weekly': today - timedelta(days=today.weekday()),
+        'monthly': today.replace(day=1),
+        'yearly': today.replace(month=1, day=1),
+    }
+    if period not in starts:
         return None
 
-    # 1. Accrual Revenue (Total value of all sales made)
-    revenue_data = Sale.objects.filter(sale_date__gte=start_date).aggregate(
-        total_revenue=Sum('total_amount'),
-        actual_cash=Sum('amount_paid') # 2. Cash In (Total money actually collected)
-    )
-    
-    total_revenue = revenue_data['total_revenue'] or 0
-    total_cash_in = revenue_data['actual_cash'] or 0
-    
-    # 3. Money Out
-    total_purchases = Purchase.objects.filter(purchase_date__gte=start_date).aggregate(
-        total=Sum('total_cost'))['total'] or 0
-    
-    total_expenses = Expense.objects.filter(date__gte=start_date).aggregate(
-        total=Sum('amount'))['total'] or 0
-
-    # Calculations
-    paper_profit = total_revenue - (total_purchases + total_expenses)
-    net_cash_flow = total_cash_in - (total_purchases + total_expenses)
-    total_debt = total_revenue - total_cash_in # Money still owed by customers
-
-    return {
-        'period': period.capitalize(),
-        'revenue': total_revenue,
-        'cash_in': total_cash_in,
-        'purchases': total_purchases,
-        'expenses': total_expenses,
-        'paper_profit': paper_profit,
-        'cash_flow': net_cash_flow,
-        'outstanding_loans': total_debt
-    }
+    # Monthly buckets: finished months of the year come from the cache
+    size = 'month' if period == 'yearly' else 'day'
+    report = report_totals(financial_report(starts[period], today, size))
+    report['period'] = period.capitalize()
+    return report
 
 def format_report_text(report_data):
     """Formats the dictionary into a readable text summary."""
@@ -106,13 +55,16 @@ def format_report_text(report_data):
     return (
         f"{border}\n"
         f"{report_data['period'] + ' FINANCIAL SUMMARY':^40}\n"
-        f"Since: {report_data['start_date'].strftime('%Y-%m-%d %H:%M')}\n"
+        f"{report_data['start']:%Y-%m-%d} to {report_data['end']:%Y-%m-%d}\n"
         f"{border}\n"
-        f"{'Total Sales:':<25} {report_data['sales']:>12.2f}\n"
+        f"{'Total Sales:':<25} {report_data['revenue']:>12.2f}\n"
+        f"{'Cash Collected:':<25} {report_data['cash_in']:>12.2f}\n"
         f"{'Total Purchases:':<25} -{report_data['purchases']:>11.2f}\n"
         f"{'Total Expenses:':<25} -{report_data['expenses']:>11.2f}\n"
         f"{'-'*40}\n"
-        f"{'NET PROFIT:':<25} {report_data['net_profit']:>12.2f}\n"
+        f"{'NET PROFIT:':<25} {report_data['paper_profit']:>12.2f}\n"
+        f"{'NET CASH FLOW:':<25} {report_data['cash_flow']:>12.2f}\n"
+        f"{'OUTSTANDING LOANS:':<25} {report_data['outstanding_loans']:>12.2f}\n"
         f"{border}"
     )
 
@@ -123,4 +75,46 @@ def get_cash_flow_report(start_date):
         date_paid__gte=start_date
     ).aggregate(total=Sum('amount_received'))['total'] or 0
     
-    return actual_cash_collected
\ No newline at end of file
+    return actual_cash_collected
+
+def parse_smart_date(date_str):
+    """
+    Parses messy dates including:
+    - 2028-30-06 (Year-Day-Month)
+    - 07/27 or 07,2027 (Month/Year -> converts to 1st of month)
+    - Standard formats
+    """
+    if not date_str:
+        return None
+
+    # 1. Clean up strings (remove quotes, extra spaces)
+    date_str = str(date_str).strip().replace('"', '').replace("'", "")
+
+    # 2. Handle Month/Year formats (e.g., 7/27, 07/2027, 07,27)
+    month_year_match = re.match(r'^(\d{1,2})[./,-](\d{2}|\d{4})$', date_str)
+    
+    if month_year_match:
+        month, year = month_year_match.groups()
+        if len(year) == 2:
+            year = f"20{year}"
+        date_str = f"{year}-{month.zfill(2)}-01"
+        
+    # 3. Try parsing with various formats
+    formats = [
+        '%Y-%m-%d',  # Standard: 2028-06-30
+        '%Y-%d-%m',  # THE FIX FOR YOUR ERROR: 2028-30-06
+        '%d-%m-%Y',  # TZ/UK: 30-06-2028
+        '%m/%d/%Y',  # US: 06/30/2028
+        '%d/%m/%Y',  # Standard Slashes
+        '%Y/%m/%d',  # ISO Slashes
+        '%d.%m.%Y',  # Dot separator
+    ]
+
+    for fmt in formats:
+        try:
+            return datetime.strptime(date_str, fmt).date()
+        except ValueError:
+            continue
+            
+    # 4. If all fail, return None
+    return None
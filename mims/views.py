@@ -1,123 +1,89 @@
+from django.conf import settings
 from django.shortcuts import render, redirect
-from django.db.models import Sum, F
+from django.urls import reverse
+from django.db import transaction
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Sum
+from django.db.models.functions import Cast
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.contrib import messages
-from django.http import HttpResponse
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseNotModified, StreamingHttpResponse,
+)
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
 from datetime import timedelta
 import csv
-import io
+import hashlib
+import json
+import re
+from urllib.parse import urlencode
 from django.http import JsonResponse
 from decimal import Decimal, InvalidOperation
-from .models import PaymentRecord, Sale, SaleItem, Product, Expense, Purchase, Category
+from .models import (
+    Customer, PaymentRecord, Sale, SaleItem, Product, Expense, Purchase, Category, DailySummary, StockAlert,
+    StockLot, customer_key, phone_key, start_of_day,
+)
+from .checkout import CheckoutError, parse_basket, process_checkout
+from .exports import EXPORTS, export_rows, stream_csv, write_xlsx
+from .importers import import_inventory_csv
+from .instrumentation import request_stats
+from .invoices import FORMATS, render_day, render_invoice
+from .utils import parse_smart_date
+from .pagination import keyset_page
+from .reports import BUCKETS, LAST_REPORT_DAY, MAX_BUCKETS, bucket_count, financial_report, report_totals
+from .payments import PaymentError, allocate_payment
+from .search import product_index
+from .cache import MISSING, barcode_cache
 from django.core.paginator import Paginator
 from django.contrib.auth.decorators import login_required
-import re
-from datetime import datetime
+from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import get_object_or_404
 from .models import Sale,SaleItem
 
-# REMOVED @login_required HERE because this is a helper function, not a view.
-def parse_smart_date(date_str):
-    """
-    Parses messy dates including:
-    - 2028-30-06 (Year-Day-Month)
-    - 07/27 or 07,2027 (Month/Year -> converts to 1st of month)
-    - Standard formats
-    """
-    if not date_str:
-        return None
-
-    # 1. Clean up strings (remove quotes, extra spaces)
-    date_str = str(date_str).strip().replace('"', '').replace("'", "")
-
-    # 2. Handle Month/Year formats (e.g., 7/27, 07/2027, 07,27)
-    month_year_match = re.match(r'^(\d{1,2})[./,-](\d{2}|\d{4})$', date_str)
-    
-    if month_year_match:
-        month, year = month_year_match.groups()
-        if len(year) == 2:
-            year = f"20{year}"
-        date_str = f"{year}-{month.zfill(2)}-01"
-        
-    # 3. Try parsing with various formats
-    formats = [
-        '%Y-%m-%d',  # Standard: 2028-06-30
-        '%Y-%d-%m',  # THE FIX FOR YOUR ERROR: 2028-30-06
-        '%d-%m-%Y',  # TZ/UK: 30-06-2028
-        '%m/%d/%Y',  # US: 06/30/2028
-        '%d/%m/%Y',  # Standard Slashes
-        '%Y/%m/%d',  # ISO Slashes
-        '%d.%m.%Y',  # Dot separator
-    ]
-
-    for fmt in formats:
-        try:
-            return datetime.strptime(date_str, fmt).date()
-        except ValueError:
-            continue
-            
-    # 4. If all fail, return None
-    return None
-
-
 @login_required
 def dashboard_stats(request): 
     return render(request, 'dashboard.html')
 
 @login_required
 def dashboard_view(request):
-    today = timezone.now().date()
-    start_of_month = today.replace(day=1)
-    
-    daily_revenue = Sale.objects.filter(sale_date__date=today).aggregate(Sum('total_amount'))['total_amount__sum'] or 0
-    todays_expense_list = Expense.objects.filter(date=today).order_by('-id')
-    today_expenses = Expense.objects.filter(date=today).aggregate(Sum('amount'))['amount__sum'] or 0
-    daily_profit = SaleItem.objects.filter(sale__sale_date__date=today).aggregate(
-        total_profit=Sum(
-            (F('price_at_sale') - F('product__buy_price_per_bulk')) * F('quantity_base')
+    today = timezone.localdate()
+    window_start = today - timedelta(days=6)
+
+    # --- 1. SEVEN SMALL ROWS FROM THE DAILY SUMMARY ---
+    summary = {
+        row.day: row for row in DailySummary.objects.filter(
+            product__isnull=True, day__gte=window_start, day__lte=today
         )
-    )['total_profit'] or 0
-
-    most_moving = SaleItem.objects.values('product__name').annotate(total=Sum('quantity_base')).order_by('-total').first()
-    top_movers = SaleItem.objects.values('product__name').annotate(total=Sum('quantity_base')).order_by('-total')[:5]
-    most_moving = top_movers[0] if top_movers else None
-    daily_revenue = Sale.objects.filter(sale_date__date=today).aggregate(Sum('total_amount'))['total_amount__sum'] or 0
-    daily_revenue = Sale.objects.filter(sale_date__date=today).aggregate(Sum('total_amount'))['total_amount__sum'] or 0
-    today_expenses = Expense.objects.filter(date=today).aggregate(Sum('amount'))['amount__sum'] or 0
-
-    daily_profit = SaleItem.objects.filter(sale__sale_date__date=today).aggregate(
-    total_profit=Sum(
-        (F('price_at_sale') - F('product__buy_price_per_bulk')) * F('quantity_base')
-            )
-        )['total_profit'] or 0
-    top_movers = SaleItem.objects.values('product__name').annotate(
-        total_sold=Sum('quantity_base')
-    ).order_by('-total_sold')[:5]
-    least_movers = SaleItem.objects.values('product__name').annotate(
-        total_sold=Sum('quantity_base')
-    ).order_by('total_sold')[:5]
-    today_expenses = Expense.objects.filter(date=today).aggregate(Sum('amount'))['amount__sum'] or 0
+    }
+    todays = summary.get(today, DailySummary(day=today))
+
+    daily_revenue = todays.revenue
+    daily_profit = todays.profit
+    today_expenses = todays.expenses
+    todays_expense_list = Expense.objects.filter(date=today).order_by('-id')
 
-        # Net Profit = (Sales Revenue - Cost of Goods Sold) - Expenses
+    # Net Profit = (Sales Revenue - Cost of Goods Sold) - Expenses
     net_profit = float(daily_profit) - float(today_expenses)
 
-    most_profitable = Product.objects.annotate(
-        profit=F('sell_price_per_base') - F('buy_price_per_bulk')
-    ).order_by('-profit').first()
+    # --- 2. MOVERS (per-product summary rows, evaluated once here) ---
+    movers = DailySummary.objects.filter(product__isnull=False).values('product__name').annotate(
+        total_sold=Sum('quantity_base')
+    )
+    top_movers = list(movers.order_by('-total_sold')[:5])
+    least_movers = list(movers.order_by('total_sold')[:5])
 
+    # --- 3. CHART SERIES FROM THE SAME ROWS ---
     graph_labels = []
     expense_data = []
     profit_data = []
 
     for i in range(6, -1, -1):
         day = today - timedelta(days=i)
-        exp = Expense.objects.filter(date=day).aggregate(t=Sum('amount'))['t'] or 0
-        prof = SaleItem.objects.filter(sale__sale_date__date=day).aggregate(
-            p=Sum((F('price_at_sale') - F('product__buy_price_per_bulk')) * F('quantity_base'))
-        )['p'] or 0
-        graph_labels.append(day.strftime('%a')) 
-        expense_data.append(float(exp))
-        profit_data.append(float(prof))
+        graph_labels.append(day.strftime('%a'))
+        expense_data.append(float(summary[day].expenses) if day in summary else 0.0)
+        profit_data.append(float(summary[day].profit) if day in summary else 0.0)
 
     context = {
         'daily_revenue': daily_revenue,
@@ -125,7 +91,7 @@ def dashboard_view(request):
         'graph_labels': graph_labels,
         'expense_data': expense_data,
         'profit_data': profit_data,   
-        'active_loans': Sale.objects.filter(total_amount__gt=F('amount_paid')).count(),
+        'active_loans': Sale.objects.filter(Sale.outstanding_q()).count(),
         'today_expenses': today_expenses,
         'net_profit': net_profit,
         'top_movers': top_movers,
@@ -136,16 +102,53 @@ def dashboard_view(request):
     
     return render(request, 'mims/dashboard.html', context)
 
+LEDGER_PAGE_SIZE = 25
+
+def _filter_date(value):
+    """A YYYY-MM-DD filter as a date; None when empty, malformed or impossible (2024-02-30)."""
+    try:
+        return parse_date(value or '')
+    except ValueError:
+        return None
+
 @login_required
 def sale_ledger_view(request):
-    """Lists last 50 sales with pagination of 10."""
-    sale_list = Sale.objects.all().order_by('-sale_date')[:50]
-    paginator = Paginator(sale_list, 10) 
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    
-    context = {'page_obj': page_obj}
-    
+    """Full sales history, newest first, with cursor pagination and filters."""
+    sales = Sale.objects.all()
+
+    status = request.GET.get('status', '')
+    if status in dict(Sale.PAYMENT_CHOICES):
+        sales = sales.filter(payment_status=status)
+
+    customer = request.GET.get('customer', '').strip()
+    if customer:
+        sales = sales.filter(customer_name__icontains=customer)
+
+    # Whole local days, as ranges on the indexed column (no __date lookups)
+    date_from = _filter_date(request.GET.get('from'))
+    date_to = _filter_date(request.GET.get('to'))
+    if date_from:
+        sales = sales.filter(sale_date__gte=start_of_day(date_from))
+    if date_to:
+        sales = sales.filter(sale_date__lt=start_of_day(date_to + timedelta(days=1)))
+
+    page_obj = keyset_page(
+        sales.prefetch_related('items__product', 'payments'),
+        'sale_date', LEDGER_PAGE_SIZE,
+        after=request.GET.get('after'), before=request.GET.get('before'),
+    )
+
+    params = request.GET.copy()
+    for key in ('after', 'before'):
+        params.pop(key, None)
+
+    context = {
+        'page_obj': page_obj,
+        'filters': {'status': status, 'customer': customer, 'from': date_from, 'to': date_to},
+        'status_choices': Sale.PAYMENT_CHOICES,
+        'querystring': params.urlencode(),
+        'export_range': urlencode({k: v.isoformat() for k, v in (('from', date_from), ('to', date_to)) if v}),
+    }
     return render(request, 'mims/sale_ledger.html', context)
 
 @login_required
@@ -154,17 +157,21 @@ def pay_debt_view(request, sale_id):
     if request.method == "POST":
         try:
             amount = Decimal(request.POST.get('amount_to_pay', 0))
-            if amount > sale.balance_due:
-                messages.error(request, f"Error: Payment (Tsh {amount}) exceeds balance (Tsh {sale.balance_due}).")
-            elif amount <= 0:
-                messages.error(request, "Please enter a valid amount.")
-            else:
-                PaymentRecord.objects.create(
-                    sale=sale,
-                    amount_received=amount,
-                    note=request.POST.get('note', 'Installment payment')
-                )
-                messages.success(request, f"Payment of Tsh {amount:,.2f} recorded.")
+            # The balance is re-read inside the write transaction (BEGIN IMMEDIATE holds the
+            # write lock), so two tills paying the same invoice cannot both pass the check
+            with transaction.atomic():
+                sale = Sale.objects.select_for_update().get(pk=sale_id)
+                if amount > sale.balance_due:
+                    messages.error(request, f"Error: Payment (Tsh {amount}) exceeds balance (Tsh {sale.balance_due}).")
+                elif amount <= 0:
+                    messages.error(request, "Please enter a valid amount.")
+                else:
+                    PaymentRecord.objects.create(
+                        sale=sale,
+                        amount_received=amount,
+                        note=request.POST.get('note', 'Installment payment')
+                    )
+                    messages.success(request, f"Payment of Tsh {amount:,.2f} recorded.")
         except InvalidOperation:
             messages.error(request, "Invalid amount entered.")
         return redirect('sale_ledger')
@@ -173,6 +180,33 @@ def pay_debt_view(request, sale_id):
     
     return render(request, 'mims/pay_debt.html', context)
 
+@login_required
+def pay_customer_view(request):
+    """One lump-sum payment from a debtor, applied to their oldest open sales first."""
+    if request.method == "POST":
+        customer = request.POST.get('customer_name', '').strip()
+        try:
+            allocations = allocate_payment(
+                customer, request.POST.get('amount_to_pay') or 0,
+                note=request.POST.get('note') or 'Lump-sum payment',
+            )
+        except PaymentError as e:
+            messages.error(request, f"Error: {e}")
+        else:
+            total = sum(applied for _, applied in allocations)
+            messages.success(request, f"Payment of Tsh {total:,.2f} from {customer} applied to {len(allocations)} sale(s).")
+    return redirect('loans_list')
+
+INVENTORY_PAGE_SIZE = 50
+
+# ?sort= value -> column or annotation (prefix with '-' for descending)
+INVENTORY_SORTS = {
+    'name': 'name',
+    'stock': 'boxes',
+    'value': 'value',
+    'expiry': 'expiry_date',
+}
+
 @login_required
 def inventory_list_view(request):
     # --- 1. DOWNLOAD TEMPLATE ---
@@ -192,13 +226,14 @@ def inventory_list_view(request):
                 # Use smart parser for manual entry too, just in case
                 expiry = parse_smart_date(request.POST.get('expiry_date'))
 
+                conversion_factor = int(request.POST.get('conversion_factor', 1))
                 Product.objects.create(
                     name=request.POST.get('name'),
                     category_id=request.POST.get('category'),
-                    stock_qty=float(request.POST.get('stock_qty', 0)),
+                    stock_base=Product.base_units(request.POST.get('stock_qty', 0), conversion_factor),
                     bulk_unit=request.POST.get('bulk_unit', 'Box'),
                     base_unit=request.POST.get('base_unit', 'Piece'),
-                    conversion_factor=int(request.POST.get('conversion_factor', 1)),
+                    conversion_factor=conversion_factor,
                     buy_price_per_bulk=Decimal(request.POST.get('buy_price', 0)),
                     sell_price_per_base=Decimal(request.POST.get('sell_price', 0)),
                     expiry_date=expiry
@@ -211,94 +246,61 @@ def inventory_list_view(request):
         # --- 3. HANDLE CSV IMPORT ---
         elif 'csv_file' in request.FILES:
             try:
-                csv_file = request.FILES['csv_file']
-                data_set = csv_file.read().decode('UTF-8')
-                io_string = io.StringIO(data_set)
-                reader = csv.DictReader(io_string)
-                field_map = {name.strip().lower(): name for name in reader.fieldnames}
-                
-                imported_count = 0
-                for row in reader:
-                    def get_val(target):
-                        for k, v in field_map.items():
-                            if target in k: return row.get(v, '').strip()
-                        return ''
-                    
-                    def clean_dec(v): 
-                        if not v: return Decimal(0)
-                        return Decimal(str(v).replace('$', '').replace(',', '').replace('Tsh', '').strip())
-                    
-                    def clean_int(v):
-                        if not v: return 0
-                        return int(float(str(v).replace(',', '').strip()))
-
-                    prod_name = get_val('productname') or row.get('ProductName', '').strip()
-                    if not prod_name: continue
-                    
-                    category, _ = Category.objects.get_or_create(name=get_val('category') or 'General')
-                    stock_in = clean_int(get_val('currentstock'))
-                    retail = clean_dec(get_val('retail'))
-                    buying = clean_dec(get_val('buying')) 
-                    
-                    # Check for 'items per box' OR 'conversion'
-                    conv = clean_int(get_val('conversion')) or clean_int(get_val('items per box')) or 1
-                    
-                    # --- UPDATED DATE HANDLING ---
-                    raw_expiry = get_val('expiry') or get_val('date')
-                    expiry = parse_smart_date(raw_expiry) # Uses the robust parser now
-
-                    product = Product.objects.filter(name__iexact=prod_name).first()
-                    if product:
-                        product.stock_qty += stock_in
-                        if buying > 0: product.buy_price_per_bulk = buying
-                        if retail > 0: product.sell_price_per_base = retail
-                        if expiry: product.expiry_date = expiry
-                        product.save()
-                    else:
-                        Product.objects.create(
-                            name=prod_name, 
-                            category=category, 
-                            stock_qty=stock_in,
-                            buy_price_per_bulk=buying, 
-                            sell_price_per_base=retail,
-                            conversion_factor=conv,
-                            bulk_unit=get_val('bulkunit') or 'Box',
-                            base_unit=get_val('baseunit') or 'Item',
-                            expiry_date=expiry
-                        )
-                    imported_count += 1
-                messages.success(request, f"Imported {imported_count} items.")
+                result = import_inventory_csv(request.FILES['csv_file'])
+                messages.success(request, f"Imported {result.imported} items.")
+                if result.errors:
+                    shown = "; ".join(f"line {line}: {error}" for line, error in result.errors[:10])
+                    more = f" (and {len(result.errors) - 10} more)" if len(result.errors) > 10 else ""
+                    messages.warning(request, f"Skipped {len(result.errors)} rows - {shown}{more}")
             except Exception as e:
                 messages.error(request, f"Error: {str(e)}")
             return redirect('inventory')
 
     # --- 4. VIEW RENDER ---
-    products = Product.objects.select_related('category').all().order_by('name')
-    categories = Category.objects.all()
-    inventory_data = []
-    total_valuation = Decimal(0)
+    # Filtering, sorting and paging all happen in SQL; only one page of rows is loaded.
+    products = Product.objects.select_related('category').annotate(
+        value=Product.stock_value_expression(),
+        boxes=ExpressionWrapper(
+            Cast('stock_base', FloatField()) / F('conversion_factor'), output_field=FloatField()
+        ),
+    )
 
-    for p in products:
-        # Check if stock_value is a callable method or a property
-        val = p.stock_value() if callable(getattr(p, 'stock_value', None)) else getattr(p, 'stock_value', 0)
-        total_valuation += Decimal(val)
-        
-        # FIX: Calculate total pieces for template display
-        total_pieces = p.stock_qty * p.conversion_factor
-        
-        inventory_data.append({
-            'item': p,
-            'stock_value_display': f"{val:,.2f}", 
-            'retail_price_display': f"{p.sell_price_per_base:,.2f}", 
-            'stock_qty_display': f"{p.stock_qty:,}", 
-            'is_low_stock': p.stock_qty < 2,
-            'total_pieces': total_pieces # Added so template can see it
-        })
+    query = request.GET.get('q', '').strip()
+    if query:
+        products = products.filter(name__istartswith=query)
+
+    category_id = request.GET.get('category', '')
+    if category_id.isdigit():
+        products = products.filter(category_id=category_id)
+
+    status = request.GET.get('status', '')
+    if status == 'low':
+        products = products.filter(Product.low_stock_q())
+    elif status == 'expiring':
+        products = products.filter(Product.expiring_q(timezone.now().date()))
+
+    sort = request.GET.get('sort', 'name')
+    if sort.lstrip('-') not in INVENTORY_SORTS:
+        sort = 'name'
+    field = INVENTORY_SORTS[sort.lstrip('-')]
+    order = F(field).desc(nulls_last=True) if sort.startswith('-') else F(field).asc(nulls_last=True)
+    products = products.order_by(order, 'pk')
+
+    page_obj = Paginator(products, INVENTORY_PAGE_SIZE).get_page(request.GET.get('page'))
+
+    totals = Product.objects.aggregate(
+        total=Sum(Product.stock_value_expression()), count=Count('pk'),
+    )
+    params = request.GET.copy()
+    params.pop('page', None)
 
     context = {
-        'inventory': inventory_data,
-        'total_valuation': f"{total_valuation:,.2f}",
-        'categories': categories
+        'page_obj': page_obj,
+        'total_valuation': f"{totals['total'] or Decimal(0):,.2f}",
+        'product_count': totals['count'],
+        'categories': Category.objects.order_by('name'),
+        'filters': {'q': query, 'category': category_id, 'status': status, 'sort': sort},
+        'querystring': params.urlencode(),
     }
 
     return render(request, 'mims/inventory.html', context)
@@ -314,7 +316,7 @@ def expense_list_view(request):
             Expense.objects.create(description=description, amount=amount, date=date)
             return redirect('expense_list')
 
-    expenses = Expense.objects.all().order_by('-date')
+    expenses = Expense.objects.all().order_by('-date', '-id')
     today_total = Expense.objects.filter(date=timezone.now().date()).aggregate(Sum('amount'))['amount__sum'] or 0
     
     return render(request, 'mims/expenses.html', {
@@ -324,62 +326,47 @@ def expense_list_view(request):
 
 @login_required
 def create_sale_view(request):
-    products = Product.objects.all()
     if request.method == 'POST':
-        p_names = request.POST.getlist('product_name[]')
-        qtys = request.POST.getlist('quantity[]')
+        lines = parse_basket(request.POST.getlist('product_name[]'), request.POST.getlist('quantity[]'))
         customer = request.POST.get('customer_name', '').strip()
-        initial_payment = Decimal(request.POST.get('amount_paid', 0))
+        try:
+            initial_payment = Decimal(request.POST.get('amount_paid') or 0)
+        except InvalidOperation:
+            messages.error(request, "Invalid amount entered.")
+            return redirect('create_sale')
 
-        if p_names:
-            sale = Sale.objects.create(
-                customer_name=customer if customer else "Walk-in",
-                amount_paid=initial_payment,
-                sale_date=timezone.now()
-            )
-            
-            for name, qty in zip(p_names, qtys):
-                try:
-                    p = Product.objects.get(name=name)
-                    SaleItem.objects.create(
-                        sale=sale, 
-                        product=p, 
-                        quantity_base=int(qty), 
-                        price_at_sale=p.sell_price_per_base
-                    )
-                except (Product.DoesNotExist, ValueError): 
-                    continue
-            
-            sale.update_status()
-            
-            if sale.payment_status != 'PAID' and sale.customer_name == "Walk-in":
-                messages.error(request, "Customer Name is required for Loan/Partial sales.")
-                sale.delete()
+        if lines:
+            try:
+                process_checkout(
+                    lines, customer_name=customer, amount_paid=initial_payment,
+                    customer_phone=request.POST.get('customer_phone', ''),
+                )
+            except CheckoutError as e:
+                messages.error(request, str(e))
                 return redirect('create_sale')
 
             messages.success(request, f"Sale processed successfully.")
             return redirect('dashboard')
-            
-    context = {'products': products}
-            
-    return render(request, 'mims/create_sale.html', context)
+
+    # The product list is fetched on demand from product_search
+    return render(request, 'mims/create_sale.html')
 
 @login_required
 def notifications_view(request):
     """Generates a filtered list for Purchase Orders or Expired Disposal."""
     today = timezone.now().date()
-    six_months = today + timedelta(days=180)
     alert_type = request.GET.get('type')
     
     if alert_type == 'expired':
-        # Only products that are actually expired
-        alert_items = Product.objects.filter(expiry_date__lt=today).order_by('expiry_date')
+        # The disposal list: every lot past its date that still has stock, not whole products
+        alert_items = StockLot.open_lots().filter(expiry_date__lt=today).select_related('product').order_by(
+            'expiry_date', 'product_id'
+        )
     else:
-        # Purchase Order: Low stock OR Expiring within 6 months
-        from django.db.models import Q
-        alert_items = Product.objects.filter(
-            Q(stock_qty__lt=2) | Q(expiry_date__lte=six_months)
-        ).distinct().order_by('name')
+        # Purchase Order: precomputed by refresh_stock_alerts; least days of cover first
+        alert_items = StockAlert.active_alerts().select_related('product').order_by(
+            F('days_of_cover').asc(nulls_last=True), 'product_id'
+        )
     
     context = {
         'alert_items': alert_items,
@@ -387,33 +374,44 @@ def notifications_view(request):
     }
     return render(request, 'mims/purchase_order.html', context)
 
+@login_required
+def dispose_lot_view(request, lot_id):
+    """Writes off what is left of an expired lot; the product and its other lots stay."""
+    if request.method == "POST":
+        lot = get_object_or_404(StockLot.objects.select_related('product'), pk=lot_id)
+        disposed = lot.write_off()
+        messages.success(request, f"Disposed of {disposed} {lot.product.base_unit} of {lot.product.name}.")
+    return redirect(f"{reverse('notifications')}?type=expired")
+
 @login_required
 def view_sale_view(request, sale_id):
-    sale = get_object_or_404(Sale, id=sale_id)
-    today = timezone.now().date()
-    
-    # FIX: Consolidated definitions into one variable to prevent overwriting calculation
-    sale_items = SaleItem.objects.filter(sale=sale).annotate(
-        subtotal=F('price_at_sale') * F('quantity_base')
-    )
-    
-    # Calculate Sale Total
-    today_total = sale_items.aggregate(
-        total=Sum(F('price_at_sale') * F('quantity_base'))
-    )['total'] or 0
+    return render(request, 'mims/view_sale.html', {'receipt': render_invoice(sale_id, 'html')})
 
-    # Calculate Daily Expenses
-    today_expenses = Expense.objects.filter(date=today).aggregate(
-        total=Sum('amount')
-    )['total'] or 0
+@login_required
+def day_invoices_view(request):
+    """All of one day's invoices on one page (or one text file) for end-of-day printing."""
+    try:
+        day = parse_date(request.GET.get('day') or '') or timezone.localdate()
+    except ValueError:  # well-formed but impossible, e.g. 2024-02-30
+        return HttpResponseBadRequest("day must be a real date (YYYY-MM-DD)")
+    fmt = request.GET.get('format', 'html')
+    if fmt not in FORMATS:
+        return HttpResponseBadRequest("Unknown format.")
+    invoices = render_day(day, fmt)
+    if fmt == 'text':
+        response = HttpResponse('\n\n'.join(text for _, text in invoices), content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = f'inline; filename="invoices-{day.isoformat()}.txt"'
+        return response
+    return render(request, 'mims/day_invoices.html', {'day': day, 'receipts': [html for _, html in invoices]})
 
-    context = {
-        'sale': sale,
-        'sale_items': sale_items,
-        'today_total': today_total,
-        'today_expenses': today_expenses,
-    }
-    return render(request, 'mims/view_sale.html', context)
+def _stock_edited(submitted, shown):
+    """Whether the edit form's box count differs from the one it was rendered with."""
+    if shown is None:
+        return True
+    try:
+        return Decimal(submitted or 0) != Decimal(shown or 0)
+    except InvalidOperation:
+        return True
 
 @login_required
 def edit_product_view(request, product_id):
@@ -424,57 +422,253 @@ def edit_product_view(request, product_id):
         try:
             product.name = request.POST.get('name')
             product.category_id = request.POST.get('category')
-            product.stock_qty = float(request.POST.get('stock_qty', 0))
             product.bulk_unit = request.POST.get('bulk_unit')
             product.base_unit = request.POST.get('base_unit')
             product.conversion_factor = int(request.POST.get('conversion_factor', 1))
             product.buy_price_per_bulk = Decimal(request.POST.get('buy_price', 0))
             product.sell_price_per_base = Decimal(request.POST.get('sell_price', 0))
-            
-            expiry_raw = request.POST.get('expiry_date')
-            product.expiry_date = parse_smart_date(expiry_raw)
-            
-            product.save()
+            fields = ['name', 'category', 'bulk_unit', 'base_unit', 'conversion_factor',
+                      'buy_price_per_bulk', 'sell_price_per_base']
+
+            # The box count on the form is rounded, so saving it back unchanged would
+            # move stock by up to half a box; only a count the user typed is applied
+            stock_edited = _stock_edited(request.POST.get('stock_qty'), request.POST.get('stock_qty_shown'))
+            if stock_edited:
+                product.stock_base = Product.base_units(request.POST.get('stock_qty', 0), product.conversion_factor)
+                fields.append('stock_base')
+
+            # Expiry lives on the lots; the recount files it against the right one
+            expiry = parse_smart_date(request.POST.get('expiry_date'))
+            with transaction.atomic():
+                product.save(update_fields=fields)
+                if stock_edited or (expiry and expiry != product.expiry_date):
+                    StockLot.recount(product, expiry)
             messages.success(request, f"Updated {product.name} successfully.")
             return redirect('inventory')
         except Exception as e:
             messages.error(request, f"Update failed: {str(e)}")
             
     return render(request, 'mims/edit_product.html', {'product': product, 'categories': categories})
+LOANS_PAGE_SIZE = 25
+
 @login_required
 def loans_list_view(request):
-    """Displays only sales with outstanding balances."""
-    loans = Sale.objects.filter(
-        total_amount__gt=F('amount_paid')
-    ).order_by('-sale_date')
-
-    total_outstanding = 0
-    for loan in loans:
-        total_outstanding += (loan.total_amount - loan.amount_paid)
+    """Displays only sales with outstanding balances, optionally for one customer."""
+    loans = Sale.objects.filter(Sale.outstanding_q())
+    customer = None
+    if request.GET.get('customer'):
+        customer = Customer.objects.filter(name_key=customer_key(request.GET['customer'])).first()
+        loans = loans.filter(customer=customer)
+    totals = loans.aggregate(count=Count('pk'), outstanding=Sum('balance_due'))
+
+    paginator = Paginator(loans.order_by('-sale_date', '-pk'), LOANS_PAGE_SIZE)
+    paginator.count = totals['count']  # already counted above; saves Paginator's own COUNT
+    page_obj = paginator.get_page(request.GET.get('page'))
 
     context = {
-        'loans': loans,
-        'total_outstanding': total_outstanding,
+        'loans': page_obj,
+        'page_obj': page_obj,
+        'total_outstanding': totals['outstanding'] or Decimal(0),
+        'customer': customer,
+        'customer_query': request.GET.get('customer', ''),
+        # Read off the partial index on Customer.balance
+        'top_debtors': Customer.objects.filter(balance__gt=0).order_by('-balance')[:5],
     }
     return render(request, 'mims/loans_list.html', context)
 
+
+def _phone_fragment(query):
+    """
+    A typed phone number (or part of one) in the form phone_key stores:
+    a full number keeps its last 9 digits, a partial one loses its trunk
+    '0' or '+255' prefix, so '0712', '+255 712' and '712' all search '712'.
+    """
+    digits = re.sub(r'\D', '', query)
+    if len(digits) >= 9:
+        return phone_key(digits)
+    if query.lstrip().startswith('+') and digits.startswith('255'):
+        digits = digits[3:]
+    return digits.lstrip('0')
+
+@login_required
+def customer_search(request):
+    """Customer autocomplete with each match's running balance (no Sale aggregation)."""
+    query = request.GET.get('q', '')
+    key = customer_key(query)
+    if not key:
+        return JsonResponse({'results': []})
+    digits = _phone_fragment(query)
+    if len(digits) >= 3 and key.replace(' ', '').isdigit():
+        customers = Customer.objects.filter(phone_key__contains=digits)
+    else:
+        # Range instead of LIKE so SQLite can walk the unique index on name_key
+        customers = Customer.objects.filter(name_key__gte=key, name_key__lt=key + '\x7f')
+    results = [{
+        'id': c.pk,
+        'name': c.name,
+        'phone': c.phone,
+        'balance': str(c.balance),
+    } for c in customers.order_by('name_key')[:15]]
+    return JsonResponse({'results': results})
+
+@login_required
+def export_view(request, name):
+    """
+    Streams one of the EXPORTS as CSV (default) or XLSX, optionally limited
+    to ?from=YYYY-MM-DD&to=YYYY-MM-DD. Rows go out as they are read.
+    """
+    if name not in EXPORTS:
+        raise Http404("Unknown export")
+    try:
+        date_from = parse_date(request.GET.get('from') or '')
+        date_to = parse_date(request.GET.get('to') or '')
+    except ValueError:  # well-formed but impossible, e.g. 2024-02-30
+        return HttpResponseBadRequest("from and to must be real dates (YYYY-MM-DD)")
+    header, rows = export_rows(name, date_from, date_to)
+    stamp = timezone.localdate().isoformat()
+
+    if request.GET.get('format') == 'xlsx':
+        try:
+            output = write_xlsx(header, rows)
+        except ImportError:
+            return HttpResponseBadRequest("XLSX export needs openpyxl: pip install openpyxl")
+        return FileResponse(
+            output, as_attachment=True, filename=f"{name}_{stamp}.xlsx",
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        )
+
+    response = StreamingHttpResponse(stream_csv(header, rows), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{name}_{stamp}.csv"'
+    return response
+
+@login_required
+def financial_report_view(request):
+    """
+    JSON report for any ?start=&end= (YYYY-MM-DD, default: this month so far)
+    in ?bucket=day|week|month rows, plus the totals over the whole range.
+    """
+    today = timezone.localdate()
+    try:
+        start = parse_date(request.GET.get('start') or '') or today.replace(day=1)
+        end = parse_date(request.GET.get('end') or '') or today
+    except ValueError:  # well-formed but impossible, e.g. 2024-02-30
+        return HttpResponseBadRequest("start and end must be real dates (YYYY-MM-DD)")
+    bucket = request.GET.get('bucket', 'day')
+    if bucket not in BUCKETS:
+        return HttpResponseBadRequest("bucket must be one of: " + ", ".join(BUCKETS))
+    if max(start, end) > LAST_REPORT_DAY:
+        return HttpResponseBadRequest(f"dates must be on or before {LAST_REPORT_DAY.isoformat()}")
+    if bucket_count(start, end, bucket) > MAX_BUCKETS:
+        return HttpResponseBadRequest(f"a report spans at most {MAX_BUCKETS} {bucket} buckets; use a larger bucket")
+    rows = financial_report(start, end, bucket)
+    return JsonResponse({'bucket': bucket, 'rows': rows, 'totals': report_totals(rows)})
+
+BARCODE_FIELDS = (
+    'id', 'barcode', 'name', 'category_id', 'bulk_unit', 'base_unit',
+    'conversion_factor', 'buy_price_per_bulk', 'sell_price_per_base',
+)
+
+
+def _barcode_payload(row):
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'category': row['category_id'] or '',
+        'bulk_unit': row['bulk_unit'],
+        'base_unit': row['base_unit'],
+        'conv': row['conversion_factor'],
+        'buy': str(row['buy_price_per_bulk']),
+        'sell': str(row['sell_price_per_base']),
+    }
+
+
+def resolve_barcodes(barcodes):
+    """
+    Maps each barcode to its lookup payload (None when unknown). Cached
+    codes, including known misses, are served from barcode_cache; the rest
+    are fetched together in one query with no join to Category.
+    """
+    found = {}
+    missing = []
+    for code in barcodes:
+        payload = barcode_cache.get(code)
+        if payload is MISSING:
+            missing.append(code)
+        else:
+            found[code] = payload
+    if missing:
+        rows = {row['barcode']: row for row in Product.objects.filter(barcode__in=missing).values(*BARCODE_FIELDS)}
+        for code in missing:
+            payload = _barcode_payload(rows[code]) if code in rows else None
+            barcode_cache.set(code, payload)
+            found[code] = payload
+    return found
+
+
 @login_required
 def barcode_lookup(request):
-    barcode = request.GET.get('barcode')
-    # Look for the product and return its details as a dictionary
-    product = Product.objects.filter(barcode=barcode).first()
-    
-    if product:
-        return JsonResponse({
-            'status': 'success',
-            'data': {
-                'name': product.name,
-                'category': product.category.id if product.category else '',
-                'bulk_unit': product.bulk_unit,
-                'base_unit': product.base_unit,
-                'conv': product.conversion_factor,
-                'buy': str(product.buy_price_per_bulk),
-                'sell': str(product.sell_price_per_base),
-            }
-        })
-    return JsonResponse({'status': 'not_found'})
\ No newline at end of file
+    """
+    ?barcode=X returns one product; ?barcode=a&barcode=b... resolves a
+    whole scanned tote in one round trip. Responses carry an ETag so a
+    repeat scan of an unchanged product is answered with a 304.
+    """
+    barcodes = [code for code in request.GET.getlist('barcode') if code]
+    found = resolve_barcodes(barcodes)
+
+    if len(barcodes) > 1:
+        body = {'status': 'success', 'results': {code: found[code] for code in barcodes}}
+    elif barcodes and found[barcodes[0]] is not None:
+        body = {'status': 'success', 'data': found[barcodes[0]]}
+    else:
+        body = {'status': 'not_found'}
+
+    content = json.dumps(body, cls=DjangoJSONEncoder)
+    etag = quote_etag(hashlib.md5(content.encode()).hexdigest())
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    # Products can be edited at any time, so clients must revalidate each scan
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+@login_required
+def product_search(request):
+    """Autocomplete for the sale form, served from the in-memory product index."""
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 15)), 50))
+    except ValueError:
+        limit = 15
+    pks = product_index.search(request.GET.get('q', ''), limit=limit)
+
+    rows = Product.objects.filter(pk__in=pks).only(
+        'name', 'barcode', 'sell_price_per_base', 'stock_base', 'conversion_factor',
+        'category_id', 'bulk_unit', 'base_unit',
+    ).in_bulk()
+    results = [{
+        'id': p.pk,
+        'name': p.name,
+        'barcode': p.barcode or '',
+        'price': str(p.sell_price_per_base),
+        'stock': str(p.stock_boxes),
+        'category': p.category_id,
+        'bulk_unit': p.bulk_unit,
+        'base_unit': p.base_unit,
+        'conv': p.conversion_factor,
+    } for p in (rows.get(pk) for pk in pks) if p is not None]
+    return JsonResponse({'results': results})
+
+
+@staff_member_required
+def performance_view(request):
+    """Per-view latency percentiles and SQL counts from RequestStatsMiddleware."""
+    if request.method == 'POST':
+        request_stats.clear()
+        messages.success(request, "Request statistics cleared.")
+        return redirect('performance')
+    return render(request, 'mims/performance.html', {
+        'views': request_stats.summary(),
+        'worst': request_stats.worst(),
+        'slow_ms': getattr(settings, 'MIMS_SLOW_REQUEST_MS', 500),
+    })